@@ -0,0 +1,274 @@
+"""
+Aggregations behind the dashboard's KPI cards and charts.
+
+Every KPI and chart in update_dashboard is a row count or a sum of
+NUMBER_OF_PERSONS_INJURED / NUMBER_OF_PERSONS_KILLED grouped by one or two of
+the filter dimensions (crosstab() covers the two-dimension case).
+summarize() computes all of them from raw rows or from a slice of
+AggregateCube, which holds those measures pre-grouped by every filter
+dimension, so most views never touch the raw rows. When persons are kept
+apart from their crashes (star.py), with_persons() adds the person-level
+tables to a summary of the crash rows.
+"""
+import numpy as np
+import pandas as pd
+
+from filters import INDEXED_COLUMNS, value_mask
+
+DIMENSIONS = INDEXED_COLUMNS
+
+MEASURES = ['NUMBER_OF_PERSONS_INJURED', 'NUMBER_OF_PERSONS_KILLED']
+
+# Dimensions with their own chart (or KPI) in update_dashboard
+CHART_DIMENSIONS = [
+    'BOROUGH',
+    'YEAR',
+    'PERSON_TYPE',
+    'CONTRIBUTING_FACTOR_VEHICLE_1',
+    'VEHICLE_TYPE_CODE_1'
+]
+
+# Dimensions of the person table, counted per person rather than per crash
+PERSON_DIMENSIONS = ['PERSON_TYPE', 'PERSON_SEX', 'PERSON_INJURY']
+
+
+def _dimension_codes(column):
+    """Integer codes (-1 for missing) and the labels they index"""
+    if column.dtype.name == 'category':
+        return column.cat.codes.to_numpy().astype(np.int64), column.cat.categories
+    # YEAR: whole numbers, offset from the smallest so codes stay dense
+    values = column.to_numpy()
+    if values.dtype.kind != 'f':
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.int64), pd.Index([], dtype=values.dtype)
+        low = values.min()
+        high = values.max()
+        codes = values.astype(np.int64) - int(low)
+    else:
+        valid = ~np.isnan(values)
+        if not valid.any():
+            return np.full(len(values), -1, dtype=np.int64), pd.Index([], dtype=values.dtype)
+        low = values[valid].min()
+        high = values[valid].max()
+        codes = np.where(valid, values - low, -1).astype(np.int64)
+    return codes, pd.Index(np.arange(low, high + 1).astype(values.dtype))
+
+
+def _sparse_weights(values):
+    """Positions and values of the non-zero entries of a weight column"""
+    positions = np.flatnonzero(values)
+    return positions, values[positions].astype(np.float64)
+
+
+def _weights(frame, measures):
+    """
+    'rows' plus the measure columns as bincount weights.
+
+    Raw rows count one each ('rows' is None); cube rows carry their group
+    size. Measures are mostly zero, so only their non-zero rows are kept.
+    """
+    weights = {measure: _sparse_weights(frame[measure].to_numpy()) for measure in measures}
+    weights['rows'] = _sparse_weights(frame['rows'].to_numpy()) if 'rows' in frame.columns else None
+    return weights
+
+
+def _bincount(slots, n_slots, weight):
+    if weight is None:
+        return np.bincount(slots, minlength=n_slots)
+    positions, values = weight
+    return np.bincount(slots[positions], weights=values, minlength=n_slots)
+
+
+def _bincount_sums(codes, labels, weights):
+    """
+    rows plus the measure sums per label, one bincount each over the codes.
+
+    Codes are shifted by one so missing values (-1) land in a slot that is
+    dropped afterwards; labels without rows are dropped too, like groupby.
+    """
+    slots = codes + 1
+    n_slots = len(labels) + 1
+    table = pd.DataFrame(
+        {name: _bincount(slots, n_slots, weight)[1:] for name, weight in weights.items()},
+        index=labels
+    ).round().astype('int64')
+    return table[table['rows'] > 0]
+
+
+def _crosstab(frame, row_dim, col_dim, weights):
+    row_codes, row_labels = _dimension_codes(frame[row_dim])
+    col_codes, col_labels = _dimension_codes(frame[col_dim])
+    shape = (len(row_labels), len(col_labels))
+    # One code per (row, column) pair; a missing half makes the pair missing
+    slots = np.where((row_codes < 0) | (col_codes < 0), -1, row_codes * shape[1] + col_codes) + 1
+    n_slots = shape[0] * shape[1] + 1
+    return {
+        name: pd.DataFrame(
+            _bincount(slots, n_slots, weight)[1:].reshape(shape).round().astype('int64'),
+            index=row_labels.rename(row_dim),
+            columns=col_labels.rename(col_dim)
+        )
+        for name, weight in weights.items()
+    }
+
+
+def crosstab(frame, row_dim, col_dim, measures=MEASURES):
+    """
+    Two-dimension breakdown of raw rows or a cube slice, e.g. PERSON_SEX x
+    PERSON_INJURY or BOROUGH x YEAR.
+
+    Returns {'rows': matrix, measure: matrix, ...}: one DataFrame per table,
+    indexed by the row dimension's values with the column dimension's values
+    as columns, zero where a pair has no rows. Each table is a single
+    bincount over the combined codes; pass measures=() for counts only.
+    """
+    return _crosstab(frame, row_dim, col_dim, _weights(frame, measures))
+
+
+def summarize(frame):
+    """
+    Everything the KPI cards and charts need, as a dict:
+
+    rows / injured / killed   totals for the KPI cards
+    by[dim]                   rows and measure sums per value of each chart dimension
+    sex_injury                crosstab() of PERSON_SEX x PERSON_INJURY
+
+    Works on raw rows or on a cube slice (whose 'rows' column is a weight).
+    Weights may be fractional, as in a scaled sample (sampling.py); sums are
+    rounded to whole counts.
+    Each dimension is read once as integer codes and every table comes from
+    np.bincount over them; nothing is hashed or sorted per chart.
+    """
+    # Non-zero positions of each measure are found once and shared by every table
+    weights = _weights(frame, MEASURES)
+
+    summary = {
+        'rows': int(round(weights['rows'][1].sum())) if weights['rows'] is not None else len(frame),
+        'injured': int(round(weights['NUMBER_OF_PERSONS_INJURED'][1].sum())),
+        'killed': int(round(weights['NUMBER_OF_PERSONS_KILLED'][1].sum())),
+        'by': {},
+        'sex_injury': None
+    }
+    for dim in CHART_DIMENSIONS:
+        if dim in frame.columns:
+            codes, labels = _dimension_codes(frame[dim])
+            summary['by'][dim] = _bincount_sums(codes, labels.rename(dim), weights)
+    if 'PERSON_SEX' in frame.columns and 'PERSON_INJURY' in frame.columns:
+        summary['sex_injury'] = _crosstab(frame, 'PERSON_SEX', 'PERSON_INJURY', weights)
+    return summary
+
+
+def with_persons(summary, persons):
+    """
+    A crash-level summary completed with the person tables of persons, a
+    summary() of the matching person rows (star.py): PERSON_TYPE and the
+    sex_injury crosstab count people, everything else counts crashes.
+    """
+    summary['by'].update({dim: table for dim, table in persons['by'].items() if dim in PERSON_DIMENSIONS})
+    summary['sex_injury'] = persons['sex_injury']
+    return summary
+
+
+def counts_by(summary, dim):
+    """Row counts per value of a chart dimension, largest first"""
+    return summary['by'][dim]['rows'].sort_values(ascending=False)
+
+
+def gender_outcomes(summary):
+    """
+    Uninjured / Injured / Killed per gender for the comparison chart.
+
+    Counts come from PERSON_INJURY; when a gender has no explicit INJURED or
+    KILLED rows, the crash-level NUMBER_OF_PERSONS_* sums stand in, and
+    Uninjured falls back to the remainder.
+    """
+    genders = pd.Index(['F', 'M'])
+    outcomes = ['UNINJURED', 'INJURED', 'KILLED']
+    table = summary['sex_injury']
+    if table is None:
+        counts = pd.DataFrame(0, index=genders, columns=outcomes)
+        total = injured_sum = killed_sum = pd.Series(0, index=genders)
+    else:
+        counts = table['rows'].reindex(index=genders, columns=outcomes, fill_value=0)
+        total = table['rows'].sum(axis=1).reindex(genders, fill_value=0)
+        injured_sum = table['NUMBER_OF_PERSONS_INJURED'].sum(axis=1).reindex(genders, fill_value=0)
+        killed_sum = table['NUMBER_OF_PERSONS_KILLED'].sum(axis=1).reindex(genders, fill_value=0)
+
+    injured = counts['INJURED'].where(counts['INJURED'] > 0, injured_sum)
+    killed = counts['KILLED'].where(counts['KILLED'] > 0, killed_sum)
+    remainder = (total - injured - killed).clip(lower=0)
+    uninjured = counts['UNINJURED'].where(counts['UNINJURED'] > 0, remainder)
+
+    return {
+        label: {'Uninjured': int(uninjured[code]), 'Injured': int(injured[code]), 'Killed': int(killed[code])}
+        for code, label in [('F', 'Female'), ('M', 'Male')]
+    }
+
+
+class AggregateCube:
+    """
+    Row count and injured/killed sums per combination of the filter dimensions.
+
+    Built once at load. The cube has at most one row per distinct combination
+    of the seven dimensions, so slicing it with the dropdown filters and
+    passing the slice to summarize() gives the same answers as the raw rows at
+    a fraction of the work.
+    """
+
+    def __init__(self, df, dimensions=DIMENSIONS):
+        self.dimensions = [d for d in dimensions if d in df.columns]
+        self.cube = self._build(df)
+
+    def _build(self, df):
+        codes = []
+        labels = []
+        for dim in self.dimensions:
+            if df[dim].dtype.name == 'category':
+                dim_codes = df[dim].cat.codes.to_numpy()
+                dim_labels = df[dim].cat.categories
+            else:
+                dim_codes, dim_labels = pd.factorize(df[dim])
+            # Shift so missing values (-1) get their own slot at 0
+            codes.append(dim_codes.astype(np.int64) + 1)
+            labels.append(dim_labels)
+
+        shape = [len(dim_labels) + 1 for dim_labels in labels]
+        keys = np.ravel_multi_index(codes, shape)
+        group, unique_keys = pd.factorize(keys, sort=True)
+        n_groups = len(unique_keys)
+
+        cube = {}
+        for dim, dim_codes, dim_labels in zip(self.dimensions, np.unravel_index(unique_keys, shape), labels):
+            dim_codes = dim_codes - 1
+            if df[dim].dtype.name == 'category':
+                cube[dim] = pd.Categorical.from_codes(dim_codes, categories=dim_labels)
+            else:
+                values = np.asarray(dim_labels)[np.maximum(dim_codes, 0)]
+                if (dim_codes < 0).any():
+                    values = values.astype('float32')
+                    values[dim_codes < 0] = np.nan
+                cube[dim] = values
+        cube['rows'] = np.bincount(group, minlength=n_groups).astype(np.int64)
+        for measure in MEASURES:
+            cube[measure] = np.bincount(group, weights=df[measure].to_numpy(), minlength=n_groups).astype(np.int64)
+        return pd.DataFrame(cube)
+
+    def __len__(self):
+        return len(self.cube)
+
+    @property
+    def nbytes(self):
+        return int(self.cube.memory_usage(deep=True).sum())
+
+    def slice(self, filters):
+        """Cube rows matching {column: [values]}; empty value lists are ignored"""
+        mask = np.ones(len(self.cube), dtype=bool)
+        for dim, values in filters.items():
+            if not values or dim not in self.dimensions:
+                continue
+            column = self.cube[dim]
+            if column.dtype.name == 'category':
+                mask &= value_mask(column, values)
+            else:
+                mask &= column.isin([int(v) for v in values]).to_numpy()
+        return self.cube[mask]
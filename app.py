@@ -1,191 +1,383 @@
 import dash
-from dash import dcc, html, Input, Output, callback
+from dash import dcc, html, Input, Output, Patch, callback
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
 import dash_bootstrap_components as dbc
 from datetime import datetime
-import re
+import threading
+import time
+from collections import OrderedDict
+
+import os
+from urllib.parse import urlencode
+
+import flask
+
+from aggregation import DIMENSIONS, MEASURES, PERSON_DIMENSIONS, AggregateCube, counts_by, gender_outcomes, summarize, with_persons
+from data_store import DASHBOARD_MANIFEST, dataset_version, load_dataset, memory_report, resolve_dataset_path
+from cache import make_result_cache
+from catalog import column_values, load_catalog, missing_search_targets, value_count
+from export import EXPORT_FORMATS, stream_export
+from filters import INDEXED_COLUMNS, BitmapIndex, compile_search_query, plan_filters, plan_state
+import metrics
+from metrics import Counter, Gauge, debug, describe_stages, log, span
+from parallel import ChunkedAggregator, min_rows_from_env, start_pool, workers_from_env
+from partitions import PartitionMap
+from sampling import StratifiedSample, sample_rows_from_env
+from spatial import MAP_WEIGHTS, SpatialGrid, viewport_bounds
+from star import CrashIndex, CrashTables, is_person_column
+from startup import BackgroundLoader, FAILED, LOADING
 
 # Initialize the Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 server = app.server
 
-# Load data once at startup (not in callback)
-print("Loading data...")
-try:
-    # Load the STANDARDIZED dataset instead of merged
-    df_global = pd.read_csv('cleaned_merged_standardized_data.csv', low_memory=False)
-    print(f"Standardized data loaded successfully. Shape: {df_global.shape}")
-    
-    # Data preparation
-   # Data preparation
-    df_global['CRASH_DATE_CRASH'] = pd.to_datetime(df_global['CRASH_DATE_CRASH'], errors='coerce')
-    df_global['YEAR'] = df_global['CRASH_DATE_CRASH'].dt.year
-    
-    # Convert to string and handle NaN - standardized values should already be consistent
-    # The standardized dataset already has cleaned categorical values
-    df_global['BOROUGH'] = df_global['BOROUGH'].astype(str).replace('nan', 'Unknown')
-    df_global['VEHICLE_TYPE_CODE_1'] = df_global['VEHICLE_TYPE_CODE_1'].astype(str).replace('nan', 'Unknown')
-    df_global['CONTRIBUTING_FACTOR_VEHICLE_1'] = df_global['CONTRIBUTING_FACTOR_VEHICLE_1'].astype(str).replace('nan', 'Unknown')
-    df_global['PERSON_TYPE'] = df_global['PERSON_TYPE'].astype(str).replace('nan', 'Unknown')
-    
-    # CRITICAL FIX #1: Properly handle PERSON_SEX standardization
-    # The standardized dataset should have M/F values, but let's ensure consistency
-    df_global['PERSON_SEX'] = df_global['PERSON_SEX'].astype(str).str.upper().str.strip()
-    df_global['PERSON_SEX'] = df_global['PERSON_SEX'].replace({
-        'MALE': 'M',
-        'FEMALE': 'F',
-        'NAN': 'Unknown',
-        'UNKNOWN': 'Unknown',
-        'U': 'Unknown'
-    })
-    
-    df_global['PERSON_INJURY'] = df_global['PERSON_INJURY'].astype(str).replace('nan', 'Unknown')
-    
-    # Ensure numeric columns are properly typed
-    df_global['NUMBER_OF_PERSONS_INJURED'] = pd.to_numeric(df_global['NUMBER_OF_PERSONS_INJURED'], errors='coerce').fillna(0)
-    df_global['NUMBER_OF_PERSONS_KILLED'] = pd.to_numeric(df_global['NUMBER_OF_PERSONS_KILLED'], errors='coerce').fillna(0)
-    
-    print("Column names:", df_global.columns.tolist())
-    print("Borough unique values:", df_global['BOROUGH'].unique()[:10])
-    print("Years available:", sorted(df_global['YEAR'].dropna().unique()))
-    print("Vehicle types (standardized):", df_global['VEHICLE_TYPE_CODE_1'].value_counts().head(10))
-    print("Person types (standardized):", df_global['PERSON_TYPE'].value_counts())
+# Placeholders until the background loader publishes the real data
+df_global = pd.DataFrame()
+filter_index = BitmapIndex(df_global)
+partition_map = None
+aggregate_cube = None
+# Set when crashes have several persons: the person table and its cube
+crash_tables = None
+person_cube = None
+spatial_grid = None
+# Set when CRASHLENS_AGGREGATE_WORKERS asks for a process pool (parallel.py)
+row_aggregator = None
+# Stratified sample behind the quick preview (sampling.py); None when disabled
+preview_sample = None
+result_cache = make_result_cache(None)
+dataset_catalog = None
+
+
+def load_data(loader):
+    """
+    Load the dataset and build everything derived from it, then publish it
+    all at once. Runs in the background loader's thread.
+    """
+    global df_global, filter_index, partition_map, aggregate_cube, crash_tables, person_cube, spatial_grid, row_aggregator
+    global preview_sample, result_cache, dataset_catalog
     
-    # CRITICAL FIX #2: Check gender distribution
-    print("\n=== GENDER DISTRIBUTION CHECK ===")
-    print(f"PERSON_SEX value counts:\n{df_global['PERSON_SEX'].value_counts()}")
-    print(f"Total records: {len(df_global)}")
-    print(f"Records with M: {len(df_global[df_global['PERSON_SEX'] == 'M'])}")
-    print(f"Records with F: {len(df_global[df_global['PERSON_SEX'] == 'F'])}")
-    print(f"Records with Unknown gender: {len(df_global[df_global['PERSON_SEX'] == 'Unknown'])}")
-    
-except Exception as e:
-    print(f"Error loading data: {e}")
-    import traceback
-    traceback.print_exc()
-    df_global = pd.DataFrame()
-
-# CRITICAL FIX #3: Enhanced search function with proper gender handling
-def parse_search_query(query, df):
-    """Parse natural language search queries"""
-    if not query or query.strip() == "":
-        return df
-    
-    query = query.lower().strip()
-    filtered_df = df.copy()
-    
-    print(f"Parsing search query: '{query}'")
-    print(f"Initial dataframe size: {len(filtered_df)}")
-    
-    # Borough detection - using standardized borough names
-    borough_mapping = {
-        'manhattan': 'MANHATTAN',
-        'brooklyn': 'BROOKLYN',
-        'queens': 'QUEENS',
-        'bronx': 'BRONX',
-        'staten island': 'STATEN ISLAND',
-        'staten': 'STATEN ISLAND'
-    }
+    # Typed Parquet copy when available, otherwise the standardized CSV.
+    # Only the columns the callbacks read are loaded; CRASHLENS_MEMORY_BUDGET_MB
+    # caps the frame by dropping optional columns (e.g. map coordinates)
+    loader.progress('reading data')
+    memory_budget = os.environ.get('CRASHLENS_MEMORY_BUDGET_MB')
+    load_start = time.perf_counter()
+    df = load_dataset(
+        manifest=DASHBOARD_MANIFEST,
+        memory_budget_mb=float(memory_budget) if memory_budget else None
+    )
+    log.info(f"Standardized data loaded successfully in {time.perf_counter() - load_start:.1f}s. Shape: {df.shape}")
     
-    for search_term, standard_borough in borough_mapping.items():
-        if search_term in query:
-            print(f"Filtering by borough: {standard_borough}")
-            filtered_df = filtered_df[filtered_df['BOROUGH'] == standard_borough]
-            print(f"After borough filter: {len(filtered_df)}")
-            break
-    
-    # CRITICAL FIX #4: Add gender detection to search query
-    gender_keywords = {
-        'male': 'M',
-        'man': 'M',
-        'men': 'M',
-        'female': 'F',
-        'woman': 'F',
-        'women': 'F'
-    }
+    debug(lambda: f"Column names: {df.columns.tolist()}")
+    report = memory_report(df)
+    log.info(f"Memory footprint: {report['mb'].sum():,.1f} MB\n{report}")
     
-    for keyword, gender_code in gender_keywords.items():
-        if keyword in query:
-            print(f"Filtering by gender keyword '{keyword}' -> '{gender_code}'")
-            filtered_df = filtered_df[filtered_df['PERSON_SEX'] == gender_code]
-            print(f"After gender filter: {len(filtered_df)}")
-            break  # Only apply first gender match
-    
-    # Year detection
-    year_match = re.findall(r'\b(20\d{2})\b', query)
-    if year_match:
-        year = int(year_match[0])
-        print(f"Filtering by year: {year}")
-        filtered_df = filtered_df[filtered_df['YEAR'] == year]
-        print(f"After year filter: {len(filtered_df)}")
-    
-    # Keywords for person types - using standardized values
-    if 'pedestrian' in query:
-        print("Filtering by pedestrian")
-        filtered_df = filtered_df[filtered_df['PERSON_TYPE'] == 'PEDESTRIAN']
-        print(f"After pedestrian filter: {len(filtered_df)}")
-    
-    if 'cyclist' in query or 'bicycle' in query or 'bike' in query:
-        print("Filtering by cyclist")
-        filtered_df = filtered_df[filtered_df['PERSON_TYPE'] == 'BICYCLIST']
-        print(f"After cyclist filter: {len(filtered_df)}")
-    
-    if 'driver' in query:
-        print("Filtering by driver")
-        filtered_df = filtered_df[filtered_df['PERSON_TYPE'] == 'DRIVER']
-        print(f"After driver filter: {len(filtered_df)}")
-    
-    if 'passenger' in query:
-        print("Filtering by passenger")
-        filtered_df = filtered_df[filtered_df['PERSON_TYPE'] == 'PASSENGER']
-        print(f"After passenger filter: {len(filtered_df)}")
-    
-    # Injury keywords - using standardized injury values
-    if 'injured' in query or 'injury' in query:
-        print("Filtering by injuries")
-        filtered_df = filtered_df[
-            (filtered_df['NUMBER_OF_PERSONS_INJURED'] > 0) | 
-            (filtered_df['PERSON_INJURY'] == 'INJURED')
-        ]
-        print(f"After injury filter: {len(filtered_df)}")
-    
-    if 'uninjured' in query:
-        print("Filtering by uninjured")
-        filtered_df = filtered_df[filtered_df['PERSON_INJURY'] == 'UNINJURED']
-        print(f"After uninjured filter: {len(filtered_df)}")
-    
-    if 'killed' in query or 'fatal' in query or 'death' in query:
-        print("Filtering by fatalities")
-        filtered_df = filtered_df[
-            (filtered_df['NUMBER_OF_PERSONS_KILLED'] > 0) | 
-            (filtered_df['PERSON_INJURY'] == 'KILLED')
-        ]
-        print(f"After fatality filter: {len(filtered_df)}")
-    
-    # Vehicle type keywords - using standardized values
-    vehicle_keywords = {
-        'taxi': 'TAXI',
-        'sedan': 'SEDAN',
-        'suv': 'SPORT UTILITY / STATION WAGON',
-        'truck': 'PICK-UP TRUCK',
-        'van': 'VAN',
-        'bus': 'BUS',
-        'motorcycle': 'MOTORCYCLE',
-        'bicycle': 'BICYCLE'
-    }
+    # One row per crash, persons in their own table linked by COLLISION_ID.
+    # With at most one person per crash the merged rows already are both
+    loader.progress('splitting crashes and persons')
+    split_start = time.perf_counter()
+    tables = CrashTables.from_merged(df)
+    if tables.one_to_one:
+        crashes, tables = df, None
+        log.info(f"One person per crash: {len(df):,} crash rows")
+    else:
+        crashes = tables.crashes
+        log.info(
+            f"Split into {len(tables.crashes):,} crashes and {len(tables.persons):,} persons "
+            f"in {time.perf_counter() - split_start:.2f}s ({tables.nbytes / 2**20:,.1f} MB)"
+        )
+    
+    loader.progress('building filter index')
+    index_start = time.perf_counter()
+    index = BitmapIndex(df) if tables is None else CrashIndex(tables)
+    log.info(f"Filter index built in {time.perf_counter() - index_start:.2f}s ({index.nbytes / 2**20:,.1f} MB)")
+    
+    # A YEAR x BOROUGH partitioned store lets the filters skip whole partitions
+    partitions = PartitionMap.load(resolve_dataset_path(), len(df))
+    if partitions is not None:
+        if tables is not None:
+            partitions = partitions.remap(tables.crash_positions)
+        log.info(f"Partition pruning on {partitions.columns}: {len(partitions)} partitions")
+    
+    loader.progress('building aggregate cube')
+    cube_start = time.perf_counter()
+    cube = AggregateCube(crashes)
+    log.info(f"Aggregate cube built in {time.perf_counter() - cube_start:.2f}s: {len(cube):,} groups ({cube.nbytes / 2**20:,.1f} MB)")
+    persons_cube = None
+    if tables is not None:
+        # Person charts count people: every filter dimension, one row per person
+        persons_cube = AggregateCube(tables.joined([d for d in DIMENSIONS if d in df.columns] + MEASURES))
+        log.info(f"Person cube built: {len(persons_cube):,} groups ({persons_cube.nbytes / 2**20:,.1f} MB)")
+    
+    # The map bins crashes per grid cell; coordinates may have been dropped by the memory budget
+    loader.progress('building spatial grid')
+    if 'LATITUDE' in crashes.columns and 'LONGITUDE' in crashes.columns:
+        grid_start = time.perf_counter()
+        grid = SpatialGrid(crashes)
+        log.info(f"Spatial grid built in {time.perf_counter() - grid_start:.2f}s: {grid.n_cells:,} cells")
+    else:
+        grid = None
+    
+    # Row summaries the cube cannot answer may be split over a process pool;
+    # persons kept apart from their crashes stay on the serial path
+    aggregator = None
+    if aggregation_pool is not None and tables is None:
+        loader.progress('sharing columns with aggregation workers')
+        aggregator = ChunkedAggregator(crashes, aggregation_pool, min_rows=min_rows_from_env())
+        log.info(
+            f"Aggregation pool: {workers_from_env()} workers over {aggregator.nbytes / 2**20:,.1f} MB of shared columns"
+        )
+    elif aggregation_pool is not None:
+        aggregation_pool.shutdown()
+    
+    # Quick previews estimate row-path reports from a BOROUGH x YEAR sample
+    sample = None
+    sample_rows = sample_rows_from_env()
+    if tables is None and 0 < sample_rows < len(crashes):
+        loader.progress('drawing preview sample')
+        sample = StratifiedSample(crashes, sample_rows)
+        log.info(f"Preview sample: {len(sample):,} rows in {len(sample.population)} borough x year strata")
+    
+    # Cached results are tied to this exact data file
+    loader.progress('opening result cache')
+    cache = make_result_cache(dataset_version())
+    log.info(f"Result cache: {cache.stats()}")
+    
+    # Distinct values and frequencies of the filter columns, saved per dataset
+    # version; the dropdowns and the diagnostics below read only this
+    loader.progress('reading catalog')
+    catalog = load_catalog(df)
+    debug(lambda: f"Borough unique values: {column_values(catalog, 'BOROUGH')[:10]}")
+    debug(lambda: f"Years available: {sorted(column_values(catalog, 'YEAR'))}")
+    debug(lambda: f"Vehicle types (standardized): {catalog['columns']['VEHICLE_TYPE_CODE_1'][:10]}")
+    debug(lambda: f"Person types (standardized): {catalog['columns']['PERSON_TYPE']}")
+    missing = missing_search_targets(catalog)
+    if missing:
+        log.warning(f"Search keywords that match no rows in this dataset: {missing}")
+    
+    # CRITICAL FIX #2: Check gender distribution
+    debug(lambda: (
+        "=== GENDER DISTRIBUTION CHECK ===\n"
+        f"PERSON_SEX value counts: {catalog['columns']['PERSON_SEX']}\n"
+        f"Total records: {catalog['rows']}\n"
+        f"Records with M: {value_count(catalog, 'PERSON_SEX', 'M')}\n"
+        f"Records with F: {value_count(catalog, 'PERSON_SEX', 'F')}\n"
+        f"Records with Unknown gender: {value_count(catalog, 'PERSON_SEX', 'Unknown')}"
+    ))
+    
+    df_global, filter_index, partition_map = crashes, index, partitions
+    aggregate_cube, crash_tables, person_cube = cube, tables, persons_cube
+    spatial_grid, result_cache, dataset_catalog = grid, cache, catalog
+    row_aggregator, preview_sample = aggregator, sample
+
+
+# The aggregation workers are forked here, before the loader's thread and the
+# server's request threads exist (see parallel.py); they map the data once it
+# is loaded
+aggregation_pool = start_pool(workers_from_env()) if workers_from_env() else None
+
+# Load data in the background so the server answers (and reports progress on
+# /healthz and /readyz) while the dataset is read and indexed
+log.info("Loading data...")
+# Optional steps are listed when configured, so progress stays within 0..1;
+# one load_data skips anyway (e.g. persons split from crashes) only leaves
+# progress short of 1 until the load finishes
+loader_steps = [
+    'reading data', 'splitting crashes and persons', 'building filter index', 'building aggregate cube',
+    'building spatial grid'
+]
+if aggregation_pool is not None:
+    loader_steps.append('sharing columns with aggregation workers')
+if sample_rows_from_env() > 0:
+    loader_steps.append('drawing preview sample')
+loader_steps += ['opening result cache', 'reading catalog']
+data_loader = BackgroundLoader(load_data, loader_steps).start()
+
+
+# Map layout shared by the report and the viewport updates. uirevision keeps
+# the user's pan/zoom across updates until the filters change
+def map_layout(fig, title, uirevision):
+    fig.update_layout(
+        title=title,
+        height=400,
+        mapbox_style="open-street-map",
+        mapbox=dict(center=dict(lat=40.7, lon=-74.0), zoom=10),
+        margin=dict(l=0, r=0, t=40, b=0),
+        uirevision=uirevision
+    )
+    return fig
+
+
+def density_title(cells, weight, title_suffix=""):
+    return f"{MAP_WEIGHTS[weight]} Density ({int(cells[weight].sum()):,} over {len(cells):,} grid cells){title_suffix}"
+
+
+def density_map(cells, weight, uirevision, title_suffix=""):
+    """
+    Density map of binned crashes (a table from SpatialGrid.density/viewport).
+    Every occupied cell is drawn, even at zero weight, so switching the
+    weight only has to replace z.
+    """
+    weight = weight if weight in cells.columns else 'rows'
+    weight_label = MAP_WEIGHTS[weight]
+    fig = go.Figure(go.Densitymapbox(
+        lat=cells['LATITUDE'],
+        lon=cells['LONGITUDE'],
+        z=cells[weight],
+        radius=12,
+        colorscale='YlOrRd',
+        colorbar=dict(title=weight_label),
+        customdata=cells[['rows', 'NUMBER_OF_PERSONS_INJURED', 'NUMBER_OF_PERSONS_KILLED']],
+        hovertemplate=(
+            "Crashes: %{customdata[0]:,}<br>"
+            "Injuries: %{customdata[1]:,}<br>"
+            "Fatalities: %{customdata[2]:,}<extra></extra>"
+        )
+    ))
+    return map_layout(fig, density_title(cells, weight, title_suffix), uirevision)
+
+
+# Hover details of individually drawn crashes, when loaded
+POINT_HOVER_COLUMNS = ['BOROUGH', 'VEHICLE_TYPE_CODE_1', 'ON_STREET_NAME', 'CROSS_STREET_NAME']
+
+
+def points_map(positions, uirevision):
+    """Individual crashes at the given rows of df_global"""
+    hover = [c for c in POINT_HOVER_COLUMNS if c in df_global.columns]
+    points = df_global[['LATITUDE', 'LONGITUDE'] + hover].take(positions)
+    fig = px.scatter_mapbox(
+        points,
+        lat="LATITUDE",
+        lon="LONGITUDE",
+        hover_data=hover,
+        color_discrete_sequence=["red"]
+    )
+    return map_layout(fig, f"Crash Locations ({len(points):,} crashes in view)", uirevision)
+
+@server.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving, whatever the data state"""
+    return data_loader.status()
+
+
+@server.route('/readyz')
+def readyz():
+    """Readiness: 200 once the data is loaded, 503 while loading or after a failure"""
+    status = data_loader.status()
+    return status, 200 if data_loader.ready else 503
+
+
+@server.route('/cache-stats')
+def cache_stats():
+    """Hit/miss counters and size of the dashboard result cache"""
+    return result_cache.stats()
+
+
+# Counters kept elsewhere, read when /metrics is scraped
+Counter('crashlens_cache_hits_total', "Result cache hits", collect=lambda: {(): result_cache.stats()['hits']})
+Counter('crashlens_cache_misses_total', "Result cache misses", collect=lambda: {(): result_cache.stats()['misses']})
+Gauge('crashlens_cache_entries', "Entries in the result cache", collect=lambda: {(): result_cache.stats()['entries']})
+Gauge('crashlens_cache_bytes', "Serialized size of the result cache", collect=lambda: {(): result_cache.stats()['bytes']})
+Gauge('crashlens_data_ready', "1 once the data is loaded", collect=lambda: {(): int(data_loader.ready)})
+Gauge('crashlens_data_rows', "Rows (crashes) being served", collect=lambda: {(): len(df_global)})
+RESOLVED_REPORTS = Counter(
+    'crashlens_resolved_reports_total', "Report handles resolved, from this process's resolved reports or afresh",
+    ['result']
+)
+
+
+@server.route('/metrics')
+def prometheus_metrics():
+    """Stage and request latency histograms plus cache counters, in the Prometheus text format"""
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Every request is timed; callback requests are labelled with their first
+# output and log where their time went at DEBUG. The stages also go back in a
+# Server-Timing header, shown per request in the browser's network panel
+@server.before_request
+def start_request_timing():
+    metrics.begin_request()
+
+
+@server.after_request
+def finish_request_timing(response):
+    rule = flask.request.url_rule
+    callback_name = ''
+    if flask.request.path.endswith('/_dash-update-component'):
+        body = flask.request.get_json(silent=True) or {}
+        callback_name = body.get('output', '').strip('.').split('.')[0]
+    stages = metrics.end_request(rule.rule if rule else 'unmatched', callback_name)
+    if callback_name:
+        debug(lambda: f"Callback {callback_name}: {describe_stages(stages)}")
+    response.headers['Server-Timing'] = metrics.server_timing(stages)
+    return response
+
+
+@server.route('/export')
+def export_rows():
+    """
+    Stream the rows matching a filter spec as gzip CSV or Parquet, a chunk
+    at a time. Query parameters: search, the filter columns of the dashboard
+    (repeatable, e.g. BOROUGH=BROOKLYN&BOROUGH=QUEENS&YEAR=2022), format
+    (csv or parquet), columns (comma-separated, default all) and limit.
     
-    for keyword, standard_vehicle in vehicle_keywords.items():
-        if keyword in query:
-            print(f"Filtering by vehicle type: {standard_vehicle}")
-            filtered_df = filtered_df[filtered_df['VEHICLE_TYPE_CODE_1'] == standard_vehicle]
-            print(f"After vehicle filter: {len(filtered_df)}")
-            break
+    Rows are crashes. When crashes have several persons each and person
+    columns are asked for, rows are the matching persons of those crashes,
+    as in the merged table.
+    """
+    if not data_loader.ready:
+        return {'error': "Data is not loaded", 'status': data_loader.status()}, 503
+    args = flask.request.args
+    fmt = args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return {'error': f"format must be one of {list(EXPORT_FORMATS)}"}, 400
+    available = list(df_global.columns) + ([] if crash_tables is None else list(crash_tables.persons.columns))
+    columns = [c for c in args.get('columns', '').split(',') if c] or list(df_global.columns)
+    unknown = [c for c in columns if c not in available]
+    if unknown:
+        return {'error': f"Unknown columns {unknown}", 'columns': available}, 400
+    try:
+        limit = int(args['limit']) if 'limit' in args else None
+        filters = {col: args.getlist(col) for col in INDEXED_COLUMNS}
+        filters['YEAR'] = [int(y) for y in filters['YEAR']]
+    except ValueError as e:
+        return {'error': f"Invalid limit or YEAR: {e}"}, 400
+    if limit is not None and limit < 0:
+        return {'error': "limit must not be negative"}, 400
     
-    print(f"Final filtered dataframe size: {len(filtered_df)}")
-    return filtered_df
+    with span('filter'):
+        plan = plan_filters(filters, compile_search_query(args.get('search')), filter_index)
+        log.debug("Export (%s, columns %s, limit %s): filter plan %s", fmt, columns, limit, plan['steps'])
+        ranges = partition_rows(plan)
+        selection = filter_index.select_plan(plan, ranges)
+    blocks = filter_index.iter_rows(selection, ranges=ranges)
+    if crash_tables is not None and any(is_person_column(c) for c in columns):
+        person_selection = filter_index.person_filter(plan)
+        blocks = (filter_index.person_rows(block, person_selection) for block in blocks)
+        rows = stream_export(None, blocks, columns, fmt, limit, gather=crash_tables.joined)
+    else:
+        rows = stream_export(df_global, blocks, columns, fmt, limit)
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return flask.Response(
+        flask.stream_with_context(rows),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="crashlens_export.{extension}"'}
+    )
+
+
+def export_href(report, fmt):
+    """/export URL for the filters of a report handle"""
+    params = [('format', fmt)]
+    if report is not None:
+        if report['search']:
+            params.append(('search', report['search']))
+        for col, values in report['filters'].items():
+            params.extend((col, value) for value in values or [])
+    return f"/export?{urlencode(params)}"
 
 # Layout components
 def create_filter_panel():
@@ -304,6 +496,13 @@ def create_filter_panel():
                 ])
             ]),
             
+            # Injured/killed searches come back estimated from a sample first
+            dbc.Row([
+                dbc.Col([
+                    dbc.Switch(id="preview-switch", label="Quick preview", value=False, className="mt-2")
+                ])
+            ]),
+            
             # Reset filters button
             dbc.Row([
                 dbc.Col([
@@ -315,10 +514,34 @@ def create_filter_panel():
                         className="w-100 mt-2"
                     )
                 ])
+            ]),
+            
+            # Export the rows of the generated report
+            dbc.Row([
+                dbc.Col([
+                    dbc.ButtonGroup([
+                        dbc.Button("Export CSV", id="export-csv", href=export_href(None, 'csv'),
+                                   external_link=True, color="link", size="sm"),
+                        dbc.Button("Export Parquet", id="export-parquet", href=export_href(None, 'parquet'),
+                                   external_link=True, color="link", size="sm")
+                    ], className="w-100 mt-2")
+                ])
             ])
         ])
     ])
 
+def create_load_banner():
+    """Loading progress (or the load error), hidden once the data is ready"""
+    return html.Div([
+        dbc.Alert([
+            html.Div(id="load-message"),
+            dbc.Progress(id="load-progress", value=0, striped=True, animated=True, className="mt-2")
+        ], id="load-status", color="info", is_open=True),
+        dcc.Interval(id="load-poll", interval=1000),
+        # Set once the data is loaded; populates the dropdowns and the first report
+        dcc.Store(id="data-ready")
+    ])
+
 def create_kpi_cards():
     """Create KPI summary cards"""
     return dbc.Row([
@@ -375,7 +598,8 @@ app.layout = dbc.Container([
         
         # Charts area
         dbc.Col([
-            # KPI cards
+            # Loading banner, then KPI cards
+            create_load_banner(),
             create_kpi_cards(),
             
             # First row of charts
@@ -411,13 +635,43 @@ app.layout = dbc.Container([
             # Fourth row - Map
             dbc.Row([
                 dbc.Col([
-                    dcc.Graph(id="crash-map")
+                    dbc.RadioItems(
+                        id="map-weight",
+                        options=[{'label': label, 'value': weight} for weight, label in MAP_WEIGHTS.items()],
+                        value='rows',
+                        inline=True
+                    ),
+                    dcc.Graph(id="crash-map"),
+                    # Handle of the last generated report, shared by every output callback
+                    dcc.Store(id="report-filters"),
+                    # What the map currently draws, so weight changes can be patched
+                    dcc.Store(id="map-view")
                 ], width=12)
             ])
         ], width=9)
     ])
 ], fluid=True)
 
+# Poll the background loader until the data is ready (or failed)
+@callback(
+    [Output('load-message', 'children'),
+     Output('load-progress', 'value'),
+     Output('load-status', 'color'),
+     Output('load-status', 'is_open'),
+     Output('load-poll', 'disabled'),
+     Output('data-ready', 'data')],
+    Input('load-poll', 'n_intervals')
+)
+def update_load_status(n_intervals):
+    status = data_loader.status()
+    if status['state'] == FAILED:
+        return f"Data failed to load: {status['error']}", 100, "danger", True, True, dash.no_update
+    if not data_loader.ready:
+        message = f"Loading data: {status['step'] or 'starting'}... ({status['elapsed']:.0f}s)"
+        return message, status['progress'] * 100, "info", True, False, dash.no_update
+    return "", 100, "info", False, True, True
+
+
 # Callback to populate dropdown options
 @callback(
     [Output('borough-dropdown', 'options'),
@@ -427,62 +681,64 @@ app.layout = dbc.Container([
      Output('gender-dropdown', 'options'),
      Output('contributing-factor-dropdown', 'options'),
      Output('injury-type-dropdown', 'options')],
-    Input('borough-dropdown', 'id')
+    Input('data-ready', 'data')
 )
-def update_dropdown_options(_):
+def update_dropdown_options(ready):
+    if not data_loader.ready:
+        raise dash.exceptions.PreventUpdate
     if df_global.empty:
         return [], [], [], [], [], [], []
     
-    print("Updating dropdown options from standardized dataset...")
+    # Everything comes from the catalog; no column is scanned per page load
+    log.debug("Updating dropdown options from the dataset catalog...")
     
     # Borough options - standardized values
-    boroughs = df_global['BOROUGH'].unique()
+    boroughs = column_values(dataset_catalog, 'BOROUGH')
     boroughs = [b for b in boroughs if str(b) not in ['Unknown', 'UNKNOWN', 'None', '', 'nan']]
     borough_options = [{'label': str(b), 'value': str(b)} for b in sorted(boroughs)]
-    print(f"Borough options: {len(borough_options)} - {borough_options}")
+    log.debug("Borough options: %s - %s", len(borough_options), borough_options)
     
     # Year options
-    years = df_global['YEAR'].dropna().unique()
+    years = column_values(dataset_catalog, 'YEAR')
     year_options = [{'label': int(y), 'value': int(y)} for y in sorted(years)]
-    print(f"Year options: {len(year_options)}")
+    log.debug("Year options: %s", len(year_options))
     
     # Vehicle type options - standardized values (top 15)
-    vehicles = df_global['VEHICLE_TYPE_CODE_1'].value_counts().head(15).index.tolist()
+    vehicles = column_values(dataset_catalog, 'VEHICLE_TYPE_CODE_1')[:15]
     vehicles = [v for v in vehicles if str(v) not in ['Unknown', 'UNKNOWN', 'None', '', 'nan']]
     vehicle_options = [{'label': str(v), 'value': str(v)} for v in vehicles]
-    print(f"Vehicle options (standardized): {len(vehicle_options)} - {[v['label'] for v in vehicle_options]}")
+    debug(lambda: f"Vehicle options (standardized): {len(vehicle_options)} - {[v['label'] for v in vehicle_options]}")
     
     # Person type options - standardized values
-    persons = df_global['PERSON_TYPE'].unique()
+    persons = column_values(dataset_catalog, 'PERSON_TYPE')
     persons = [p for p in persons if str(p) not in ['Unknown', 'UNKNOWN', 'None', '', 'nan']]
     person_options = [{'label': str(p), 'value': str(p)} for p in sorted(persons)]
-    print(f"Person options (standardized): {len(person_options)} - {[p['label'] for p in person_options]}")
+    debug(lambda: f"Person options (standardized): {len(person_options)} - {[p['label'] for p in person_options]}")
     
     # Gender options - simple labels without counts
-    gender_counts = df_global['PERSON_SEX'].value_counts()
     gender_options = []
-    if gender_counts.get('M', 0) > 0:
+    if value_count(dataset_catalog, 'PERSON_SEX', 'M') > 0:
         gender_options.append({'label': 'Male', 'value': 'M'})
-    if gender_counts.get('F', 0) > 0:
+    if value_count(dataset_catalog, 'PERSON_SEX', 'F') > 0:
         gender_options.append({'label': 'Female', 'value': 'F'})
     
-    print(f"Gender options: {gender_options}")
+    log.debug("Gender options: %s", gender_options)
     
     # Contributing Factor options - standardized values (top 15)
-    factors = df_global['CONTRIBUTING_FACTOR_VEHICLE_1'].value_counts().head(15).index.tolist()
+    factors = column_values(dataset_catalog, 'CONTRIBUTING_FACTOR_VEHICLE_1')[:15]
     factors = [f for f in factors if str(f) not in ['Unknown', 'UNKNOWN', 'None', '', 'nan', 'UNSPECIFIED']]
     contributing_factor_options = [{'label': str(f), 'value': str(f)} for f in factors]
-    print(f"Contributing Factor options (standardized): {len(contributing_factor_options)}")
+    log.debug("Contributing Factor options (standardized): %s", len(contributing_factor_options))
     
     # Injury Type options - standardized values
-    if 'PERSON_INJURY' in df_global.columns:
-        injuries = df_global['PERSON_INJURY'].unique()
+    if 'PERSON_INJURY' in dataset_catalog['columns']:
+        injuries = column_values(dataset_catalog, 'PERSON_INJURY')
         injuries = [i for i in injuries if str(i) not in ['Unknown', 'UNKNOWN', 'None', '', 'nan']]
         injury_type_options = [{'label': str(i), 'value': str(i)} for i in sorted(injuries)]
-        print(f"Injury Type options (standardized): {len(injury_type_options)} - {[i['label'] for i in injury_type_options]}")
+        debug(lambda: f"Injury Type options (standardized): {len(injury_type_options)} - {[i['label'] for i in injury_type_options]}")
     else:
         injury_type_options = []
-        print("PERSON_INJURY column not found")
+        log.warning("PERSON_INJURY column not found")
 
     return borough_options, year_options, vehicle_options, person_options, gender_options, contributing_factor_options, injury_type_options
 
@@ -503,20 +759,19 @@ def update_dropdown_options(_):
 def reset_filters(n_clicks):
     return "", None, None, None, None, None, None, None
 
-# Main callback for updating all charts
+# Prefix of a preview handle's state, so its outputs are cached apart from the exact ones
+PREVIEW_PREFIX = 'preview|'
+
+
+# Resolving the filters is done once per report: the search and dropdowns are
+# compiled into a plan whose state string is the handle kept in the
+# report-filters store. Every KPI/chart group below has its own callback and
+# result-cache entry keyed by that handle, so the browser gets the cheap
+# outputs first and one failing chart does not blank the others.
 @callback(
-    [Output('total-crashes', 'children'),
-     Output('total-injuries', 'children'),
-     Output('total-fatalities', 'children'),
-     Output('most-dangerous-borough', 'children'),
-     Output('borough-bar-chart', 'figure'),
-     Output('time-series-chart', 'figure'),
-     Output('person-type-pie-chart', 'figure'),
-     Output('contributing-factor-bar-chart', 'figure'),
-     Output('vehicle-type-bar-chart', 'figure'),
-     Output('gender-comparison-chart', 'figure'),
-     Output('crash-map', 'figure')],
-    Input('generate-report-btn', 'n_clicks'),
+    Output('report-filters', 'data'),
+    [Input('generate-report-btn', 'n_clicks'),
+     Input('data-ready', 'data')],
     [dash.dependencies.State('search-input', 'value'),
      dash.dependencies.State('borough-dropdown', 'value'),
      dash.dependencies.State('year-dropdown', 'value'),
@@ -524,417 +779,706 @@ def reset_filters(n_clicks):
      dash.dependencies.State('person-dropdown', 'value'),
      dash.dependencies.State('gender-dropdown', 'value'),
      dash.dependencies.State('contributing-factor-dropdown', 'value'),
-     dash.dependencies.State('injury-type-dropdown', 'value')],
-    prevent_initial_call=False
+     dash.dependencies.State('injury-type-dropdown', 'value'),
+     dash.dependencies.State('preview-switch', 'value')]
 )
-def update_dashboard(n_clicks, search_query, boroughs, years, vehicles, persons, genders, contributing_factors, injury_types):
-    if df_global.empty:
-        empty_fig = go.Figure()
-        empty_fig.add_annotation(text="No data available", x=0.5, y=0.5, showarrow=False)
-        return "0", "0", "0", "N/A", empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, empty_fig
-    
+def resolve_filters(n_clicks, ready, search_query, boroughs, years, vehicles, persons, genders, contributing_factors, injury_types,
+                    preview=False):
+    """
+    Handle for one search + dropdown state, shared by the output callbacks.
+    With the quick preview on, reports that need the rows get a preview
+    handle first: the outputs estimate them from the sample, and
+    refine_report() then swaps in the exact handle.
+    """
+    if not data_loader.ready:
+        # The outputs show the loading state until data-ready fires
+        return None
+    filters = {
+        'BOROUGH': boroughs,
+        'YEAR': years,
+        'VEHICLE_TYPE_CODE_1': vehicles,
+        'PERSON_TYPE': persons,
+        'PERSON_SEX': genders,
+        'CONTRIBUTING_FACTOR_VEHICLE_1': contributing_factors,
+        'PERSON_INJURY': injury_types
+    }
+    with span('filter'):
+        plan = plan_filters(filters, compile_search_query(search_query), filter_index)
+    log.debug("Generate Report: search %r, filters %s, filter plan %s", search_query, filters, plan['steps'])
+    report = {'state': plan_state(plan), 'search': search_query, 'filters': filters}
+    if preview and preview_sample is not None and plan['outcomes'] and not plan['empty']:
+        report.update(state=PREVIEW_PREFIX + report['state'], preview=True)
+    return report
+
+
+def exact_report(report):
+    """The exact handle a preview handle stands in for"""
+    return {'state': report['state'][len(PREVIEW_PREFIX):], 'search': report['search'], 'filters': report['filters']}
+
+
+@callback(
+    Output('report-filters', 'data', allow_duplicate=True),
+    Input('report-filters', 'data'),
+    prevent_initial_call=True
+)
+def refine_report(report):
+    """
+    Replace a preview handle with the exact one once its rows are summarized.
+    The browser sends this alongside the preview outputs, so the exact
+    resolution runs while the estimates are drawn; the outputs then redraw
+    from the exact handle.
+    """
+    if report is None or not report.get('preview'):
+        raise dash.exceptions.PreventUpdate
+    exact = exact_report(report)
+    resolve_report(exact)
+    return exact
+
+
+@callback(
+    [Output('export-csv', 'href'),
+     Output('export-parquet', 'href')],
+    Input('report-filters', 'data')
+)
+def update_export_links(report):
+    return export_href(report, 'csv'), export_href(report, 'parquet')
+
+
+# Resolved handles per process: plan, packed row selection and summary
+RESOLVED_LIMIT = 16
+resolved_reports = OrderedDict()
+# Handles being resolved right now: state -> Event set when that resolution ends
+resolving_reports = {}
+resolved_lock = threading.Lock()
+# Preview handles, kept apart so estimates never evict the exact reports
+# refining them
+preview_reports = OrderedDict()
+resolving_previews = {}
+preview_lock = threading.Lock()
+
+
+def resolve_once(cache, in_flight, lock, key, compute):
+    """
+    (cache[key], False), or (compute(), True) after storing it when the key is
+    missing. The lock is only held to look the key up and to register it in
+    in_flight, so different keys resolve in parallel; a caller asking for a key
+    another thread is already computing waits for that result instead of
+    repeating the work (and computes it itself if that attempt failed).
+    """
+    while True:
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key], False
+            pending = in_flight.get(key)
+            if pending is None:
+                pending = in_flight[key] = threading.Event()
+                break
+        pending.wait()
     try:
-        df = df_global.copy()
-        print(f"\n=== Update Dashboard Called (Standardized Data) ===")
-        print(f"Initial data shape: {df.shape}")
-        print(f"Search query: {search_query}")
-        print(f"Borough filter: {boroughs}")
-        print(f"Year filter: {years}")
-        print(f"Vehicle filter: {vehicles}")
-        print(f"Person filter: {persons}")
-        print(f"Gender filter: {genders}")
-        print(f"Contributing Factor filter: {contributing_factors}")
-        print(f"Injury Type filter: {injury_types}")
-        
-        # Apply search filter first
-        if search_query and search_query.strip():
-            df = parse_search_query(search_query, df)
-            print(f"After search query: {df.shape}")
-        
-        # Apply dropdown filters - all using standardized values
-        if boroughs:
-            print(f"Applying borough filter: {boroughs}")
-            df = df[df['BOROUGH'].isin([str(b) for b in boroughs])]
-            print(f"After borough dropdown filter: {df.shape}")
-        
-        if years:
-            print(f"Applying year filter: {years}")
-            df = df[df['YEAR'].isin([int(y) for y in years])]
-            print(f"After year filter: {df.shape}")
-        
-        if vehicles:
-            print(f"Applying vehicle filter: {vehicles}")
-            df = df[df['VEHICLE_TYPE_CODE_1'].isin([str(v) for v in vehicles])]
-            print(f"After vehicle filter: {df.shape}")
-        
-        if persons:
-            print(f"Applying person filter: {persons}")
-            df = df[df['PERSON_TYPE'].isin([str(p) for p in persons])]
-            print(f"After person filter: {df.shape}")
-        
-        # CRITICAL FIX #8: Enhanced gender filtering with validation
-        if genders:
-            print(f"Applying gender filter: {genders}")
-            print(f"Before gender filter - PERSON_SEX values: {df['PERSON_SEX'].value_counts().to_dict()}")
-            df = df[df['PERSON_SEX'].isin([str(g) for g in genders])]
-            print(f"After gender filter: {df.shape}")
-            print(f"After gender filter - PERSON_SEX values: {df['PERSON_SEX'].value_counts().to_dict()}")
-        
-        if contributing_factors:
-            print(f"Applying contributing factor filter: {contributing_factors}")
-            df = df[df['CONTRIBUTING_FACTOR_VEHICLE_1'].isin([str(c) for c in contributing_factors])]
-            print(f"After contributing factor filter: {df.shape}")
-        
-        if injury_types and 'PERSON_INJURY' in df.columns:
-            print(f"Applying injury type filter: {injury_types}")
-            df = df[df['PERSON_INJURY'].isin([str(i) for i in injury_types])]
-            print(f"After injury type filter: {df.shape}")
-        
-        # Check if we have any data left
-        if len(df) == 0:
-            print("WARNING: No data remaining after filters!")
-            empty_fig = go.Figure()
-            empty_fig.add_annotation(
-                text="No data matches the selected filters.<br>Try adjusting your filter criteria.",
-                x=0.5, y=0.5,
-                showarrow=False,
-                font=dict(size=16)
-            )
-            return "0", "0", "0", "N/A", empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, empty_fig
-        
-        # Calculate KPIs
-        total_crashes = len(df)
-        total_injuries = int(df['NUMBER_OF_PERSONS_INJURED'].sum())
-        total_fatalities = int(df['NUMBER_OF_PERSONS_KILLED'].sum())
-        
-        # Most dangerous borough
-        if len(df) > 0:
-            borough_danger = df.groupby('BOROUGH')['NUMBER_OF_PERSONS_KILLED'].sum()
-            borough_danger = borough_danger[~borough_danger.index.isin(['Unknown', 'UNKNOWN'])]
-            most_dangerous = borough_danger.idxmax() if len(borough_danger) > 0 and borough_danger.max() > 0 else "N/A"
-        else:
-            most_dangerous = "N/A"
-        
-        # 1. Borough Bar Chart
-        if len(df) > 0:
-            borough_counts = df['BOROUGH'].value_counts().head(10)
-            # Exclude Unknown
-            borough_counts = borough_counts[~borough_counts.index.isin(['Unknown', 'UNKNOWN'])]
-            
-            borough_bar_fig = px.bar(
-                x=borough_counts.index,
-                y=borough_counts.values,
-                title="Crashes by Borough (Top 10)",
-                labels={'x': 'Borough', 'y': 'Number of Crashes'},
-                color=borough_counts.values,
-                color_continuous_scale='Reds'
-            )
-            borough_bar_fig.update_layout(
-                xaxis_title="Borough",
-                yaxis_title="Number of Crashes",
-                showlegend=False
-            )
-        else:
-            borough_bar_fig = go.Figure()
-            borough_bar_fig.add_annotation(text="No data matches the selected filters", x=0.5, y=0.5, showarrow=False)
-    
-        # 2. Time series chart
-        if len(df) > 0 and 'YEAR' in df.columns:
-            yearly_counts = df['YEAR'].value_counts().sort_index()
-            time_fig = px.line(
-                x=yearly_counts.index,
-                y=yearly_counts.values,
-                title="Crashes Over Time",
-                labels={'x': 'Year', 'y': 'Number of Crashes'},
-                markers=True
-            )
-            time_fig.update_layout(
-                xaxis_title="Year",
-                yaxis_title="Number of Crashes"
-            )
-        else:
-            time_fig = go.Figure()
-            time_fig.add_annotation(text="No temporal data available", x=0.5, y=0.5, showarrow=False)
-        
-        # 3. Person Type Pie Chart - using standardized values
-        if len(df) > 0:
-            person_counts = df['PERSON_TYPE'].value_counts().head(6)
-            # Filter out Unknown
-            person_counts = person_counts[~person_counts.index.isin(['Unknown', 'UNKNOWN'])]
-            
-            pie_fig = px.pie(
-                values=person_counts.values,
-                names=person_counts.index,
-                title="Person Type Distribution (Standardized)",
-                hole=0.3  # Creates a donut chart
-            )
-            pie_fig.update_traces(textposition='inside', textinfo='percent+label')
-        else:
-            pie_fig = go.Figure()
-            pie_fig.add_annotation(text="No data available", x=0.5, y=0.5, showarrow=False)
-        
-        # 4. Contributing Factor Bar Chart - using standardized values
-        if len(df) > 0:
-            factor_counts = df['CONTRIBUTING_FACTOR_VEHICLE_1'].value_counts().head(10)
-            # Filter out Unknown and Unspecified
-            factor_counts = factor_counts[~factor_counts.index.isin(['Unknown', 'UNKNOWN', 'UNSPECIFIED'])]
-            
-            factor_bar_fig = px.bar(
-                x=factor_counts.values,
-                y=factor_counts.index,
-                title="Top Contributing Factors (Standardized)",
-                labels={'x': 'Number of Crashes', 'y': 'Contributing Factor'},
-                orientation='h',
-                color=factor_counts.values,
-                color_continuous_scale='Blues'
-            )
-            factor_bar_fig.update_layout(
-                xaxis_title="Number of Crashes",
-                yaxis_title="Contributing Factor",
-                showlegend=False,
-                height=400
-            )
-        else:
-            factor_bar_fig = go.Figure()
-            factor_bar_fig.add_annotation(text="No data available", x=0.5, y=0.5, showarrow=False)
-        
-        # 5. Vehicle Type Bar Chart - using standardized values
-        if len(df) > 0:
-            vehicle_counts = df['VEHICLE_TYPE_CODE_1'].value_counts().head(10)
-            # Filter out Unknown
-            vehicle_counts = vehicle_counts[~vehicle_counts.index.isin(['Unknown', 'UNKNOWN'])]
-            
-            vehicle_bar_fig = px.bar(
-                x=vehicle_counts.index,
-                y=vehicle_counts.values,
-                title="Top Vehicle Types Involved in Crashes (Standardized)",
-                labels={'x': 'Vehicle Type', 'y': 'Number of Crashes'},
-                color=vehicle_counts.values,
-                color_continuous_scale='Greens'
-            )
-            vehicle_bar_fig.update_layout(
-                xaxis_title="Vehicle Type",
-                yaxis_title="Number of Crashes",
-                showlegend=False,
-                xaxis_tickangle=-45,
-                height=400
-            )
-        else:
-            vehicle_bar_fig = go.Figure()
-            vehicle_bar_fig.add_annotation(text="No data available", x=0.5, y=0.5, showarrow=False)
-        
-        # 6. Gender Comparison Chart - using standardized M/F values
-        if len(df) > 0 and 'PERSON_SEX' in df.columns and 'PERSON_INJURY' in df.columns:
-            # Use the FILTERED data (respects gender dropdown)
-            # Only show M/F, exclude Unknown
-            gender_df = df[df['PERSON_SEX'].isin(['M', 'F'])].copy()
-            
-            print(f"\n=== GENDER CHART DEBUG ===")
-            print(f"Filtered data for gender chart: {len(gender_df)} records")
-            print(f"Gender distribution: {gender_df['PERSON_SEX'].value_counts().to_dict()}")
-            
-            if len(gender_df) > 0:
-                # Initialize result dictionary for both genders (even if one is filtered out)
-                gender_data = {
-                    'Female': {'Uninjured': 0, 'Injured': 0, 'Killed': 0},
-                    'Male': {'Uninjured': 0, 'Injured': 0, 'Killed': 0}
-                }
-                
-                # Process each gender that exists in filtered data
-                for sex_code, sex_label in [('F', 'Female'), ('M', 'Male')]:
-                    sex_df = gender_df[gender_df['PERSON_SEX'] == sex_code]
-                    
-                    if len(sex_df) > 0:
-                        # Count by PERSON_INJURY standardized values
-                        gender_data[sex_label]['Uninjured'] = len(sex_df[sex_df['PERSON_INJURY'] == 'UNINJURED'])
-                        gender_data[sex_label]['Injured'] = len(sex_df[sex_df['PERSON_INJURY'] == 'INJURED'])
-                        gender_data[sex_label]['Killed'] = len(sex_df[sex_df['PERSON_INJURY'] == 'KILLED'])
-                        
-                        # If no explicit injury classification, use aggregated counts
-                        if gender_data[sex_label]['Injured'] == 0:
-                            gender_data[sex_label]['Injured'] = int(sex_df['NUMBER_OF_PERSONS_INJURED'].sum())
-                        if gender_data[sex_label]['Killed'] == 0:
-                            gender_data[sex_label]['Killed'] = int(sex_df['NUMBER_OF_PERSONS_KILLED'].sum())
-                        
-                        # Calculate uninjured as remainder if not explicitly coded
-                        total_sex = len(sex_df)
-                        if gender_data[sex_label]['Uninjured'] == 0:
-                            gender_data[sex_label]['Uninjured'] = max(0, 
-                                total_sex - gender_data[sex_label]['Injured'] - gender_data[sex_label]['Killed'])
-                
-                print(f"Gender data calculated: {gender_data}")
-                
-                # Only include genders that have data
-                gender_labels = []
-                uninjured_values = []
-                injured_values = []
-                killed_values = []
-                
-                for gender in ['Female', 'Male']:
-                    total_for_gender = (gender_data[gender]['Uninjured'] + 
-                                      gender_data[gender]['Injured'] + 
-                                      gender_data[gender]['Killed'])
-                    if total_for_gender > 0:
-                        gender_labels.append(gender)
-                        uninjured_values.append(gender_data[gender]['Uninjured'])
-                        injured_values.append(gender_data[gender]['Injured'])
-                        killed_values.append(gender_data[gender]['Killed'])
-                
-                if len(gender_labels) > 0:
-                    # Create the chart
-                    gender_fig = go.Figure()
-                    
-                    # Add traces with consistent formatting
-                    gender_fig.add_trace(go.Bar(
-                        name='Uninjured',
-                        x=gender_labels,
-                        y=uninjured_values,
-                        marker_color='lightgreen',
-                        text=[f'{int(val):,}' for val in uninjured_values],
-                        textposition='outside',
-                        textfont=dict(size=14, color='black')
-                    ))
-                    
-                    gender_fig.add_trace(go.Bar(
-                        name='Injuries',
-                        x=gender_labels,
-                        y=injured_values,
-                        marker_color='orange',
-                        text=[f'{int(val):,}' for val in injured_values],
-                        textposition='outside',
-                        textfont=dict(size=14, color='black')
-                    ))
-                    
-                    gender_fig.add_trace(go.Bar(
-                        name='Fatalities',
-                        x=gender_labels,
-                        y=killed_values,
-                        marker_color='red',
-                        text=[f'{int(val):,}' for val in killed_values],
-                        textposition='outside',
-                        textfont=dict(size=14, color='black')
-                    ))
-                    
-                    # Build title based on filters
-                    title_parts = ['Gender Comparison']
-                    if genders:
-                        gender_names = ['Male' if g == 'M' else 'Female' for g in genders]
-                        title_parts.append(f"({', '.join(gender_names)} Only)")
-                    
-                    gender_fig.update_layout(
-                        title=dict(
-                            text=' - '.join(title_parts),
-                            font=dict(size=18)
-                        ),
-                        xaxis_title='Gender',
-                        yaxis_title='Count',
-                        barmode='group',
-                        height=500,
-                        font=dict(size=16),
-                        legend=dict(
-                            font=dict(size=14),
-                            orientation="h",
-                            yanchor="bottom",
-                            y=1.02,
-                            xanchor="right",
-                            x=1
-                        ),
-                        yaxis=dict(tickformat=",d")
-                    )
-                    
-                    print(f"Gender chart created with labels: {gender_labels}")
-                else:
-                    gender_fig = go.Figure()
-                    gender_fig.add_annotation(
-                        text="No gender data available for selected filters",
-                        x=0.5, y=0.5,
-                        showarrow=False,
-                        font=dict(size=16)
-                    )
-            else:
-                gender_fig = go.Figure()
-                gender_fig.add_annotation(
-                    text="No valid gender data (M/F) in filtered results",
-                    x=0.5, y=0.5,
-                    showarrow=False,
-                    font=dict(size=16)
-                )
-        else:
-            gender_fig = go.Figure()
-            gender_fig.add_annotation(
-                text="Gender or injury data not available",
-                x=0.5, y=0.5,
-                showarrow=False,
-                font=dict(size=16)
-            )
-        
-        # 7. Map (sample data for performance)
-        if len(df) > 0 and 'LATITUDE' in df.columns and 'LONGITUDE' in df.columns:
-            map_df = df.dropna(subset=['LATITUDE', 'LONGITUDE'])
-            # Filter out invalid coordinates
-            map_df = map_df[
-                (map_df['LATITUDE'] >= 40.5) & 
-                (map_df['LATITUDE'] <= 40.9) &
-                (map_df['LONGITUDE'] >= -74.25) & 
-                (map_df['LONGITUDE'] <= -73.7)
-            ]
-            
-            if len(map_df) > 0:
-                sample_size = min(1000, len(map_df))
-                map_df = map_df.sample(n=sample_size, random_state=42)
-                
-                map_fig = px.scatter_mapbox(
-                    map_df,
-                    lat="LATITUDE",
-                    lon="LONGITUDE",
-                    hover_data=["BOROUGH", "VEHICLE_TYPE_CODE_1"],
-                    zoom=10,
-                    height=400,
-                    title=f"Crash Locations (Sample of {sample_size} crashes)",
-                    color_discrete_sequence=["red"]
-                )
-                map_fig.update_layout(
-                    mapbox_style="open-street-map",
-                    mapbox=dict(center=dict(lat=40.7, lon=-74.0))
-                )
-            else:
-                map_fig = go.Figure()
-                map_fig.add_annotation(text="No valid location data available", x=0.5, y=0.5, showarrow=False)
+        value = compute()
+        with lock:
+            cache[key] = value
+            while len(cache) > RESOLVED_LIMIT:
+                cache.popitem(last=False)
+        return value, True
+    finally:
+        with lock:
+            del in_flight[key]
+        pending.set()
+
+
+# Columns of the person rows summarized next to the crash rows
+PERSON_SUMMARY_COLUMNS = PERSON_DIMENSIONS + MEASURES
+
+
+def partition_rows(plan):
+    """Row ranges of the partitions a plan can match, or None to use every row"""
+    if partition_map is None:
+        return None
+    ranges = partition_map.ranges(plan)
+    if ranges is not None:
+        def pruned():
+            kept, rows = partition_map.stats(ranges)
+            return f"Partitions pruned to {kept} of {len(partition_map)} ({rows:,} of {partition_map.n_rows:,} rows)"
+        debug(pruned)
+    return ranges
+
+
+def estimate_report(report):
+    """Plan and sample estimate for a preview handle, or None when too few sample rows match"""
+    if preview_sample is None:
+        return None
+    with span('filter'):
+        plan = plan_filters(report['filters'], compile_search_query(report['search']), filter_index)
+    with span('aggregate') as aggregated:
+        summary = preview_sample.estimate(plan)
+        aggregated['rows'] = 0 if summary is None else summary['sample_rows']
+    if summary is None:
+        return None
+    return {'plan': plan, 'ranges': None, 'selection': None, 'summary': summary}
+
+
+def compute_report(report):
+    """Plan, row selection and summary of a report handle, computed afresh"""
+    with span('filter'):
+        plan = plan_filters(report['filters'], compile_search_query(report['search']), filter_index)
+        ranges = partition_rows(plan)
+        selection = filter_index.select_plan(plan, ranges)
+    if plan['empty']:
+        # Contradictory filters (e.g. search "queens" + MANHATTAN dropdown)
+        log.debug("Filter plan cannot match any row: %s", plan['empty'])
+        summary = {'rows': 0}
+    elif plan['outcomes'] or (crash_tables is not None and filter_index.semi_joined(plan)):
+        # Injured/killed searches are not cube dimensions, and the crashes
+        # a person filter semi-joins to are not a cube slice; summarize the
+        # rows selected by the plan's bitmap
+        if row_aggregator is not None and row_aggregator.use_for(plan):
+            # Large 1:1 selections: filtered and counted chunk by chunk in
+            # the aggregation pool instead
+            with span('aggregate') as aggregated:
+                summary = row_aggregator.summarize(plan, ranges)
+                aggregated['rows'] = summary['rows']
         else:
-            map_fig = go.Figure()
-            map_fig.add_annotation(text="No location data available", x=0.5, y=0.5, showarrow=False)
-        
-        print(f"=== Results (Standardized Data) ===")
-        print(f"Crashes: {total_crashes:,}, Injuries: {total_injuries:,}, Fatalities: {total_fatalities:,}")
-        print(f"Most dangerous borough: {most_dangerous}")
-        
+            with span('filter') as filtered:
+                rows = None if selection is None else filter_index.rows(selection, ranges)
+                df = df_global if rows is None else df_global.take(rows)
+                filtered['rows'] = len(df)
+            with span('aggregate') as aggregated:
+                summary = summarize(df)
+                aggregated['rows'] = len(df)
+                if crash_tables is not None:
+                    if rows is None:
+                        rows = np.arange(len(df_global))
+                    persons = filter_index.person_rows(rows, filter_index.person_filter(plan))
+                    summary = with_persons(summary, summarize(crash_tables.joined(PERSON_SUMMARY_COLUMNS, persons)))
+                    aggregated['rows'] += len(persons)
+    else:
+        # Everything else is answered from the aggregate cube(s)
+        with span('aggregate') as aggregated:
+            cube_slice = aggregate_cube.slice(plan['values'])
+            summary = summarize(cube_slice)
+            aggregated['rows'] = len(cube_slice)
+            if person_cube is not None:
+                person_slice = person_cube.slice(plan['values'])
+                summary = with_persons(summary, summarize(person_slice))
+                aggregated['rows'] += len(person_slice)
+        log.debug("Answered from the aggregate cube: %s rows", summary['rows'])
+
+    return {'plan': plan, 'ranges': ranges, 'selection': selection, 'summary': summary}
+
+
+def resolve_preview(report):
+    """
+    Plan and sample estimate for a preview handle (no row selection), or
+    None when too few sample rows match to estimate from.
+    """
+    resolved, _ = resolve_once(
+        preview_reports, resolving_previews, preview_lock, report['state'], lambda: estimate_report(report)
+    )
+    return resolved
+
+
+def resolve_report(report):
+    """
+    Plan, row selection and summary for a report handle, computed once per
+    process and shared by every output callback. A worker that has not seen
+    the handle (or has evicted it) rebuilds it from the stored inputs.
+    Preview handles resolve to a sample estimate, or to the exact report
+    when the sample cannot estimate it.
+    """
+    if report.get('preview'):
+        resolved = resolve_preview(report)
+        return resolved if resolved is not None else resolve_report(exact_report(report))
+    resolved, computed = resolve_once(
+        resolved_reports, resolving_reports, resolved_lock, report['state'], lambda: compute_report(report)
+    )
+    RESOLVED_REPORTS.inc(result='miss' if computed else 'hit')
+    return resolved
+
+
+def message_figure(text, **font):
+    fig = go.Figure()
+    fig.add_annotation(text=text, x=0.5, y=0.5, showarrow=False, font=font or None)
+    return fig
+
+
+def no_match_figure():
+    return message_figure(
+        "No data matches the selected filters.<br>Try adjusting your filter criteria.",
+        size=16
+    )
+
+
+def cached_output(name, report, build, error_output):
+    """
+    One output group for a report handle: from the result cache, else
+    build(resolved) and cache it. A failure is logged and shown in this
+    group only (error_output(exception)), and is not cached.
+    """
+    key = f"{report['state']}|{name}"
+    with span('cache'):
+        outputs = result_cache.get(key)
+    if outputs is not None:
+        return outputs
+    try:
+        resolved = resolve_report(report)
+        with span('figure'):
+            outputs = build(resolved)
+    except Exception as e:
+        log.exception(f"ERROR in {name}: {e}")
+        return error_output(e)
+    with span('cache'):
+        result_cache.put(key, outputs)
+    return outputs
+
+
+def error_figure(e):
+    return message_figure(
+        f"Error processing data: {str(e)}<br>Check console for details",
+        size=14, color='red'
+    )
+
+
+def unavailable_figure():
+    """Placeholder chart while the data is loading, failed to load, or is empty"""
+    status = data_loader.status()
+    if status['state'] == FAILED:
+        return message_figure(f"Data failed to load: {status['error']}", size=14, color='red')
+    if not data_loader.ready:
+        return message_figure("Loading data...", size=16)
+    return message_figure("No data available")
+
+
+def preview_title(build):
+    """build() with '(preview)' after the title of charts drawn from a sample estimate"""
+    def build_preview(resolved):
+        fig = build(resolved)
+        if 'margins' in resolved['summary'] and fig.layout.title.text:
+            fig.update_layout(title_text=f"{fig.layout.title.text} (preview)")
+        return fig
+    return build_preview
+
+
+def cached_figure(name, report, build):
+    """cached_output() for a single chart"""
+    if df_global.empty or report is None:
+        return unavailable_figure()
+    if report.get('preview'):
+        build = preview_title(build)
+    return cached_output(name, report, build, error_figure)
+
+
+def estimated(value, margin):
+    """A KPI estimated from the sample: '≈12,340 ± 310', or still refining when too rare to bound"""
+    if margin is None:
+        return f"≈{value:,} (refining)"
+    return f"≈{value:,} ± {margin:,.0f}"
+
+
+def build_kpis(resolved):
+    summary = resolved['summary']
+    if summary['rows'] == 0:
+        log.debug("No data remaining after filters")
+        return "0", "0", "0", "N/A"
+    
+    # Calculate KPIs
+    total_crashes = summary['rows']
+    total_injuries = summary['injured']
+    total_fatalities = summary['killed']
+    
+    # Most dangerous borough
+    borough_danger = summary['by']['BOROUGH']['NUMBER_OF_PERSONS_KILLED']
+    borough_danger = borough_danger[~borough_danger.index.isin(['Unknown', 'UNKNOWN'])]
+    most_dangerous = borough_danger.idxmax() if len(borough_danger) > 0 and borough_danger.max() > 0 else "N/A"
+    
+    log.debug(
+        "Results: %s crashes, %s injuries, %s fatalities; most dangerous borough %s",
+        total_crashes, total_injuries, total_fatalities, most_dangerous
+    )
+    
+    if 'margins' in summary:
+        margins = summary['margins']
         return (
-            f"{total_crashes:,}",
-            f"{total_injuries:,}",
-            f"{total_fatalities:,}",
-            most_dangerous,
-            borough_bar_fig,
-            time_fig,
-            pie_fig,
-            factor_bar_fig,
-            vehicle_bar_fig,
-            gender_fig,
-            map_fig
+            estimated(total_crashes, margins['rows']), estimated(total_injuries, margins['injured']),
+            estimated(total_fatalities, margins['killed']),
+            # Ranked by fatalities, so no better than their estimate
+            most_dangerous if margins['killed'] is not None else "(refining)"
         )
+    return f"{total_crashes:,}", f"{total_injuries:,}", f"{total_fatalities:,}", most_dangerous
+
+
+@callback(
+    [Output('total-crashes', 'children'),
+     Output('total-injuries', 'children'),
+     Output('total-fatalities', 'children'),
+     Output('most-dangerous-borough', 'children')],
+    Input('report-filters', 'data')
+)
+def update_kpis(report):
+    if data_loader.state == LOADING:
+        return "...", "...", "...", "..."
+    if df_global.empty or report is None:
+        return "0", "0", "0", "N/A"
+    return cached_output('kpis', report, build_kpis, lambda e: ("Error", "Error", "Error", "Error"))
+
+
+# 1. Borough Bar Chart
+def build_borough_chart(resolved):
+    summary = resolved['summary']
+    if summary['rows'] == 0:
+        return no_match_figure()
+    borough_counts = counts_by(summary, 'BOROUGH').head(10)
+    # Exclude Unknown
+    borough_counts = borough_counts[~borough_counts.index.isin(['Unknown', 'UNKNOWN'])]
+    
+    borough_bar_fig = px.bar(
+        x=borough_counts.index,
+        y=borough_counts.values,
+        title="Crashes by Borough (Top 10)",
+        labels={'x': 'Borough', 'y': 'Number of Crashes'},
+        color=borough_counts.values,
+        color_continuous_scale='Reds'
+    )
+    borough_bar_fig.update_layout(
+        xaxis_title="Borough",
+        yaxis_title="Number of Crashes",
+        showlegend=False
+    )
+    return borough_bar_fig
+
+
+@callback(Output('borough-bar-chart', 'figure'), Input('report-filters', 'data'))
+def update_borough_chart(report):
+    return cached_figure('borough', report, build_borough_chart)
+
+
+# 2. Time series chart
+def build_time_chart(resolved):
+    summary = resolved['summary']
+    if summary['rows'] == 0:
+        return no_match_figure()
+    if 'YEAR' not in summary['by']:
+        return message_figure("No temporal data available")
+    yearly_counts = summary['by']['YEAR']['rows'].sort_index()
+    time_fig = px.line(
+        x=yearly_counts.index,
+        y=yearly_counts.values,
+        title="Crashes Over Time",
+        labels={'x': 'Year', 'y': 'Number of Crashes'},
+        markers=True
+    )
+    time_fig.update_layout(
+        xaxis_title="Year",
+        yaxis_title="Number of Crashes"
+    )
+    return time_fig
+
+
+@callback(Output('time-series-chart', 'figure'), Input('report-filters', 'data'))
+def update_time_chart(report):
+    return cached_figure('time', report, build_time_chart)
+
+
+# 3. Person Type Pie Chart - using standardized values
+def build_person_type_chart(resolved):
+    summary = resolved['summary']
+    if summary['rows'] == 0:
+        return no_match_figure()
+    person_counts = counts_by(summary, 'PERSON_TYPE').head(6)
+    # Filter out Unknown
+    person_counts = person_counts[~person_counts.index.isin(['Unknown', 'UNKNOWN'])]
+    
+    pie_fig = px.pie(
+        values=person_counts.values,
+        names=person_counts.index,
+        title="Person Type Distribution (Standardized)",
+        hole=0.3  # Creates a donut chart
+    )
+    pie_fig.update_traces(textposition='inside', textinfo='percent+label')
+    return pie_fig
+
+
+@callback(Output('person-type-pie-chart', 'figure'), Input('report-filters', 'data'))
+def update_person_type_chart(report):
+    return cached_figure('person_type', report, build_person_type_chart)
+
+
+# 4. Contributing Factor Bar Chart - using standardized values
+def build_factor_chart(resolved):
+    summary = resolved['summary']
+    if summary['rows'] == 0:
+        return no_match_figure()
+    factor_counts = counts_by(summary, 'CONTRIBUTING_FACTOR_VEHICLE_1').head(10)
+    # Filter out Unknown and Unspecified
+    factor_counts = factor_counts[~factor_counts.index.isin(['Unknown', 'UNKNOWN', 'UNSPECIFIED'])]
+    
+    factor_bar_fig = px.bar(
+        x=factor_counts.values,
+        y=factor_counts.index,
+        title="Top Contributing Factors (Standardized)",
+        labels={'x': 'Number of Crashes', 'y': 'Contributing Factor'},
+        orientation='h',
+        color=factor_counts.values,
+        color_continuous_scale='Blues'
+    )
+    factor_bar_fig.update_layout(
+        xaxis_title="Number of Crashes",
+        yaxis_title="Contributing Factor",
+        showlegend=False,
+        height=400
+    )
+    return factor_bar_fig
+
+
+@callback(Output('contributing-factor-bar-chart', 'figure'), Input('report-filters', 'data'))
+def update_factor_chart(report):
+    return cached_figure('factor', report, build_factor_chart)
+
+
+# 5. Vehicle Type Bar Chart - using standardized values
+def build_vehicle_chart(resolved):
+    summary = resolved['summary']
+    if summary['rows'] == 0:
+        return no_match_figure()
+    vehicle_counts = counts_by(summary, 'VEHICLE_TYPE_CODE_1').head(10)
+    # Filter out Unknown
+    vehicle_counts = vehicle_counts[~vehicle_counts.index.isin(['Unknown', 'UNKNOWN'])]
+    
+    vehicle_bar_fig = px.bar(
+        x=vehicle_counts.index,
+        y=vehicle_counts.values,
+        title="Top Vehicle Types Involved in Crashes (Standardized)",
+        labels={'x': 'Vehicle Type', 'y': 'Number of Crashes'},
+        color=vehicle_counts.values,
+        color_continuous_scale='Greens'
+    )
+    vehicle_bar_fig.update_layout(
+        xaxis_title="Vehicle Type",
+        yaxis_title="Number of Crashes",
+        showlegend=False,
+        xaxis_tickangle=-45,
+        height=400
+    )
+    return vehicle_bar_fig
+
+
+@callback(Output('vehicle-type-bar-chart', 'figure'), Input('report-filters', 'data'))
+def update_vehicle_chart(report):
+    return cached_figure('vehicle', report, build_vehicle_chart)
+
+
+# 6. Gender Comparison Chart - using standardized M/F values
+def build_gender_chart(resolved):
+    summary = resolved['summary']
+    plan = resolved['plan']
+    if summary['rows'] == 0:
+        return no_match_figure()
+    if summary['sex_injury'] is None:
+        return message_figure("Gender or injury data not available", size=16)
+    
+    # Use the FILTERED data (respects gender dropdown)
+    # Only show M/F, exclude Unknown
+    rows_by_sex = summary['sex_injury']['rows'].sum(axis=1)
+    if rows_by_sex.reindex(['M', 'F'], fill_value=0).sum() == 0:
+        return message_figure("No valid gender data (M/F) in filtered results", size=16)
+    
+    # Both genders are always present (zeros if one is filtered out)
+    gender_data = gender_outcomes(summary)
+    
+    log.debug("Gender data calculated: %s", gender_data)
+    
+    # Only include genders that have data
+    gender_labels = []
+    uninjured_values = []
+    injured_values = []
+    killed_values = []
+    
+    for gender in ['Female', 'Male']:
+        total_for_gender = (gender_data[gender]['Uninjured'] + 
+                          gender_data[gender]['Injured'] + 
+                          gender_data[gender]['Killed'])
+        if total_for_gender > 0:
+            gender_labels.append(gender)
+            uninjured_values.append(gender_data[gender]['Uninjured'])
+            injured_values.append(gender_data[gender]['Injured'])
+            killed_values.append(gender_data[gender]['Killed'])
     
+    if len(gender_labels) == 0:
+        return message_figure("No gender data available for selected filters", size=16)
+    
+    # Create the chart
+    gender_fig = go.Figure()
+    
+    # Add traces with consistent formatting
+    gender_fig.add_trace(go.Bar(
+        name='Uninjured',
+        x=gender_labels,
+        y=uninjured_values,
+        marker_color='lightgreen',
+        text=[f'{int(val):,}' for val in uninjured_values],
+        textposition='outside',
+        textfont=dict(size=14, color='black')
+    ))
+    
+    gender_fig.add_trace(go.Bar(
+        name='Injuries',
+        x=gender_labels,
+        y=injured_values,
+        marker_color='orange',
+        text=[f'{int(val):,}' for val in injured_values],
+        textposition='outside',
+        textfont=dict(size=14, color='black')
+    ))
+    
+    gender_fig.add_trace(go.Bar(
+        name='Fatalities',
+        x=gender_labels,
+        y=killed_values,
+        marker_color='red',
+        text=[f'{int(val):,}' for val in killed_values],
+        textposition='outside',
+        textfont=dict(size=14, color='black')
+    ))
+    
+    # Build title based on filters
+    title_parts = ['Gender Comparison']
+    if plan['values'].get('PERSON_SEX'):
+        gender_names = ['Male' if g == 'M' else 'Female' for g in plan['values']['PERSON_SEX']]
+        title_parts.append(f"({', '.join(gender_names)} Only)")
+    
+    gender_fig.update_layout(
+        title=dict(
+            text=' - '.join(title_parts),
+            font=dict(size=18)
+        ),
+        xaxis_title='Gender',
+        yaxis_title='Count',
+        barmode='group',
+        height=500,
+        font=dict(size=16),
+        legend=dict(
+            font=dict(size=14),
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        yaxis=dict(tickformat=",d")
+    )
+    
+    log.debug("Gender chart created with labels: %s", gender_labels)
+    return gender_fig
+
+
+@callback(Output('gender-comparison-chart', 'figure'), Input('report-filters', 'data'))
+def update_gender_chart(report):
+    return cached_figure('gender', report, build_gender_chart)
+
+
+# 7. Map - density of every selected crash, binned per grid cell. The
+# map-view store records what is drawn so a weight change can be patched in
+def map_cells(resolved, bounds=None):
+    """('points', positions) or ('density', table) for the whole city or a viewport"""
+    selection = resolved['selection']
+    if resolved['plan']['empty']:
+        return 'points', np.zeros(0, dtype=np.uint32)
+    if bounds is None:
+        with span('filter') as filtered:
+            positions = None if selection is None else filter_index.rows(selection, resolved['ranges'])
+            filtered['rows'] = len(df_global) if positions is None else len(positions)
+        with span('aggregate', rows=filtered['rows']):
+            return 'density', spatial_grid.density(positions)
+    with span('aggregate'):
+        if selection is None:
+            return spatial_grid.viewport(*bounds)
+        return spatial_grid.viewport(*bounds, keep=lambda rows: filter_index.contains(selection, rows))
+
+
+def build_map(report, map_weight, bounds=None):
+    """Map figure plus the map-view record for a report (and optional viewport)"""
+    resolved = resolve_report(report)
+    uirevision = report['state']
+    if resolved['summary']['rows'] == 0 and bounds is None:
+        return no_match_figure(), None
+    mode, data = map_cells(resolved, bounds)
+    suffix = "" if bounds is None else " in view"
+    if mode == 'points':
+        fig = points_map(data, uirevision)
+    elif len(data) == 0:
+        mode = 'empty'
+        fig = message_figure("No valid location data available")
+    else:
+        fig = density_map(data, map_weight, uirevision, suffix)
+    return fig, {'state': report['state'], 'mode': mode, 'bounds': bounds}
+
+
+@callback(
+    [Output('crash-map', 'figure'),
+     Output('map-view', 'data')],
+    [Input('report-filters', 'data'),
+     Input('map-weight', 'value')],
+    dash.dependencies.State('map-view', 'data')
+)
+def update_map(report, map_weight, map_view):
+    if df_global.empty or report is None:
+        return unavailable_figure(), None
+    if spatial_grid is None:
+        return message_figure("No location data available"), None
+    if report.get('preview'):
+        # Estimates have no crash positions; the map waits for the exact report
+        raise dash.exceptions.PreventUpdate
+    
+    same_view = map_view is not None and map_view['state'] == report['state']
+    if same_view and dash.ctx.triggered_id == 'map-weight':
+        if map_view['mode'] in ('points', 'empty'):
+            # Individual crashes, or none in view, do not depend on the weight
+            raise dash.exceptions.PreventUpdate
+        if map_view['mode'] == 'density':
+            # Same cells, new weight: only z and the titles change
+            _, cells = map_cells(resolve_report(report), map_view['bounds'])
+            weight = map_weight if map_weight in cells.columns else 'rows'
+            patch = Patch()
+            patch['data'][0]['z'] = cells[weight].tolist()
+            patch['data'][0]['colorbar']['title']['text'] = MAP_WEIGHTS[weight]
+            patch['layout']['title']['text'] = density_title(cells, weight, "" if map_view['bounds'] is None else " in view")
+            return patch, map_view
+    
+    key = f"{report['state']}|map|{map_weight}"
+    with span('cache'):
+        outputs = result_cache.get(key)
+    if outputs is not None:
+        return outputs
+    try:
+        with span('figure'):
+            outputs = build_map(report, map_weight)
     except Exception as e:
-        print(f"ERROR in update_dashboard: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        empty_fig = go.Figure()
-        empty_fig.add_annotation(
-            text=f"Error processing data: {str(e)}<br>Check console for details",
-            x=0.5, y=0.5,
-            showarrow=False,
-            font=dict(size=14, color='red')
-        )
-        return "Error", "Error", "Error", "Error", empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, empty_fig, empty_fig
+        log.exception(f"ERROR in map: {e}")
+        return error_figure(e), None
+    with span('cache'):
+        result_cache.put(key, outputs)
+    return outputs
+
+
+@callback(
+    [Output('crash-map', 'figure', allow_duplicate=True),
+     Output('map-view', 'data', allow_duplicate=True)],
+    Input('crash-map', 'relayoutData'),
+    [dash.dependencies.State('report-filters', 'data'),
+     dash.dependencies.State('map-weight', 'value')],
+    prevent_initial_call=True
+)
+def update_map_viewport(relayout_data, report, map_weight):
+    """Redraw the map for the visible area: crashes when zoomed in, density otherwise"""
+    bounds = viewport_bounds(relayout_data)
+    if bounds is None or report is None or spatial_grid is None or report.get('preview'):
+        raise dash.exceptions.PreventUpdate
+    
+    with span('figure'):
+        fig, map_view = build_map(report, map_weight, bounds)
+    log.debug("Map viewport %s: %s", bounds, map_view['mode'])
+    return fig, map_view
 
-if _name_ == '_main_':
-    app.run(debug=True, port=8050)
+if __name__ == '__main__':
+    app.run(debug=True,port=8050)
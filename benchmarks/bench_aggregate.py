@@ -0,0 +1,85 @@
+"""
+Per-request aggregation latency as the selected row count grows.
+
+    python -m benchmarks.bench_aggregate [--sizes 100000 1000000 5000000 20000000]
+
+Builds synthetic frames with the dtypes data_store produces (categorical
+dimensions, int16 YEAR, small unsigned counts) and times summarize() on each,
+next to the groupby-per-chart approach it replaced. The synthetic frame stands
+in for the rows a filter selects, so the sizes can exceed the real dataset.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from aggregation import CHART_DIMENSIONS, MEASURES, summarize
+
+# Distinct values per dimension, roughly as in the standardized dataset
+CARDINALITY = {
+    'BOROUGH': 6,
+    'VEHICLE_TYPE_CODE_1': 120,
+    'CONTRIBUTING_FACTOR_VEHICLE_1': 60,
+    'PERSON_TYPE': 5,
+    'PERSON_SEX': 3,
+    'PERSON_INJURY': 4
+}
+
+
+def synthetic_frame(n_rows, seed=0):
+    """n_rows of random dashboard columns with skewed value frequencies"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for col, n_values in CARDINALITY.items():
+        weights = 1.0 / np.arange(1, n_values + 1)
+        codes = rng.choice(n_values, size=n_rows, p=weights / weights.sum()).astype(np.int8)
+        labels = ['Unknown'] + [f"{col}_{i}" for i in range(1, n_values)]
+        columns[col] = pd.Categorical.from_codes(codes, categories=labels)
+    columns['YEAR'] = rng.integers(2012, 2026, size=n_rows).astype(np.int16)
+    columns['NUMBER_OF_PERSONS_INJURED'] = rng.poisson(0.3, size=n_rows).astype(np.uint8)
+    columns['NUMBER_OF_PERSONS_KILLED'] = (rng.random(n_rows) < 0.002).astype(np.uint8)
+    return pd.DataFrame(columns)
+
+
+def groupby_summary(frame):
+    """The replaced approach: one groupby (a hash/sort pass) per chart"""
+    summary = {'by': {}}
+    for by in [[dim] for dim in CHART_DIMENSIONS] + [['PERSON_SEX', 'PERSON_INJURY']]:
+        grouped = frame.groupby(by, observed=True)
+        sums = grouped[MEASURES].sum()
+        sums['rows'] = grouped.size()
+        summary['by'][tuple(by)] = sums
+    return summary
+
+
+def best_of(func, frame, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 5_000_000, 20_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'summarize ms':>14} {'groupby ms':>12} {'speedup':>8} {'ns/row':>7}")
+    for n_rows in args.sizes:
+        frame = synthetic_frame(n_rows)
+        fused = best_of(summarize, frame, args.repeat)
+        grouped = best_of(groupby_summary, frame, args.repeat)
+        print(
+            f"{n_rows:>12,} {fused * 1000:>14.1f} {grouped * 1000:>12.1f} "
+            f"{grouped / fused:>7.1f}x {fused / n_rows * 1e9:>7.1f}"
+        )
+        del frame
+
+
+if __name__ == '__main__':
+    main()
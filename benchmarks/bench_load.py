@@ -0,0 +1,71 @@
+"""
+Startup load benchmark: standardized CSV vs typed Parquet.
+
+    python -m benchmarks.bench_load [path/to/cleaned_merged_standardized_data.csv]
+
+Converts the CSV to Parquet in a temporary directory (unless a Parquet file is
+passed with --parquet), then times load_dataset() on both and reports the load
+time, the in-memory size and the on-disk size of each, for the full table and
+for just the dashboard's column manifest.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from data_store import CSV_PATH, DASHBOARD_MANIFEST, load_dataset, save_dataset
+
+
+def time_load(path, repeat, manifest=None):
+    """Best-of-N wall time for load_dataset(path), plus the loaded frame"""
+    best = None
+    df = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = load_dataset(path, manifest=manifest)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('csv', nargs='?', default=CSV_PATH)
+    parser.add_argument('--parquet', help="existing Parquet copy (default: convert the CSV)")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parquet_path = args.parquet
+        if parquet_path is None:
+            parquet_path = os.path.join(tmp, 'dataset.parquet')
+            start = time.perf_counter()
+            save_dataset(pd.read_csv(args.csv, low_memory=False), parquet_path)
+            print(f"One-off conversion: {time.perf_counter() - start:.2f}s")
+
+        rows = []
+        loads = [
+            (label, path, columns, manifest)
+            for label, path in [('csv', args.csv), ('parquet', parquet_path)]
+            for columns, manifest in [('all', None), ('dashboard', DASHBOARD_MANIFEST)]
+        ]
+        for label, path, columns, manifest in loads:
+            seconds, df = time_load(path, args.repeat, manifest)
+            rows.append({
+                'format': label,
+                'columns': columns,
+                'load_s': round(seconds, 3),
+                'rows': len(df),
+                'memory_mb': round(df.memory_usage(deep=True).sum() / 2**20, 1),
+                'file_mb': round(os.path.getsize(path) / 2**20, 1)
+            })
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    print(f"Speed-up, full table: {rows[0]['load_s'] / rows[2]['load_s']:.1f}x")
+    print(f"Speed-up, dashboard columns: {rows[1]['load_s'] / rows[3]['load_s']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Scaling of the chunked aggregation pool (parallel.py) from one worker to N.
+
+    python -m benchmarks.bench_parallel [--rows 20000000] [--workers 1 2 4 8] [--repeat 3]
+
+Loads the suite's synthetic column store for --rows (benchmarks/synthetic.py,
+generated under --data-dir when missing) as the app does, then for each plan
+in PLANS times the serial path resolve_report() takes today (bitmap select,
+unpack the rows, take, summarize()) against ChunkedAggregator.summarize() run
+in-process and with each pool size. Every chunked summary is compared with the
+serial one first; the script exits with status 1 on a mismatch. Worker counts
+beyond os.cpu_count() are still run, but cannot scale.
+"""
+import argparse
+import os
+import sys
+import time
+
+from aggregation import summarize
+from benchmarks.check_cube import differences
+from benchmarks.suite import dataset
+from data_store import DASHBOARD_MANIFEST, load_dataset
+from filters import BitmapIndex, compile_search_query, plan_filters
+from parallel import CHUNK_ROWS, ChunkedAggregator, start_pool
+
+# (label, dropdown filters, search): the outcome searches resolve_report sends
+# to the rows, plus a full scan and a narrow one for contrast
+PLANS = [
+    ("everything", {}, ''),
+    ("injured", {}, 'injured'),
+    ("killed", {}, 'killed'),
+    ("injured sedan 2015", {}, 'injured sedan 2015'),
+    ("brooklyn injured, 3 years", {'YEAR': [2019, 2020, 2021]}, 'brooklyn injured'),
+    ("pedestrian killed", {}, 'pedestrian killed'),
+]
+
+
+def best_of(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def serial_summary(df, index, plan):
+    selection = index.select_plan(plan)
+    # None selects every row
+    return summarize(df if selection is None else df.take(index.rows(selection)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', default='benchmark_data')
+    args = parser.parse_args()
+
+    df = load_dataset(dataset(args.rows, args.seed, 1.0, args.data_dir), manifest=DASHBOARD_MANIFEST)
+    index = BitmapIndex(df)
+    plans = [(label, plan_filters(filters, compile_search_query(search), index)) for label, filters, search in PLANS]
+    print(f"{len(df):,} rows, {os.cpu_count()} CPUs, chunks of {args.chunk_rows:,} rows")
+
+    # label -> [(setting, seconds)]
+    timings = {label: [] for label, _ in plans}
+    expected = {}
+    for label, plan in plans:
+        seconds, expected[label] = best_of(lambda: serial_summary(df, index, plan), args.repeat)
+        timings[label].append(('serial', seconds))
+
+    for workers in [0] + args.workers:
+        pool = start_pool(workers) if workers else None
+        aggregator = ChunkedAggregator(df, pool, chunk_rows=args.chunk_rows, min_rows=0)
+        try:
+            for label, plan in plans:
+                actual = aggregator.summarize(plan)  # also starts the pool's processes
+                problems = differences(expected[label], actual)
+                if problems:
+                    print(f"MISMATCH for {label} with {workers} workers:")
+                    for problem in problems:
+                        print(f"  {problem}")
+                    sys.exit(1)
+                seconds, _ = best_of(lambda: aggregator.summarize(plan), args.repeat)
+                timings[label].append((f"{workers} workers" if workers else 'in-process', seconds))
+        finally:
+            aggregator.close()
+
+    settings = [setting for setting, _ in timings[plans[0][0]]]
+    print(f"{'plan':<28} {'matches':>11} " + ' '.join(f"{s:>11}" for s in settings) + f" {'best vs serial':>15}")
+    for label, _ in plans:
+        seconds = [s for _, s in timings[label]]
+        print(
+            f"{label:<28} {expected[label]['rows']:>11,} "
+            + ' '.join(f"{s * 1000:>8.1f} ms" for s in seconds)
+            + f" {seconds[0] / min(seconds[1:]):>14.2f}x"
+        )
+    print("All chunked summaries match the serial path (ms: best of each setting)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Partition pruning: filter latency and memory touched with and without it.
+
+    python -m benchmarks.bench_partitions [--rows 5000000]
+
+Writes a synthetic dataset as a YEAR x BOROUGH partitioned store in a
+temporary directory, memory-maps it and builds the bitmap index, then times
+the selection of representative plans (select_plan() plus rows()) on every
+row and on the partitions PartitionMap.ranges() keeps. Last, it gathers the
+map coordinates of one plan's rows, which nothing read at load, and reports
+how much the resident set grew: only the kept partitions' pages are read.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_aggregate import synthetic_frame
+from data_store import DASHBOARD_MANIFEST, load_dataset
+from filters import BitmapIndex, compile_search_query, plan_filters
+from partitions import PartitionMap, save_partitioned
+
+# (label, dropdown filters, search)
+PLANS = [
+    ("Brooklyn 2023", {'BOROUGH': ['BOROUGH_1'], 'YEAR': [2023]}, None),
+    ("2019-2021", {'YEAR': [2019, 2020, 2021]}, None),
+    ("two boroughs, one vehicle", {'BOROUGH': ['BOROUGH_2', 'BOROUGH_3'], 'VEHICLE_TYPE_CODE_1': ['VEHICLE_TYPE_CODE_1_1']}, None),
+    ("search: killed 2015", {}, "killed 2015"),
+    ("one vehicle type", {'VEHICLE_TYPE_CODE_1': ['VEHICLE_TYPE_CODE_1_5']}, None),
+]
+
+
+def resident_mb():
+    """Resident set size of this process (Linux)"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    frame = synthetic_frame(args.rows)
+    rng = np.random.default_rng(1)
+    frame['LATITUDE'] = rng.uniform(40.5, 40.9, args.rows).astype(np.float32)
+    frame['LONGITUDE'] = rng.uniform(-74.25, -73.7, args.rows).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.partitions')
+        save_partitioned(frame, path)
+        del frame
+        df = load_dataset(path, manifest=DASHBOARD_MANIFEST)
+        index = BitmapIndex(df)
+        partitions = PartitionMap.load(path, len(df))
+        print(f"{len(df):,} rows in {len(partitions)} partitions\n")
+
+        print(f"{'plan':<28} {'rows':>10} {'words touched':>14} {'all ms':>8} {'pruned ms':>10} {'speedup':>8}")
+        for label, filters, search in PLANS:
+            plan = plan_filters(filters, compile_search_query(search), index)
+            ranges = partitions.ranges(plan)
+            full, selected = best_of(lambda: index.rows(index.select_plan(plan)), args.repeat)
+            pruned, kept = best_of(lambda: index.rows(index.select_plan(plan, ranges), ranges), args.repeat)
+            assert np.array_equal(selected, kept)
+            words = sum(last - first for first, last in index.word_spans(ranges)) / index.n_words
+            print(
+                f"{label:<28} {len(kept):>10,} {words:>13.1%} {full * 1000:>8.2f} "
+                f"{pruned * 1000:>10.2f} {full / pruned:>7.1f}x"
+            )
+
+        label, filters, search = PLANS[0]
+        plan = plan_filters(filters, compile_search_query(search), index)
+        ranges = partitions.ranges(plan)
+        before = resident_mb()
+        rows = index.rows(index.select_plan(plan, ranges), ranges)
+        # Column by column: df[[...]] would copy both columns in full first
+        coordinates = [df[col].take(rows) for col in ('LATITUDE', 'LONGITUDE')]
+        grown = resident_mb() - before
+        total = df['LATITUDE'].nbytes + df['LONGITUDE'].nbytes
+        print(
+            f"\nGathering {label}'s coordinates ({len(coordinates[0]):,} rows) grew the resident set by "
+            f"{grown:,.1f} MB of the {total / 2**20:,.1f} MB the two columns take on disk"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Crash / person star schema vs the merged table: memory, filtering, aggregation.
+
+    python -m benchmarks.bench_star [--crashes 2000000] [--persons-per-crash 2.4]
+
+Builds synthetic crashes (bench_aggregate.synthetic_frame plus coordinates
+and a COLLISION_ID) with a varying number of persons each, joins them into
+the merged table the notebook's left merge would give, and splits it back
+with CrashTables.from_merged(). Reports the memory of both layouts, how
+much the merged table inflates the crash count and injury sum, and times
+selection plus summarize() of representative plans on each: merged rows
+with BitmapIndex against crash rows with CrashIndex, and separately the
+person tables with_persons() adds from the matching persons.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from aggregation import MEASURES, PERSON_DIMENSIONS, summarize, with_persons
+from benchmarks.bench_aggregate import synthetic_frame
+from filters import BitmapIndex, compile_search_query, plan_filters
+from star import CrashIndex, CrashTables
+
+# (label, dropdown filters, search)
+PLANS = [
+    ("everything", {}, None),
+    ("one borough", {'BOROUGH': ['BOROUGH_1']}, None),
+    ("2019-2021, one vehicle", {'YEAR': [2019, 2020, 2021], 'VEHICLE_TYPE_CODE_1': ['VEHICLE_TYPE_CODE_1_1']}, None),
+    ("female pedestrians", {'PERSON_SEX': ['PERSON_SEX_1'], 'PERSON_TYPE': ['PERSON_TYPE_2']}, None),
+    ("search: killed", {}, "killed"),
+]
+
+
+def merged_frame(n_crashes, persons_per_crash, seed=0):
+    """Merged crash x person rows, each crash's rows together"""
+    rng = np.random.default_rng(seed)
+    crashes = synthetic_frame(n_crashes, seed).drop(columns=PERSON_DIMENSIONS)
+    crashes['COLLISION_ID'] = np.arange(n_crashes, dtype=np.int64) + 4_000_000
+    crashes['LATITUDE'] = rng.uniform(40.5, 40.9, n_crashes).astype(np.float32)
+    crashes['LONGITUDE'] = rng.uniform(-74.25, -73.7, n_crashes).astype(np.float32)
+    persons = np.maximum(rng.poisson(persons_per_crash - 1, n_crashes) + 1, 1)
+    merged = crashes.take(np.repeat(np.arange(n_crashes), persons)).reset_index(drop=True)
+    people = synthetic_frame(len(merged), seed + 1)
+    for col in PERSON_DIMENSIONS:
+        merged[col] = people[col]
+    return merged
+
+
+def frame_mb(df):
+    return df.memory_usage(deep=True, index=False).sum() / 2**20
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def merged_rows(merged, index, plan):
+    """The merged path: every table counts merged rows"""
+    selection = index.select_plan(plan)
+    return summarize(merged if selection is None else merged.take(index.rows(selection)))
+
+
+def crash_rows(tables, index, plan):
+    """Crash-level tables over crash rows (KPIs, borough/year/factor/vehicle charts)"""
+    selection = index.select_plan(plan)
+    if selection is None:
+        return np.arange(len(tables.crashes)), summarize(tables.crashes)
+    rows = index.rows(selection)
+    return rows, summarize(tables.crashes.take(rows))
+
+
+def person_tables(tables, index, plan, rows, summary):
+    """The person type and sex x injury tables over the matching persons"""
+    persons = index.person_rows(rows, index.person_filter(plan))
+    return with_persons(summary, summarize(tables.joined(PERSON_DIMENSIONS + MEASURES, persons)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--crashes', type=int, default=2_000_000)
+    parser.add_argument('--persons-per-crash', type=float, default=2.4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    merged = merged_frame(args.crashes, args.persons_per_crash)
+    start = time.perf_counter()
+    tables = CrashTables.from_merged(merged)
+    split = time.perf_counter() - start
+    merged_index = BitmapIndex(merged)
+    crash_index = CrashIndex(tables)
+
+    print(f"{len(tables.crashes):,} crashes, {len(tables.persons):,} persons (split in {split:.2f}s)")
+    print(f"merged table      {frame_mb(merged):>8,.1f} MB")
+    print(
+        f"crash + person    {tables.nbytes / 2**20:>8,.1f} MB "
+        f"(crashes {frame_mb(tables.crashes):,.1f}, persons {frame_mb(tables.persons):,.1f})"
+    )
+    print(f"indexes           {merged_index.nbytes / 2**20:>8,.1f} MB merged, {crash_index.nbytes / 2**20:,.1f} MB star")
+    inflated = summarize(merged)
+    exact = summarize(tables.crashes)
+    print(
+        f"merged rows count {inflated['rows']:,} crashes and {inflated['injured']:,} injured; "
+        f"the crash table {exact['rows']:,} and {exact['injured']:,}\n"
+    )
+
+    print(
+        f"{'plan':<26} {'crashes':>10} {'persons':>10} {'merged ms':>10} {'crash ms':>9} "
+        f"{'speedup':>8} {'+ persons ms':>13}"
+    )
+    for label, filters, search in PLANS:
+        merged_plan = plan_filters(filters, compile_search_query(search), merged_index)
+        star_plan = plan_filters(filters, compile_search_query(search), crash_index)
+        merged_time, _ = best_of(lambda: merged_rows(merged, merged_index, merged_plan), args.repeat)
+        crash_time, (rows, summary) = best_of(lambda: crash_rows(tables, crash_index, star_plan), args.repeat)
+        person_time, summary = best_of(
+            lambda: person_tables(tables, crash_index, star_plan, rows, summary), args.repeat
+        )
+        persons = int(summary['by']['PERSON_TYPE']['rows'].sum())
+        print(
+            f"{label:<26} {summary['rows']:>10,} {persons:>10,} {merged_time * 1000:>10.1f} "
+            f"{crash_time * 1000:>9.1f} {merged_time / crash_time:>7.1f}x {person_time * 1000:>13.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
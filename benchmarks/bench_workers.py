@@ -0,0 +1,139 @@
+"""
+Per-worker memory of the dashboard under gunicorn: private Parquet load vs
+the shared memory-mapped column store.
+
+    python -m benchmarks.bench_workers [dataset path] [--workers 1 4 16] [--scale 10]
+
+Writes the dataset (optionally repeated --scale times, so the data outweighs
+the interpreter) as Parquet and as a column store in a temporary directory,
+then starts `gunicorn app:server` with each worker count on each layout. Once
+every worker has finished loading, it reads /proc/<pid>/smaps_rollup for each
+worker and reports RSS split into shared and private pages, and the summed
+PSS, which is what the workers really cost the host together.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from data_store import DASHBOARD_MANIFEST, load_dataset, save_column_store, save_dataset
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Printed by the background loader once a worker has built everything
+READY_LINE = 'Data ready in'
+
+
+def worker_pids(master_pid):
+    """Pids of the processes whose parent is master_pid"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; ppid follows the closing paren
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def smaps_rollup(pid):
+    """Memory counters of a process in MB"""
+    counters = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                counters[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return counters
+
+
+def measure(path, workers, port, timeout):
+    """Start gunicorn on path with the given worker count and sum the workers' memory"""
+    env = dict(os.environ, CRASHLENS_DATA_PATH=path, PYTHONUNBUFFERED='1')
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:server',
+        '--workers', str(workers),
+        '--bind', f'127.0.0.1:{port}',
+        '--timeout', '600'
+    ]
+    process = subprocess.Popen(
+        command, cwd=APP_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    ready = []
+
+    def watch():
+        for line in process.stdout:
+            if READY_LINE in line:
+                ready.append(line)
+
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        deadline = time.time() + timeout
+        while len(ready) < workers:
+            if process.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"gunicorn with {workers} workers on {path} did not become ready")
+            time.sleep(0.5)
+        # Let the workers settle after their last startup allocations
+        time.sleep(2)
+        rollups = [smaps_rollup(pid) for pid in worker_pids(process.pid)]
+    finally:
+        process.terminate()
+        process.wait()
+
+    def total(*keys):
+        return sum(r.get(k, 0.0) for r in rollups for k in keys)
+
+    return {
+        'workers': len(rollups),
+        'rss': total('Rss'),
+        'shared': total('Shared_Clean', 'Shared_Dirty'),
+        'private': total('Private_Clean', 'Private_Dirty'),
+        'pss': total('Pss')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', nargs='?', default=None)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--scale', type=int, default=1, help="repeat the rows this many times")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    df = load_dataset(args.path, manifest=DASHBOARD_MANIFEST)
+    if args.scale > 1:
+        df = pd.concat([df] * args.scale, ignore_index=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        layouts = {
+            'parquet': save_dataset(df, os.path.join(tmp, 'data.parquet')),
+            'mmap': save_column_store(df, os.path.join(tmp, 'data.columns'))
+        }
+        del df
+
+        print(f"\n{'layout':<8} {'workers':>7} {'RSS/worker':>11} {'shared/worker':>14} "
+              f"{'private/worker':>15} {'total RSS':>10} {'total PSS':>10}")
+        for layout, path in layouts.items():
+            for workers in args.workers:
+                m = measure(path, workers, args.port, args.timeout)
+                n = max(m['workers'], 1)
+                print(
+                    f"{layout:<8} {m['workers']:>7} {m['rss'] / n:>9.0f}MB {m['shared'] / n:>12.0f}MB "
+                    f"{m['private'] / n:>13.0f}MB {m['rss']:>8.0f}MB {m['pss']:>8.0f}MB"
+                )
+
+
+if __name__ == '__main__':
+    main()
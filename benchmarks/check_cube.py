@@ -0,0 +1,189 @@
+"""
+Correctness check and timing for the aggregate cube.
+
+    python -m benchmarks.check_cube [dataset path] [--trials 200]
+
+For random dropdown filter combinations (plus the unfiltered view), compares
+summarize() over a slice of AggregateCube with summarize() over the raw rows
+the same filters select, and reports how long each path takes. The chart
+series and KPIs the dashboard draws from the cube summary are also compared
+with the original per-chart groupby/value_counts code over the raw rows.
+Exits with status 1 on the first mismatch.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from aggregation import AggregateCube, counts_by, gender_outcomes, summarize
+from data_store import DASHBOARD_MANIFEST, load_dataset
+from filters import INDEXED_COLUMNS, value_mask
+
+
+def random_filters(df, rng):
+    """Up to three dropdown values for a random subset of the filter columns"""
+    filters = {}
+    for col in INDEXED_COLUMNS:
+        if rng.random() < 0.35:
+            values = pd.unique(df[col].dropna())
+            picked = rng.choice(values, size=min(len(values), rng.integers(1, 4)), replace=False)
+            filters[col] = [int(v) if col == 'YEAR' else str(v) for v in picked]
+    return filters
+
+
+def row_level(df, filters):
+    """The pre-cube path: mask the raw rows one filter at a time"""
+    return summarize(filter_rows(df, filters))
+
+
+def filter_rows(df, filters):
+    """The raw rows the dropdown filters select, one filter at a time"""
+    for col, values in filters.items():
+        if col == 'YEAR':
+            df = df[df[col].isin(values)]
+        else:
+            df = df[value_mask(df[col], values)]
+    return df
+
+
+def original_charts(df):
+    """
+    The chart series and KPIs as the dashboard computed them before the cube,
+    one groupby/value_counts per chart over the filtered rows
+    """
+    charts = {'rows': len(df), 'injured': int(df['NUMBER_OF_PERSONS_INJURED'].sum()),
+              'killed': int(df['NUMBER_OF_PERSONS_KILLED'].sum())}
+    charts['danger'] = df.groupby('BOROUGH', observed=True)['NUMBER_OF_PERSONS_KILLED'].sum()
+    charts['BOROUGH'] = df['BOROUGH'].value_counts().head(10)
+    charts['YEAR'] = df['YEAR'].value_counts().sort_index()
+    charts['PERSON_TYPE'] = df['PERSON_TYPE'].value_counts().head(6)
+    charts['CONTRIBUTING_FACTOR_VEHICLE_1'] = df['CONTRIBUTING_FACTOR_VEHICLE_1'].value_counts().head(10)
+    charts['VEHICLE_TYPE_CODE_1'] = df['VEHICLE_TYPE_CODE_1'].value_counts().head(10)
+
+    gender_df = df[df['PERSON_SEX'].isin(['M', 'F'])]
+    gender_data = {
+        'Female': {'Uninjured': 0, 'Injured': 0, 'Killed': 0},
+        'Male': {'Uninjured': 0, 'Injured': 0, 'Killed': 0}
+    }
+    for sex_code, sex_label in [('F', 'Female'), ('M', 'Male')]:
+        sex_df = gender_df[gender_df['PERSON_SEX'] == sex_code]
+        if len(sex_df) > 0:
+            outcome = gender_data[sex_label]
+            outcome['Uninjured'] = len(sex_df[sex_df['PERSON_INJURY'] == 'UNINJURED'])
+            outcome['Injured'] = len(sex_df[sex_df['PERSON_INJURY'] == 'INJURED'])
+            outcome['Killed'] = len(sex_df[sex_df['PERSON_INJURY'] == 'KILLED'])
+            if outcome['Injured'] == 0:
+                outcome['Injured'] = int(sex_df['NUMBER_OF_PERSONS_INJURED'].sum())
+            if outcome['Killed'] == 0:
+                outcome['Killed'] = int(sex_df['NUMBER_OF_PERSONS_KILLED'].sum())
+            if outcome['Uninjured'] == 0:
+                outcome['Uninjured'] = max(0, len(sex_df) - outcome['Injured'] - outcome['Killed'])
+    charts['gender'] = gender_data
+    return charts
+
+
+def nonzero(series):
+    """{label: count} of a series' non-zero entries, whatever its index or dtype"""
+    return {str(label): int(count) for label, count in series.items() if count > 0}
+
+
+def chart_differences(original, summary):
+    """Where the charts drawn from a summary disagree with original_charts()"""
+    problems = []
+    for key in ('rows', 'injured', 'killed'):
+        if original[key] != summary[key]:
+            problems.append(f"KPI {key}: {original[key]} != {summary[key]}")
+    danger = summary['by']['BOROUGH']['NUMBER_OF_PERSONS_KILLED']
+    if nonzero(danger) != nonzero(original['danger']):
+        problems.append("fatalities per borough differ")
+
+    for dim, limit in [('BOROUGH', 10), ('PERSON_TYPE', 6), ('CONTRIBUTING_FACTOR_VEHICLE_1', 10),
+                       ('VEHICLE_TYPE_CODE_1', 10)]:
+        old = original[dim][original[dim] > 0]
+        new = counts_by(summary, dim).head(limit)
+        if list(old.values) != list(new.values):
+            problems.append(f"{dim} counts differ: {list(old.values)} != {list(new.values)}")
+            continue
+        # Values tied at the cut may be picked in either order; every label
+        # counted above the cut must be shown by both, with the same count
+        cut = old.values.min() if len(old) == limit else 0
+        if nonzero(old[old > cut]) != nonzero(new[new > cut]):
+            problems.append(f"{dim} labels differ")
+
+    years = summary['by']['YEAR']['rows'].sort_index()
+    if list(nonzero(years).items()) != list(nonzero(original['YEAR']).items()):
+        problems.append("crashes per year differ")
+    if original['gender'] != gender_outcomes(summary):
+        problems.append(f"gender outcomes differ: {original['gender']} != {gender_outcomes(summary)}")
+    return problems
+
+
+def differences(expected, actual):
+    problems = []
+    for key in ('rows', 'injured', 'killed'):
+        if expected[key] != actual[key]:
+            problems.append(f"{key}: {expected[key]} != {actual[key]}")
+    for dim, table in expected['by'].items():
+        if not table.sort_index().equals(actual['by'][dim].sort_index()):
+            problems.append(f"by[{dim}] differs")
+    for name, matrix in expected['sex_injury'].items():
+        if not matrix.equals(actual['sex_injury'][name]):
+            problems.append(f"sex_injury[{name}] differs")
+    if gender_outcomes(expected) != gender_outcomes(actual):
+        problems.append("gender outcomes differ")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', nargs='?', default=None)
+    parser.add_argument('--trials', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df = load_dataset(args.path, manifest=DASHBOARD_MANIFEST)
+    start = time.perf_counter()
+    cube = AggregateCube(df)
+    print(f"{len(df):,} rows -> {len(cube):,} cube groups in {time.perf_counter() - start:.2f}s")
+
+    rng = np.random.default_rng(args.seed)
+    cases = [{}] + [random_filters(df, rng) for _ in range(args.trials)]
+    row_seconds = 0.0
+    cube_seconds = 0.0
+    for filters in cases:
+        start = time.perf_counter()
+        expected = row_level(df, filters)
+        row_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = summarize(cube.slice(filters))
+        cube_seconds += time.perf_counter() - start
+
+        if expected['rows'] == 0:
+            if actual['rows'] != 0:
+                print(f"MISMATCH for {filters}: cube found {actual['rows']} rows")
+                sys.exit(1)
+            continue
+        problems = differences(expected, actual)
+        if problems:
+            print(f"MISMATCH for {filters}:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+
+        problems = chart_differences(original_charts(filter_rows(df, filters)), actual)
+        if problems:
+            print(f"MISMATCH with the original chart code for {filters}:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+
+    print(f"All {len(cases)} filter combinations match, including the original chart code")
+    print(f"Row-level path: {row_seconds / len(cases) * 1000:.1f} ms/request")
+    print(f"Cube path:      {cube_seconds / len(cases) * 1000:.1f} ms/request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Coverage check for the preview's confidence intervals (sampling.py).
+
+    python -m benchmarks.check_preview [--rows 5000000] [--sample-rows 200000] [--samples 20] [--trials 100]
+
+Loads the suite's synthetic column store for --rows (generated under
+--data-dir when missing), draws --samples stratified samples with different
+seeds, and for random dropdown filters combined with injured/killed searches
+compares every estimated KPI total with the exact one. The exact total should
+fall within the stated margin about CONFIDENCE of the time. The script prints
+the coverage per total, how wide the margins were and how long an estimate
+took, and exits with status 1 when a total's coverage is clearly below
+CONFIDENCE (by more than three binomial standard errors).
+"""
+import argparse
+import math
+import sys
+import time
+
+import numpy as np
+
+from aggregation import summarize
+from benchmarks.check_cube import random_filters
+from benchmarks.suite import dataset
+from data_store import DASHBOARD_MANIFEST, load_dataset
+from filters import BitmapIndex, compile_search_query, plan_filters, plan_state
+from sampling import CONFIDENCE, DEFAULT_ROWS, TOTALS, StratifiedSample
+
+SEARCHES = ['', 'injured', 'killed']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sample-rows', type=int, default=DEFAULT_ROWS)
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--trials', type=int, default=100)
+    parser.add_argument('--data-dir', default='benchmark_data')
+    args = parser.parse_args()
+
+    df = load_dataset(dataset(args.rows, args.seed, 1.0, args.data_dir), manifest=DASHBOARD_MANIFEST)
+    index = BitmapIndex(df)
+    rng = np.random.default_rng(args.seed)
+    cases = [({}, search) for search in SEARCHES]
+    cases += [(random_filters(df, rng), SEARCHES[rng.integers(len(SEARCHES))]) for _ in range(args.trials)]
+
+    # Distinct plans only, so a common one (e.g. every row) is not counted many times
+    exact = {}
+    for filters, search in cases:
+        plan = plan_filters(filters, compile_search_query(search), index)
+        if plan['empty'] or plan_state(plan) in exact:
+            continue
+        selection = index.select_plan(plan)
+        exact[plan_state(plan)] = (plan, summarize(df if selection is None else df.take(index.rows(selection))))
+
+    # total -> [(within margin, margin / exact)]
+    results = {total: [] for total in TOTALS}
+    skipped = 0
+    seconds = []
+    for seed in range(args.samples):
+        sample = StratifiedSample(df, args.sample_rows, seed=seed)
+        for plan, expected in exact.values():
+            start = time.perf_counter()
+            estimate = sample.estimate(plan)
+            seconds.append(time.perf_counter() - start)
+            if estimate is None:
+                skipped += 1
+                continue
+            for total, margin in estimate['margins'].items():
+                if margin is not None:
+                    within = abs(estimate[total] - expected[total]) <= margin
+                    results[total].append((within, margin / expected[total] if expected[total] else 0.0))
+
+    print(
+        f"{len(df):,} rows, {args.samples} samples of {args.sample_rows:,} rows, {len(exact)} distinct filter combinations; "
+        f"{skipped} estimates skipped (too few matching sample rows)"
+    )
+    print(f"Median estimate: {np.median(seconds) * 1000:.1f} ms")
+    print(f"{'total':<10} {'intervals':>10} {'covered':>9} {'median +/-':>11}")
+    failed = False
+    for total, outcomes in results.items():
+        if not outcomes:
+            print(f"{total:<10} {0:>10} {'-':>9} {'-':>11}")
+            continue
+        coverage = np.mean([within for within, _ in outcomes])
+        relative = np.median([r for _, r in outcomes])
+        floor = CONFIDENCE - 3 * math.sqrt(CONFIDENCE * (1 - CONFIDENCE) / len(outcomes))
+        failed |= coverage < floor
+        print(f"{total:<10} {len(outcomes):>10,} {coverage:>8.1%} {relative:>10.1%}")
+
+    if failed:
+        print(f"FAILED: coverage clearly below the {CONFIDENCE:.0%} the margins state")
+        sys.exit(1)
+    print(f"Coverage is consistent with the stated {CONFIDENCE:.0%} intervals")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""
+Load test of the dashboard's Dash callbacks under gunicorn, all on this machine.
+
+    python -m benchmarks.load_test [--data synthetic.columns] [--configs 1x1 1x4 2x4 4x4]
+                                   [--concurrency 1 4 16] [--duration 20] [--output load.json]
+    python -m benchmarks.load_test --url http://127.0.0.1:8050 --concurrency 8
+
+Starts `gunicorn app:server` with each WORKERSxTHREADS configuration (or uses
+the server at --url) and, once every worker has loaded the data, runs
+--concurrency virtual users against it at each level. Each user repeatedly
+picks a scenario from the scenario file (load_scenarios.json by default) by
+weight and plays it as the browser would, with POSTs to
+/_dash-update-component:
+
+- report      the report-filters callback with the scenario's search and
+              dropdown values, then every callback fed by the report handle
+              (KPIs, charts, map, export links) at once, up to --fanout
+              requests in flight like a browser's connection pool
+- dropdowns   the dropdown options a page load fills in
+
+The payloads are built from /_dash-dependencies, so they follow the app's
+callbacks. Users draw scenarios from generators seeded with --seed and their
+number, so a run can be replayed; --iterations fixes how many scenarios each
+user plays instead of --duration.
+
+Reports per configuration, concurrency and scenario: completed scenarios per
+second, p50/p95/p99 latency (whole scenario, first request to last response)
+and the error rate (any failed request fails the scenario). Throughput that
+stops growing with concurrency while p95 climbs is the saturation point.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from benchmarks.bench_workers import APP_DIR, READY_LINE
+
+SCENARIOS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_scenarios.json')
+
+UPDATE_PATH = '/_dash-update-component'
+
+# Inputs of the report callbacks that are not part of a scenario
+PAGE_VALUES = {
+    'generate-report-btn.n_clicks': 1,
+    'data-ready.data': True,
+    'map-weight.value': 'rows',
+    'map-view.data': None
+}
+
+FILTER_IDS = [
+    'search-input', 'borough-dropdown', 'year-dropdown', 'vehicle-dropdown', 'person-dropdown',
+    'gender-dropdown', 'contributing-factor-dropdown', 'injury-type-dropdown'
+]
+
+
+class RequestError(Exception):
+    """A callback request that failed or returned something unusable"""
+
+
+def load_scenarios(path=SCENARIOS_PATH):
+    with open(path) as f:
+        scenarios = json.load(f)['scenarios']
+    for scenario in scenarios:
+        if scenario.get('kind', 'report') not in ('report', 'dropdowns'):
+            raise ValueError(f"Scenario {scenario['name']!r}: unknown kind {scenario['kind']!r}")
+        unknown = set(scenario.get('values', {})) - set(FILTER_IDS)
+        if unknown:
+            raise ValueError(f"Scenario {scenario['name']!r}: unknown components {sorted(unknown)}")
+    return scenarios
+
+
+def _outputs(output):
+    """[{'id', 'property'}] of a dependency's output string ('..a.b...c.d..' when several)"""
+    multi = output.startswith('..')
+    parts = output[2:-2].split('...') if multi else [output]
+    outputs = [dict(zip(['id', 'property'], part.rsplit('.', 1))) for part in parts]
+    return outputs if multi else outputs[0]
+
+
+class DashClient:
+    """Builds and sends the browser's callback requests for the dashboard at base_url"""
+
+    def __init__(self, base_url, timeout=120):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.callbacks = self._get('/_dash-dependencies')
+        self.report_callback = self._find(lambda cb: cb['output'] == 'report-filters.data')
+        self.dropdown_callback = self._find(lambda cb: 'borough-dropdown.options' in cb['output'])
+        # Everything the report handle feeds on first render
+        self.output_callbacks = [
+            cb for cb in self.callbacks
+            if any(i['id'] == 'report-filters' for i in cb['inputs']) and not cb.get('prevent_initial_call')
+        ]
+
+    def _find(self, match):
+        for cb in self.callbacks:
+            if match(cb):
+                return cb
+        raise RequestError("The app has no such callback; is this the dashboard?")
+
+    def _request(self, method, path, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            raise RequestError(f"{method} {path}: {e}")
+        finally:
+            connection.close()
+        if response.status == 204:
+            # PreventUpdate
+            return None
+        if response.status != 200:
+            raise RequestError(f"{method} {path}: HTTP {response.status}")
+        return json.loads(data)
+
+    def _get(self, path):
+        return self._request('GET', path)
+
+    def call(self, callback, values):
+        """POST one callback with values ({'id.property': value}) for its inputs and state"""
+        def props(items):
+            return [{'id': i['id'], 'property': i['property'], 'value': values.get(f"{i['id']}.{i['property']}")}
+                    for i in items]
+
+        inputs = props(callback['inputs'])
+        payload = {
+            'output': callback['output'],
+            'outputs': _outputs(callback['output']),
+            'inputs': inputs,
+            'state': props(callback['state']),
+            'changedPropIds': [f"{inputs[0]['id']}.{inputs[0]['property']}"]
+        }
+        return self._request('POST', UPDATE_PATH, json.dumps(payload).encode())
+
+    def report(self, values, pool):
+        """Generate Report: the report handle, then every output it feeds in parallel"""
+        values = dict(PAGE_VALUES, **{f"{id_}.value": value for id_, value in values.items()})
+        response = self.call(self.report_callback, values)
+        handle = (response or {}).get('response', {}).get('report-filters', {}).get('data')
+        if handle is None:
+            raise RequestError("No report handle; is the data loaded?")
+        values['report-filters.data'] = handle
+        for future in [pool.submit(self.call, cb, values) for cb in self.output_callbacks]:
+            future.result()
+
+    def dropdowns(self):
+        if self.call(self.dropdown_callback, PAGE_VALUES) is None:
+            raise RequestError("Dropdown options not sent; is the data loaded?")
+
+
+def play(client, scenario, pool):
+    """One scenario; False when any of its requests failed"""
+    try:
+        if scenario.get('kind', 'report') == 'dropdowns':
+            client.dropdowns()
+        else:
+            client.report(scenario.get('values', {}), pool)
+    except RequestError:
+        return False
+    return True
+
+
+def run_users(client, scenarios, concurrency, duration, iterations, seed, fanout):
+    """[(scenario name, seconds, ok)] from concurrency users playing scenarios, plus the wall time"""
+    weights = [s.get('weight', 1) for s in scenarios]
+    records = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user(number):
+        rng = random.Random(seed * 100_003 + number)
+        played = 0
+        with ThreadPoolExecutor(max_workers=fanout) as pool:
+            while (played < iterations) if iterations else (time.perf_counter() < deadline):
+                scenario = rng.choices(scenarios, weights)[0]
+                start = time.perf_counter()
+                ok = play(client, scenario, pool)
+                with lock:
+                    records.append((scenario['name'], time.perf_counter() - start, ok))
+                played += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - start
+
+
+def summarize_records(records, elapsed):
+    """Per scenario (and 'all'): count, throughput, latency percentiles and error rate"""
+    names = sorted({name for name, _, _ in records})
+    rows = []
+    for name in names + ['all']:
+        picked = [(seconds, ok) for n, seconds, ok in records if name in ('all', n)]
+        seconds = np.array([s for s, _ in picked]) * 1000
+        errors = sum(1 for _, ok in picked if not ok)
+        p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) if len(seconds) else (0.0, 0.0, 0.0)
+        rows.append({
+            'scenario': name,
+            'count': len(picked),
+            'per_second': round(len(picked) / elapsed, 2),
+            'p50_ms': round(float(p50), 1),
+            'p95_ms': round(float(p95), 1),
+            'p99_ms': round(float(p99), 1),
+            'error_rate': round(errors / len(picked), 4) if picked else 0.0
+        })
+    return rows
+
+
+def start_gunicorn(workers, threads, port, env, timeout):
+    """gunicorn app:server with every worker's data loaded"""
+    command = [
+        sys.executable, '-m', 'gunicorn', 'app:server',
+        '--workers', str(workers),
+        '--threads', str(threads),
+        '--bind', f'127.0.0.1:{port}',
+        '--timeout', '600'
+    ]
+    process = subprocess.Popen(
+        command, cwd=APP_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    ready = []
+
+    def watch():
+        for line in process.stdout:
+            if READY_LINE in line:
+                ready.append(line)
+
+    threading.Thread(target=watch, daemon=True).start()
+    deadline = time.time() + timeout
+    while len(ready) < workers:
+        if process.poll() is not None or time.time() > deadline:
+            process.terminate()
+            raise RuntimeError(f"gunicorn with {workers} workers x {threads} threads did not become ready")
+        time.sleep(0.5)
+    return process
+
+
+def print_rows(label, rows):
+    print(f"\n{label}")
+    print(f"{'scenario':<28} {'count':>7} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for r in rows:
+        print(
+            f"{r['scenario']:<28} {r['count']:>7,} {r['per_second']:>8.2f} {r['p50_ms']:>8.1f} "
+            f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['error_rate']:>7.1%}"
+        )
+
+
+def run_levels(base_url, scenarios, args, config):
+    """Every concurrency level against one server; returns the result entries"""
+    client = DashClient(base_url)
+    # Warm up: every scenario once, so first-request setup is not measured
+    with ThreadPoolExecutor(max_workers=args.fanout) as pool:
+        failed = [s['name'] for s in scenarios if not play(client, s, pool)]
+    if failed:
+        print(f"Warning: scenarios failing before the test: {failed}")
+    results = []
+    for concurrency in args.concurrency:
+        records, elapsed = run_users(
+            client, scenarios, concurrency, args.duration, args.iterations, args.seed, args.fanout
+        )
+        rows = summarize_records(records, elapsed)
+        print_rows(f"{config}, {concurrency} concurrent users, {elapsed:.1f}s", rows)
+        results.append({'config': config, 'concurrency': concurrency, 'seconds': round(elapsed, 2), 'scenarios': rows})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help="test a running server instead of starting gunicorn")
+    parser.add_argument('--data', help="dataset for the gunicorn runs (CRASHLENS_DATA_PATH)")
+    parser.add_argument('--configs', nargs='+', default=['1x1', '1x4', '2x4', '4x4'],
+                        help="gunicorn WORKERSxTHREADS configurations")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=20, help="seconds per concurrency level")
+    parser.add_argument('--iterations', type=int, help="scenarios per user instead of --duration")
+    parser.add_argument('--scenarios', default=SCENARIOS_PATH)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fanout', type=int, default=6, help="requests a user keeps in flight")
+    parser.add_argument('--no-cache', action='store_true', help="disable the result cache (CRASHLENS_CACHE_MB=0)")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--timeout', type=float, default=600, help="seconds allowed for startup")
+    parser.add_argument('--output', help="write the results as JSON")
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.scenarios)
+    if args.url:
+        results = run_levels(args.url, scenarios, args, args.url)
+    else:
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        if args.data:
+            env['CRASHLENS_DATA_PATH'] = os.path.abspath(args.data)
+        if args.no_cache:
+            env['CRASHLENS_CACHE_MB'] = '0'
+        results = []
+        for config in args.configs:
+            workers, threads = (int(n) for n in config.lower().split('x'))
+            process = start_gunicorn(workers, threads, args.port, env, args.timeout)
+            try:
+                results += run_levels(f'http://127.0.0.1:{args.port}', scenarios, args, config)
+            finally:
+                process.terminate()
+                process.wait()
+
+    print(f"\n{'config':<24} {'users':>6} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for result in results:
+        total = result['scenarios'][-1]
+        print(
+            f"{result['config']:<24} {result['concurrency']:>6} {total['per_second']:>8.2f} {total['p50_ms']:>8.1f} "
+            f"{total['p95_ms']:>8.1f} {total['p99_ms']:>8.1f} {total['error_rate']:>7.1%}"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'cpus': os.cpu_count(),
+                'data': args.data,
+                'seed': args.seed,
+                'scenarios': args.scenarios,
+                'results': results
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
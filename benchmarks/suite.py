@@ -0,0 +1,258 @@
+"""
+Dashboard benchmark suite on seeded synthetic data: cold start, dropdowns, reports, memory.
+
+    python -m benchmarks.suite [--sizes 1000000 5000000 20000000] [--seed 0] [--repeat 5]
+                               [--output benchmark_results.json] [--compare old_results.json]
+
+For each size, writes a synthetic column store of the dashboard's columns
+(benchmarks/synthetic.py) under --data-dir, reused by later runs with the same
+size, seed and persons per crash. A fresh Python process then loads it as the
+app would (CRASHLENS_DATA_PATH, result cache off) and measures:
+
+- cold start   importing app.py until the background loader is ready
+- dropdowns    update_dropdown_options() once the data is ready
+- reports      each SCENARIOS entry end to end: resolve_filters(), every
+               KPI/chart/map callback and the JSON encoding Dash sends back,
+               with the per-process resolved reports cleared between repeats
+- memory       the process's peak RSS after loading and after the reports
+
+Results go to --output as JSON (machine, commit and settings, then one run
+per size); --compare prints each timing next to the same one in an earlier
+results file.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (label, resolve_filters() keyword arguments): dropdowns, searches, person
+# filters, outcome searches that need the rows, and a contradiction
+SCENARIOS = [
+    ("everything", {}),
+    ("one borough", {'boroughs': ['BROOKLYN']}),
+    ("borough + year", {'boroughs': ['BROOKLYN'], 'years': [2023]}),
+    ("multi-select", {
+        'boroughs': ['BRONX', 'QUEENS'], 'years': [2019, 2020, 2021],
+        'vehicles': ['SEDAN', 'TAXI'], 'genders': ['F']
+    }),
+    ("person filters", {'persons': ['PEDESTRIAN'], 'injury_types': ['INJURED', 'KILLED']}),
+    ("search: brooklyn 2020 male", {'search_query': 'brooklyn 2020 male'}),
+    ("search: injured sedan 2015", {'search_query': 'injured sedan 2015'}),
+    ("search: pedestrian killed", {'search_query': 'pedestrian killed'}),
+    ("rare: staten island killed", {'search_query': 'killed', 'boroughs': ['STATEN ISLAND']}),
+    ("no match", {'search_query': 'queens', 'boroughs': ['MANHATTAN']}),
+]
+
+# resolve_filters() inputs left empty by a scenario
+NO_FILTERS = dict.fromkeys([
+    'search_query', 'boroughs', 'years', 'vehicles', 'persons', 'genders', 'contributing_factors', 'injury_types'
+])
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (ru_maxrss is in kB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(func, repeat):
+    """Every wall time of repeat calls, plus the last result"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def dashboard(app, kwargs):
+    """One report as the browser requests it: the handle, then every output"""
+    import plotly
+
+    report = app.resolve_filters(1, True, **dict(NO_FILTERS, **kwargs))
+    outputs = [
+        app.update_kpis(report),
+        app.update_borough_chart(report),
+        app.update_time_chart(report),
+        app.update_person_type_chart(report),
+        app.update_factor_chart(report),
+        app.update_vehicle_chart(report),
+        app.update_gender_chart(report),
+        app.update_map(report, 'rows', None)
+    ]
+    json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder)
+    return report
+
+
+def measure(repeat):
+    """Run inside the child process: time the app on CRASHLENS_DATA_PATH"""
+    start = time.perf_counter()
+    import app
+    if not app.data_loader.wait():
+        raise RuntimeError(f"Data failed to load: {app.data_loader.status()['error']}")
+    cold_start = time.perf_counter() - start
+    loaded_rss = peak_rss_mb()
+
+    dropdown_times, _ = timed(lambda: app.update_dropdown_options(True), repeat)
+
+    scenarios = []
+    for label, kwargs in SCENARIOS:
+        def run():
+            app.resolved_reports.clear()
+            return dashboard(app, kwargs)
+
+        times, report = timed(run, repeat)
+        resolve_times, _ = timed(lambda: (app.resolved_reports.clear(), app.resolve_report(report)), repeat)
+        scenarios.append({
+            'label': label,
+            'rows': int(app.resolve_report(report)['summary']['rows']),
+            'ms': round(statistics.median(times) * 1000, 2),
+            'best_ms': round(min(times) * 1000, 2),
+            'resolve_ms': round(statistics.median(resolve_times) * 1000, 2)
+        })
+
+    return {
+        'rows': len(app.df_global) if app.crash_tables is None else int(app.crash_tables.persons.shape[0]),
+        'crashes': len(app.df_global),
+        'cold_start_s': round(cold_start, 3),
+        'dropdown_ms': round(statistics.median(dropdown_times) * 1000, 2),
+        'loaded_rss_mb': round(loaded_rss, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'scenarios': scenarios
+    }
+
+
+def dataset(size, seed, persons_per_crash, data_dir):
+    """Path of the synthetic column store for a size, generated when missing"""
+    path = os.path.join(data_dir, f"synthetic_{size}_seed{seed}_ppc{persons_per_crash:g}.columns")
+    if not os.path.exists(os.path.join(path, 'schema.json')):
+        os.makedirs(data_dir, exist_ok=True)
+        # In its own process so the generator's memory is returned before measuring
+        subprocess.run([
+            sys.executable, '-m', 'benchmarks.synthetic', '--rows', str(size), '--seed', str(seed),
+            '--persons-per-crash', str(persons_per_crash), '--columns', 'dashboard', '--output', path
+        ], cwd=APP_DIR, check=True)
+    return path
+
+
+def run_size(path, repeat, timeout):
+    """Measure one dataset in a fresh interpreter, so every run starts cold"""
+    env = dict(os.environ, CRASHLENS_DATA_PATH=path, CRASHLENS_CACHE_MB='0', PYTHONUNBUFFERED='1')
+    env.pop('CRASHLENS_CACHE_PATH', None)
+    with tempfile.NamedTemporaryFile(suffix='.json') as result:
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.suite', '--measure', '--repeat', str(repeat), '--result', result.name],
+            cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, check=True, timeout=timeout
+        )
+        with open(result.name) as f:
+            return json.load(f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run):
+    print(
+        f"\n{run['size']:,} rows ({run['crashes']:,} crashes): cold start {run['cold_start_s']:.2f}s, "
+        f"dropdowns {run['dropdown_ms']:.2f} ms, peak RSS {run['loaded_rss_mb']:,.0f} MB loaded / "
+        f"{run['peak_rss_mb']:,.0f} MB after reports"
+    )
+    print(f"{'scenario':<28} {'matches':>11} {'median ms':>10} {'best ms':>9} {'resolve ms':>11}")
+    for s in run['scenarios']:
+        print(f"{s['label']:<28} {s['rows']:>11,} {s['ms']:>10.1f} {s['best_ms']:>9.1f} {s['resolve_ms']:>11.1f}")
+
+
+def compare(results, old):
+    """Each timing and memory figure next to the same one in an older results file"""
+    def change(new, before):
+        return f"{before:>10,.2f} {new:>10,.2f} {(new - before) / before * 100 if before else 0.0:>+8.1f}%"
+
+    old_runs = {run['size']: run for run in old['runs']}
+    print(f"\nCompared with {old.get('commit') or 'an earlier run'} ({old.get('created')})")
+    for setting in ('seed', 'persons_per_crash', 'cpus'):
+        if old.get(setting) != results[setting]:
+            print(f"Note: {setting} differs ({old.get(setting)} before, {results[setting]} now)")
+    if not set(old_runs) & {run['size'] for run in results['runs']}:
+        print("No sizes in common")
+        return
+    print(f"{'size':>11} {'measure':<34} {'before':>10} {'after':>10} {'change':>9}")
+    for run in results['runs']:
+        before = old_runs.get(run['size'])
+        if before is None:
+            continue
+        rows = [
+            ('cold start s', run['cold_start_s'], before['cold_start_s']),
+            ('dropdowns ms', run['dropdown_ms'], before['dropdown_ms']),
+            ('peak RSS MB', run['peak_rss_mb'], before['peak_rss_mb'])
+        ]
+        old_scenarios = {s['label']: s for s in before['scenarios']}
+        rows += [
+            (f"{s['label']} ms", s['ms'], old_scenarios[s['label']]['ms'])
+            for s in run['scenarios'] if s['label'] in old_scenarios
+        ]
+        for label, new, value in rows:
+            print(f"{run['size']:>11,} {label:<34} {change(new, value)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 5_000_000, 20_000_000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--persons-per-crash', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data-dir', default='benchmark_data')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds allowed per size")
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        run = measure(args.repeat)
+        with open(args.result, 'w') as f:
+            json.dump(run, f)
+        return
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'persons_per_crash': args.persons_per_crash,
+        'repeat': args.repeat,
+        'runs': []
+    }
+    for size in args.sizes:
+        path = dataset(size, args.seed, args.persons_per_crash, args.data_dir)
+        run = dict(size=size, **run_size(path, args.repeat, args.timeout))
+        print_run(run)
+        results['runs'].append(run)
+        # Written after every size, so a long run keeps what it has measured
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
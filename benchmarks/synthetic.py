@@ -0,0 +1,419 @@
+"""
+Seeded synthetic NYC collisions in the merged crash x person schema.
+
+    python -m benchmarks.synthetic --rows 5000000 [--seed 0] [--persons-per-crash 1]
+                                   [--columns all|dashboard] [--output synthetic.columns]
+
+The real exports cannot be downloaded offline, so benchmarks run on rows
+drawn from distributions shaped like them (NYC Open Data, 2012-2025):
+
+- BOROUGH     about 31% of crashes have none; Brooklyn and Queens lead
+- YEAR        ~200k crashes a year until 2019, about half that since 2020,
+              2012 and 2025 partial
+- vehicles    sedans and SUVs make up most crashes, then a long tail of
+              rare types; contributing factors are mostly UNKNOWN
+              (unspecified) or driver inattention, then a long tail
+- persons     M / F / UNKNOWN sex about 56 / 30 / 14; KILLED about 1 in
+              1,000 persons, INJURED about 1 in 7
+- LATITUDE / LONGITUDE  scattered around each borough inside NYC_BOUNDS,
+              about 9% missing and a few at (0, 0) as in the raw data
+
+Labels are the standardized ones pipeline.py writes, and the columns are the
+ones it writes, in the same order. Like the notebook, each crash has a
+single person row by default; --persons-per-crash above 1 gives crashes a
+Poisson number of persons (at least one) for the star schema (star.py).
+
+Rows are generated CHUNK_ROWS at a time from a generator seeded with (seed,
+chunk), so the same seed and row count always give the same data. The
+output format follows the extension: .csv is streamed chunk by chunk; a
+.parquet file, a .columns column store or a .partitions store is written
+from the whole frame (use --columns dashboard to keep 20M rows in memory).
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_store import DASHBOARD_MANIFEST, manifest_columns, save_column_store, save_dataset
+from spatial import NYC_BOUNDS
+
+CHUNK_ROWS = 1_000_000
+
+# Column order of pipeline.py's merged output
+MERGED_COLUMNS = [
+    'CRASH_DATE_CRASH', 'CRASH_TIME_CRASH', 'BOROUGH', 'ZIP_CODE', 'LATITUDE', 'LONGITUDE', 'LOCATION',
+    'ON_STREET_NAME', 'CROSS_STREET_NAME', 'OFF_STREET_NAME',
+    'NUMBER_OF_PERSONS_INJURED', 'NUMBER_OF_PERSONS_KILLED',
+    'NUMBER_OF_PEDESTRIANS_INJURED', 'NUMBER_OF_PEDESTRIANS_KILLED',
+    'NUMBER_OF_CYCLIST_INJURED', 'NUMBER_OF_CYCLIST_KILLED',
+    'NUMBER_OF_MOTORIST_INJURED', 'NUMBER_OF_MOTORIST_KILLED',
+    'CONTRIBUTING_FACTOR_VEHICLE_1', 'CONTRIBUTING_FACTOR_VEHICLE_2', 'COLLISION_ID',
+    'VEHICLE_TYPE_CODE_1', 'VEHICLE_TYPE_CODE_2', 'YEAR', 'UNIQUE_ID', 'CRASH_DATE_PERSON', 'CRASH_TIME_PERSON',
+    'PERSON_ID', 'PERSON_TYPE', 'PERSON_INJURY', 'VEHICLE_ID', 'PERSON_AGE', 'EJECTION', 'EMOTIONAL_STATUS',
+    'BODILY_INJURY', 'POSITION_IN_VEHICLE', 'SAFETY_EQUIPMENT', 'PED_LOCATION', 'PED_ACTION', 'COMPLAINT',
+    'PED_ROLE', 'CONTRIBUTING_FACTOR_1', 'CONTRIBUTING_FACTOR_2', 'PERSON_SEX',
+    'PERSON_AGE_was_missing', 'LATITUDE_was_missing', 'LONGITUDE_was_missing'
+]
+
+# Crash columns the dashboard reads, plus what they are derived from
+DASHBOARD_COLUMNS = ['CRASH_DATE_CRASH'] + manifest_columns(DASHBOARD_MANIFEST)
+
+# Share of crashes per borough; about a third of the records have none
+BOROUGH_WEIGHTS = {
+    'BROOKLYN': 0.22,
+    'QUEENS': 0.185,
+    'MANHATTAN': 0.155,
+    'BRONX': 0.10,
+    'STATEN ISLAND': 0.03,
+    'UNKNOWN': 0.31
+}
+
+# Rough centre and spread (degrees) of each borough's crashes
+BOROUGH_CENTRES = {
+    'BROOKLYN': (40.65, -73.95, 0.035),
+    'QUEENS': (40.72, -73.82, 0.05),
+    'MANHATTAN': (40.77, -73.97, 0.03),
+    'BRONX': (40.84, -73.88, 0.03),
+    'STATEN ISLAND': (40.59, -74.13, 0.035)
+}
+
+# First three digits of the ZIP codes of each borough
+BOROUGH_ZIPS = {
+    'BROOKLYN': 112,
+    'QUEENS': 113,
+    'MANHATTAN': 100,
+    'BRONX': 104,
+    'STATEN ISLAND': 103
+}
+
+# Crashes per year (thousands); 2012 starts in July, 2025 is partial
+YEAR_WEIGHTS = {
+    2012: 100, 2013: 203, 2014: 206, 2015: 217, 2016: 229, 2017: 231, 2018: 231,
+    2019: 211, 2020: 112, 2021: 110, 2022: 104, 2023: 96, 2024: 91, 2025: 50
+}
+
+# Common values and their shares; the rest of each column goes to a long
+# tail of rare values with Zipf-like frequencies
+VEHICLE_WEIGHTS = {
+    'SEDAN': 0.30,
+    'SPORT UTILITY / STATION WAGON': 0.25,
+    'PASSENGER VEHICLE': 0.11,
+    'UNKNOWN': 0.05,
+    'TAXI': 0.04,
+    'PICK-UP TRUCK': 0.025,
+    'BOX TRUCK': 0.02,
+    'BUS': 0.015,
+    'BICYCLE': 0.015,
+    'VAN': 0.01,
+    'MOTORCYCLE': 0.008,
+    'TRACTOR TRUCK DIESEL': 0.007,
+    'E-BIKE': 0.006,
+    'AMBULANCE': 0.003,
+    'E-SCOOTER': 0.003,
+    'MOPED': 0.002
+}
+VEHICLE_TAIL = 150
+
+FACTOR_WEIGHTS = {
+    'UNKNOWN': 0.36,
+    'DRIVER INATTENTION/DISTRACTION': 0.20,
+    'FAILURE TO YIELD RIGHT-OF-WAY': 0.06,
+    'FOLLOWING TOO CLOSELY': 0.055,
+    'BACKING UNSAFELY': 0.04,
+    'OTHER VEHICULAR': 0.03,
+    'PASSING OR LANE USAGE IMPROPER': 0.03,
+    'PASSING TOO CLOSELY': 0.025,
+    'TURNING IMPROPERLY': 0.025,
+    'UNSAFE LANE CHANGING': 0.02,
+    'TRAFFIC CONTROL DISREGARDED': 0.015,
+    'DRIVER INEXPERIENCE': 0.015,
+    'UNSAFE SPEED': 0.013,
+    'ALCOHOL INVOLVEMENT': 0.01,
+    'PAVEMENT SLIPPERY': 0.008,
+    'VIEW OBSTRUCTED/LIMITED': 0.008
+}
+FACTOR_TAIL = 45
+
+PERSON_TYPE_WEIGHTS = {
+    'DRIVER': 0.42,
+    'PASSENGER': 0.38,
+    'PEDESTRIAN': 0.11,
+    'BICYCLIST': 0.05,
+    'UNKNOWN': 0.04
+}
+
+PERSON_SEX_WEIGHTS = {'M': 0.56, 'F': 0.30, 'UNKNOWN': 0.14}
+
+PERSON_INJURY_WEIGHTS = {'UNINJURED': 0.859, 'INJURED': 0.14, 'KILLED': 0.001}
+
+STREET_NAMES = [
+    'BROADWAY', 'ATLANTIC AVENUE', 'NORTHERN BOULEVARD', 'QUEENS BOULEVARD', 'FLATBUSH AVENUE',
+    'GRAND CONCOURSE', 'BELT PARKWAY', 'LONG ISLAND EXPRESSWAY', 'BROOKLYN QUEENS EXPRESSWAY',
+    'FDR DRIVE', 'MAJOR DEEGAN EXPRESSWAY', 'HYLAN BOULEVARD', 'JAMAICA AVENUE', 'OCEAN PARKWAY'
+]
+STREET_TAIL = 2000
+
+MISSING_COORDINATES = 0.09
+ZERO_COORDINATES = 0.003
+
+
+def _tail(prefix, n):
+    return [f"{prefix} {i:03d}" for i in range(1, n + 1)]
+
+
+def _distribution(weights, tail=()):
+    """Labels and probabilities: the given shares, then tail values sharing the rest 1/rank"""
+    labels = list(weights)
+    shares = np.array(list(weights.values()), dtype=np.float64)
+    if len(tail):
+        rest = max(1.0 - shares.sum(), 0.0)
+        ranks = 1.0 / np.arange(1, len(tail) + 1)
+        labels += list(tail)
+        shares = np.concatenate([shares, rest * ranks / ranks.sum()])
+    return labels, shares / shares.sum()
+
+
+DISTRIBUTIONS = {
+    'BOROUGH': _distribution(BOROUGH_WEIGHTS),
+    'VEHICLE_TYPE_CODE_1': _distribution(VEHICLE_WEIGHTS, _tail('VEHICLE TYPE', VEHICLE_TAIL)),
+    'VEHICLE_TYPE_CODE_2': _distribution(VEHICLE_WEIGHTS, _tail('VEHICLE TYPE', VEHICLE_TAIL)),
+    'CONTRIBUTING_FACTOR_VEHICLE_1': _distribution(FACTOR_WEIGHTS, _tail('FACTOR', FACTOR_TAIL)),
+    'CONTRIBUTING_FACTOR_VEHICLE_2': _distribution(FACTOR_WEIGHTS, _tail('FACTOR', FACTOR_TAIL)),
+    'PERSON_TYPE': _distribution(PERSON_TYPE_WEIGHTS),
+    'PERSON_SEX': _distribution(PERSON_SEX_WEIGHTS),
+    'PERSON_INJURY': _distribution(PERSON_INJURY_WEIGHTS),
+    'ON_STREET_NAME': _distribution({'Unknown': 0.25}, STREET_NAMES + _tail('STREET', STREET_TAIL)),
+    'CROSS_STREET_NAME': _distribution({'Unknown': 0.4}, STREET_NAMES + _tail('STREET', STREET_TAIL)),
+    'OFF_STREET_NAME': _distribution({'Unknown': 0.85}, _tail('STREET', STREET_TAIL))
+}
+
+# The remaining person columns: a handful of values each, first most common
+PERSON_DETAILS = {
+    'EJECTION': ['Not Ejected', 'Unknown', 'Ejected'],
+    'EMOTIONAL_STATUS': ['Unknown', 'Conscious', 'Does Not Apply', 'Shock', 'Unconscious'],
+    'BODILY_INJURY': ['Unknown', 'Does Not Apply', 'Back', 'Neck', 'Head', 'Knee-Lower Leg Foot'],
+    'POSITION_IN_VEHICLE': ['Driver', 'Unknown', 'Front passenger', 'Right rear passenger'],
+    'SAFETY_EQUIPMENT': ['Lap Belt & Harness', 'Unknown', 'None', 'Lap Belt', 'Air Bag Deployed'],
+    'PED_LOCATION': ['Unknown', 'Pedestrian/Bicyclist/Other Pedestrian at Intersection'],
+    'PED_ACTION': ['Unknown', 'Crossing With Signal', 'Crossing Against Signal'],
+    'COMPLAINT': ['None', 'Complaint of Pain or Nausea', 'Does Not Apply', 'Minor Bleeding'],
+    'PED_ROLE': ['Driver', 'Passenger', 'Pedestrian', 'Registrant'],
+    'CONTRIBUTING_FACTOR_1': ['UNSPECIFIED', 'DRIVER INATTENTION/DISTRACTION', 'UNKNOWN'],
+    'CONTRIBUTING_FACTOR_2': ['UNSPECIFIED', 'UNKNOWN']
+}
+
+
+def _categorical(rng, col, n):
+    labels, shares = DISTRIBUTIONS[col]
+    codes = rng.choice(len(labels), size=n, p=shares).astype(np.int16)
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def _details(rng, labels, n):
+    # Geometric shares: each value about half as common as the one before
+    shares = 0.5 ** np.arange(len(labels))
+    codes = rng.choice(len(labels), size=n, p=shares / shares.sum()).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def _crash_dates(rng, n):
+    years = np.array(list(YEAR_WEIGHTS))
+    weights = np.array(list(YEAR_WEIGHTS.values()), dtype=np.float64)
+    year = rng.choice(years, size=n, p=weights / weights.sum())
+    # 2012 starts in July, 2025 ends in June
+    first_day = np.where(year == 2012, 182, 0)
+    last_day = np.where(year == 2025, 181, 365)
+    day = first_day + (rng.random(n) * (last_day - first_day)).astype(np.int64)
+    starts = pd.to_datetime(year.astype(str), format='%Y').to_numpy()
+    return starts + day.astype('timedelta64[D]')
+
+
+def _coordinates(rng, boroughs):
+    n = len(boroughs)
+    names = np.asarray(boroughs.categories)[boroughs.codes]
+    # Crashes without a borough still happened somewhere in the city
+    known = list(BOROUGH_CENTRES)
+    names = np.where(names == 'UNKNOWN', np.asarray(known)[rng.integers(0, len(known), n)], names)
+    lat = np.empty(n)
+    lon = np.empty(n)
+    for name, (centre_lat, centre_lon, spread) in BOROUGH_CENTRES.items():
+        rows = names == name
+        lat[rows] = rng.normal(centre_lat, spread, rows.sum())
+        lon[rows] = rng.normal(centre_lon, spread * 1.3, rows.sum())
+    lat = np.clip(lat, *NYC_BOUNDS['lat'])
+    lon = np.clip(lon, *NYC_BOUNDS['lon'])
+    draw = rng.random(n)
+    lat[draw < ZERO_COORDINATES] = 0.0
+    lon[draw < ZERO_COORDINATES] = 0.0
+    missing = draw > 1 - MISSING_COORDINATES
+    lat[missing] = np.nan
+    lon[missing] = np.nan
+    return names, lat, lon
+
+
+def _casualties(rng, injury, person_type):
+    """Crash-level counts consistent with the person row: its own outcome plus others'"""
+    n = len(injury)
+    injured = (injury == 'INJURED').astype(np.int64) + rng.poisson(0.12, n)
+    killed = (injury == 'KILLED').astype(np.int64) + (rng.random(n) < 0.0003)
+    counts = {}
+    for kind, types in (('PEDESTRIANS', ['PEDESTRIAN']), ('CYCLIST', ['BICYCLIST'])):
+        own = np.isin(person_type, types)
+        counts[f'NUMBER_OF_{kind}_INJURED'] = np.where(own, injured, 0)
+        counts[f'NUMBER_OF_{kind}_KILLED'] = np.where(own, killed, 0)
+    motorist = ~np.isin(person_type, ['PEDESTRIAN', 'BICYCLIST'])
+    counts['NUMBER_OF_MOTORIST_INJURED'] = np.where(motorist, injured, 0)
+    counts['NUMBER_OF_MOTORIST_KILLED'] = np.where(motorist, killed, 0)
+    counts['NUMBER_OF_PERSONS_INJURED'] = injured
+    counts['NUMBER_OF_PERSONS_KILLED'] = killed
+    return counts
+
+
+def generate_chunk(n_crashes, seed, chunk, first_id, first_row=0, persons_per_crash=1.0, columns=None):
+    """
+    One chunk of merged rows for n_crashes crashes with COLLISION_IDs from
+    first_id (and UNIQUE_IDs from first_row), ordered by COLLISION_ID. columns limits what is built (all of
+    MERGED_COLUMNS by default).
+    """
+    rng = np.random.default_rng([seed, chunk])
+    wanted = set(MERGED_COLUMNS if columns is None else columns)
+    if persons_per_crash > 1:
+        persons = np.maximum(rng.poisson(persons_per_crash - 1, n_crashes) + 1, 1)
+    else:
+        persons = np.ones(n_crashes, dtype=np.int64)
+    n = int(persons.sum())
+    crash_of_row = np.repeat(np.arange(n_crashes), persons)
+
+    # Crash attributes, drawn per crash and repeated for each of its persons
+    dates = _crash_dates(rng, n_crashes)
+    boroughs = _categorical(rng, 'BOROUGH', n_crashes)
+    located, lat, lon = _coordinates(rng, boroughs)
+    crash = {
+        'CRASH_DATE_CRASH': dates,
+        'BOROUGH': boroughs,
+        'LATITUDE': lat,
+        'LONGITUDE': lon,
+        'COLLISION_ID': np.arange(first_id, first_id + n_crashes, dtype=np.int64),
+        'YEAR': pd.DatetimeIndex(dates).year.to_numpy().astype(np.int16)
+    }
+    for col in ('VEHICLE_TYPE_CODE_1', 'VEHICLE_TYPE_CODE_2', 'CONTRIBUTING_FACTOR_VEHICLE_1',
+                'CONTRIBUTING_FACTOR_VEHICLE_2', 'ON_STREET_NAME', 'CROSS_STREET_NAME', 'OFF_STREET_NAME'):
+        if col in wanted:
+            crash[col] = _categorical(rng, col, n_crashes)
+    if 'CRASH_TIME_CRASH' in wanted:
+        minutes = rng.integers(0, 24 * 60, n_crashes)
+        crash['CRASH_TIME_CRASH'] = pd.Series(minutes // 60).astype(str).str.cat(
+            pd.Series(minutes % 60).astype(str).str.zfill(2), sep=':'
+        ).to_numpy()
+    if 'ZIP_CODE' in wanted:
+        prefix = np.array([BOROUGH_ZIPS.get(b, 0) for b in located])
+        crash['ZIP_CODE'] = np.where(prefix > 0, prefix * 100 + rng.integers(0, 40, n_crashes), 11201)
+    if 'LOCATION' in wanted:
+        crash['LOCATION'] = pd.Series(np.round(lat, 4)).astype(str).radd('(').str.cat(
+            pd.Series(np.round(lon, 4)).astype(str), sep=', ').add(')').to_numpy()
+
+    # Person attributes, one draw per row
+    person_type = _categorical(rng, 'PERSON_TYPE', n)
+    injury = _categorical(rng, 'PERSON_INJURY', n)
+    person = {
+        'PERSON_TYPE': person_type,
+        'PERSON_INJURY': injury,
+        'PERSON_SEX': _categorical(rng, 'PERSON_SEX', n),
+        'UNIQUE_ID': 10_000_000 + first_row + np.arange(n, dtype=np.int64)
+    }
+    # Crash counts include the crash's own persons' outcomes (the first person's here)
+    first_person = np.concatenate([[0], np.cumsum(persons)[:-1]])
+    crash.update(_casualties(rng, np.asarray(injury)[first_person], np.asarray(person_type)[first_person]))
+    for col, labels in PERSON_DETAILS.items():
+        if col in wanted:
+            person[col] = _details(rng, labels, n)
+    if 'PERSON_AGE' in wanted or 'PERSON_AGE_was_missing' in wanted:
+        age = np.clip(rng.normal(40, 17, n), 0, 100).round()
+        missing_age = rng.random(n) < 0.1
+        person['PERSON_AGE'] = np.where(missing_age, 38.0, age)
+        person['PERSON_AGE_was_missing'] = missing_age.astype(np.int8)
+    if 'VEHICLE_ID' in wanted:
+        person['VEHICLE_ID'] = rng.integers(100_000, 20_000_000, n).astype(np.float64)
+    if 'PERSON_ID' in wanted:
+        person['PERSON_ID'] = pd.Series(person['UNIQUE_ID']).map('{:x}'.format).radd('p').to_numpy()
+
+    data = {}
+    for col in MERGED_COLUMNS:
+        if col not in wanted:
+            continue
+        if col in crash:
+            values = crash[col]
+            data[col] = values.take(crash_of_row) if isinstance(values, pd.Categorical) else values[crash_of_row]
+        elif col in person:
+            data[col] = person[col]
+        elif col == 'CRASH_DATE_PERSON':
+            data[col] = crash['CRASH_DATE_CRASH'][crash_of_row]
+        elif col == 'CRASH_TIME_PERSON' and 'CRASH_TIME_CRASH' in crash:
+            data[col] = crash['CRASH_TIME_CRASH'][crash_of_row]
+        elif col in ('LATITUDE_was_missing', 'LONGITUDE_was_missing'):
+            data[col] = np.isnan(lat[crash_of_row]).astype(np.int8)
+    return pd.DataFrame(data)
+
+
+def generate(n_rows, seed=0, persons_per_crash=1.0, columns=None, chunk_rows=CHUNK_ROWS):
+    """
+    DataFrames of about n_rows merged rows in total, a chunk at a time (with
+    several persons per crash the row count is approximate).
+    """
+    crashes = max(int(round(n_rows / max(persons_per_crash, 1.0))), 1)
+    per_chunk = max(int(chunk_rows / max(persons_per_crash, 1.0)), 1)
+    first_id = 4_000_000
+    rows = 0
+    for chunk, start in enumerate(range(0, crashes, per_chunk)):
+        n_crashes = min(per_chunk, crashes - start)
+        frame = generate_chunk(n_crashes, seed, chunk, first_id + start, rows, persons_per_crash, columns)
+        rows += len(frame)
+        yield frame
+
+
+def synthetic_dataset(n_rows, seed=0, persons_per_crash=1.0, columns=None):
+    """The whole synthetic frame at once"""
+    frames = list(generate(n_rows, seed, persons_per_crash, columns))
+    # Every chunk shares its categories, so concatenating keeps the categoricals
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_dataset(path, n_rows, seed=0, persons_per_crash=1.0, columns=None):
+    """Write a synthetic dataset in the format path's extension names; returns the row count"""
+    if path.endswith('.csv'):
+        rows = 0
+        for chunk in generate(n_rows, seed, persons_per_crash, columns):
+            chunk.to_csv(path, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+            rows += len(chunk)
+        return rows
+
+    df = synthetic_dataset(n_rows, seed, persons_per_crash, columns)
+    if path.endswith('.partitions'):
+        from partitions import save_partitioned
+        save_partitioned(df, path)
+    elif path.endswith('.columns'):
+        save_column_store(df, path)
+    else:
+        save_dataset(df, path)
+    return len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--persons-per-crash', type=float, default=1.0)
+    parser.add_argument('--columns', choices=['all', 'dashboard'], default='all')
+    parser.add_argument('--output', default='synthetic.csv',
+                        help="a .csv, .parquet, .columns or .partitions path")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    columns = DASHBOARD_COLUMNS if args.columns == 'dashboard' else None
+    rows = write_dataset(args.output, args.rows, args.seed, args.persons_per_crash, columns)
+    print(f"Wrote {rows:,} synthetic rows (seed {args.seed}) to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
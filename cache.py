@@ -0,0 +1,172 @@
+"""
+Result cache for update_dashboard.
+
+Users keep regenerating the same few views, so the rendered outputs (KPI
+strings and figure dicts) are cached under a canonical form of the filter
+state. Entries are stored as serialized JSON so their size is known exactly;
+the least recently used ones are evicted once the byte budget is exceeded.
+
+Two stores share one interface:
+
+MemoryResultCache   per-process OrderedDict (default)
+SqliteResultCache   a local SQLite file shared by every gunicorn worker on the host
+
+Every key includes the dataset version, so results computed on an older data
+file are never served; the SQLite store also purges them when it opens.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import plotly.utils
+
+
+def _encode(outputs):
+    return json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder).encode()
+
+
+def _decode(payload):
+    return json.loads(payload)
+
+
+class MemoryResultCache:
+    """In-process LRU of serialized dashboard outputs under a byte budget"""
+
+    def __init__(self, version, max_bytes):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, state):
+        return hashlib.sha1(f"{self.version}|{state}".encode()).hexdigest()
+
+    def get(self, state):
+        key = self.key(state)
+        with self.lock:
+            payload = self.entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return _decode(payload)
+
+    def put(self, state, outputs):
+        payload = _encode(outputs)
+        if len(payload) > self.max_bytes:
+            return
+        key = self.key(state)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= len(self.entries.pop(key))
+            self.entries[key] = payload
+            self.bytes += len(payload)
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'store': 'memory',
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+class SqliteResultCache(MemoryResultCache):
+    """Host-wide LRU in a SQLite file, so all workers share one cache"""
+
+    def __init__(self, version, max_bytes, path):
+        super().__init__(version, max_bytes)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(key TEXT PRIMARY KEY, version TEXT, payload BLOB, size INTEGER, used REAL)'
+            )
+            conn.execute('DELETE FROM results WHERE version != ?', (version,))
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call: safe across threads and forks
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, state):
+        key = self.key(state)
+        with self._connect() as conn:
+            row = conn.execute('SELECT payload FROM results WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return _decode(row[0])
+
+    def put(self, state, outputs):
+        payload = _encode(outputs)
+        if len(payload) > self.max_bytes:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                (self.key(state), self.version, payload, len(payload), time.time())
+            )
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in conn.execute('SELECT key, size FROM results ORDER BY used').fetchall():
+                conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        with self.lock:
+            return {
+                'store': 'sqlite',
+                'path': self.path,
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes
+            }
+
+
+def make_result_cache(version):
+    """
+    Cache configured from the environment:
+
+    CRASHLENS_CACHE_MB     byte budget in MB (default 64, 0 disables caching)
+    CRASHLENS_CACHE_PATH   SQLite file to share the cache between workers
+    """
+    max_bytes = int(float(os.environ.get('CRASHLENS_CACHE_MB', 64)) * 2**20)
+    path = os.environ.get('CRASHLENS_CACHE_PATH')
+    if path:
+        return SqliteResultCache(version, max_bytes, path)
+    return MemoryResultCache(version, max_bytes)
@@ -0,0 +1,150 @@
+"""
+Metadata catalog of the dashboard dataset.
+
+The dropdown options, the search vocabulary check and the startup diagnostics
+only need the distinct values of the filter columns and how often each occurs.
+Instead of scanning those columns again on every page load, they are counted
+once per dataset version and saved as JSON next to the data file; later starts
+on the same file read the JSON and never scan.
+
+A catalog looks like:
+
+    {
+      "version": "<dataset_version()>",
+      "format": CATALOG_FORMAT,
+      "rows": 5830000,
+      "columns": {"BOROUGH": [["BROOKLYN", 1234], ...], ...},
+      "years": [2012, 2025]
+    }
+
+where each column lists its values that occur, most frequent first (the order
+of value_counts()).
+"""
+import json
+import numbers
+import os
+import time
+
+from data_store import dataset_version, resolve_dataset_path
+from filters import INDEXED_COLUMNS, search_targets
+from metrics import log
+
+# Bump whenever the catalog layout changes
+CATALOG_FORMAT = 1
+
+
+def catalog_path(path=None):
+    """Where the catalog of a dataset file (or column store) is kept"""
+    path = resolve_dataset_path(path)
+    if os.path.isdir(path):
+        # A separate file: the store's version follows its schema.json only
+        return os.path.join(path, 'catalog.json')
+    return f"{path}.catalog.json"
+
+
+def _label(value):
+    # YEAR may be float32 when some dates are missing; its labels are ints
+    if isinstance(value, numbers.Number):
+        return int(value)
+    return str(value)
+
+
+def build_catalog(df, version=None, columns=INDEXED_COLUMNS):
+    """Value frequencies of the filter columns of df, most frequent first"""
+    catalog = {
+        'version': version,
+        'format': CATALOG_FORMAT,
+        'rows': len(df),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'columns': {}
+    }
+    for col in columns:
+        if col not in df.columns:
+            continue
+        counts = df[col].value_counts()
+        counts = counts[counts > 0]
+        catalog['columns'][col] = [[_label(value), int(n)] for value, n in counts.items()]
+    years = [year for year, _ in catalog['columns'].get('YEAR', [])]
+    catalog['years'] = [min(years), max(years)] if years else None
+    return catalog
+
+
+def update_catalog(catalog, removed, added, version=None):
+    """
+    The catalog once the rows of removed are replaced by those of added,
+    counting only those rows. Values keep their order among equal counts.
+    """
+    updated = dict(catalog, version=version, rows=catalog['rows'] - len(removed) + len(added),
+                   created=time.strftime('%Y-%m-%dT%H:%M:%S'), columns={})
+    for col, entries in catalog['columns'].items():
+        counts = dict((value, n) for value, n in entries)
+        for frame, sign in ((removed, -1), (added, 1)):
+            if col in frame.columns:
+                for value, n in frame[col].value_counts().items():
+                    label = _label(value)
+                    counts[label] = counts.get(label, 0) + sign * int(n)
+        ordered = sorted((item for item in counts.items() if item[1] > 0), key=lambda item: -item[1])
+        updated['columns'][col] = [[value, n] for value, n in ordered]
+    years = [year for year, _ in updated['columns'].get('YEAR', [])]
+    updated['years'] = [min(years), max(years)] if years else None
+    return updated
+
+
+def save_catalog(catalog, path):
+    """Write atomically, so a concurrent worker never reads a partial file"""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(temporary, path)
+
+
+def read_catalog(path, version):
+    """The saved catalog at path if it was built for this dataset version, else None"""
+    try:
+        with open(path) as f:
+            catalog = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if catalog.get('version') != version or catalog.get('format') != CATALOG_FORMAT:
+        return None
+    return catalog
+
+
+def load_catalog(df, path=None):
+    """
+    Catalog of the dataset at path (loaded as df): the saved one when it is
+    current, else built from df and saved for the next start. A read-only
+    data directory only costs the rebuild.
+    """
+    version = dataset_version(path)
+    target = catalog_path(path)
+    catalog = read_catalog(target, version)
+    if catalog is not None:
+        log.info(f"Catalog read from {target}")
+        return catalog
+
+    catalog = build_catalog(df, version)
+    try:
+        save_catalog(catalog, target)
+        log.info(f"Catalog built and saved to {target}")
+    except OSError as e:
+        log.warning(f"Catalog built; could not save it to {target}: {e}")
+    return catalog
+
+
+def column_values(catalog, col):
+    """Values of col that occur in the dataset, most frequent first"""
+    return [value for value, _ in catalog['columns'].get(col, [])]
+
+
+def value_count(catalog, col, value):
+    """Rows with col == value (0 when it does not occur)"""
+    return next((n for v, n in catalog['columns'].get(col, []) if v == value), 0)
+
+
+def missing_search_targets(catalog):
+    """Search vocabulary values that never occur, so their keywords match nothing"""
+    return [
+        (col, value) for col, value in search_targets()
+        if col in catalog['columns'] and value_count(catalog, col, value) == 0
+    ]
@@ -0,0 +1,598 @@
+"""
+Dataset storage for the NYC CrashLens dashboard.
+
+V1.ipynb produces the standardized crash x person table. Re-parsing that CSV in
+every gunicorn worker is slow, so the same table can be saved once as a typed
+Parquet file (dates already parsed, categoricals stored as dictionaries, counts
+stored as small unsigned ints). load_dataset() prefers the Parquet copy and
+falls back to the CSV, applying the same cleaning either way.
+
+The dashboard only reads the columns in DASHBOARD_MANIFEST. Passing it to
+load_dataset() skips everything else, and an optional memory budget drops the
+optional column groups (or refuses to load) when the frame would not fit.
+
+For several gunicorn workers on one host, the table can instead be written as
+a column store: one .npy file per column (categoricals as their integer codes
+plus a JSON dictionary). load_dataset() memory-maps those files read-only, so
+every worker shares the same page-cache pages instead of holding its own copy.
+
+Convert an existing CSV with:
+
+    python data_store.py cleaned_merged_standardized_data.csv
+    python data_store.py cleaned_merged_standardized_data.csv cleaned_merged_standardized_data.columns
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import log
+
+CSV_PATH = 'cleaned_merged_standardized_data.csv'
+PARQUET_PATH = 'cleaned_merged_standardized_data.parquet'
+COLUMNS_PATH = 'cleaned_merged_standardized_data.columns'
+# Column store ordered by YEAR x BOROUGH with a partition map (partitions.py)
+PARTITIONED_PATH = 'cleaned_merged_standardized_data.partitions'
+
+# Column store layout: schema.json lists the columns; each has COLUMN.npy and,
+# for categoricals, COLUMN.categories.json
+COLUMN_STORE_SCHEMA = 'schema.json'
+
+# Bump whenever prepare_dataset() changes what ends up in the Parquet file
+SCHEMA_VERSION = 4
+SCHEMA_KEY = b'crashlens_schema'
+
+DATE_COLUMN = 'CRASH_DATE_CRASH'
+
+CATEGORICAL_COLUMNS = [
+    'BOROUGH',
+    'VEHICLE_TYPE_CODE_1',
+    'CONTRIBUTING_FACTOR_VEHICLE_1',
+    'PERSON_TYPE',
+    'PERSON_SEX',
+    'PERSON_INJURY'
+]
+
+COUNT_COLUMNS = [
+    'NUMBER_OF_PERSONS_INJURED',
+    'NUMBER_OF_PERSONS_KILLED',
+    'NUMBER_OF_PEDESTRIANS_INJURED',
+    'NUMBER_OF_PEDESTRIANS_KILLED',
+    'NUMBER_OF_CYCLIST_INJURED',
+    'NUMBER_OF_CYCLIST_KILLED',
+    'NUMBER_OF_MOTORIST_INJURED',
+    'NUMBER_OF_MOTORIST_KILLED'
+]
+
+COORDINATE_COLUMNS = ['LATITUDE', 'LONGITUDE']
+
+# Free-text labels shown on hover; few distinct values, so kept as categoricals
+STREET_COLUMNS = ['ON_STREET_NAME', 'CROSS_STREET_NAME']
+
+# Columns app.py reads. Optional groups are given up whole (a map needs both
+# coordinates), last group first, when a memory budget is exceeded: street
+# names only label zoomed-in map points, so they go before the coordinates.
+# COLLISION_ID links persons to their crash (star.py) and goes last; without
+# it every row counts as a crash of its own.
+DASHBOARD_MANIFEST = {
+    'required': [
+        'YEAR',
+        'BOROUGH',
+        'VEHICLE_TYPE_CODE_1',
+        'CONTRIBUTING_FACTOR_VEHICLE_1',
+        'PERSON_TYPE',
+        'PERSON_SEX',
+        'PERSON_INJURY',
+        'NUMBER_OF_PERSONS_INJURED',
+        'NUMBER_OF_PERSONS_KILLED'
+    ],
+    'optional': [
+        ['COLLISION_ID'],
+        ['LATITUDE', 'LONGITUDE'],
+        STREET_COLUMNS
+    ]
+}
+
+# Spellings of "no value" that share the single 'Unknown' category
+UNKNOWN_LABELS = ['Unknown', 'UNKNOWN', 'nan', 'NAN', 'None', '']
+UNKNOWN_CODE = 0
+
+PERSON_SEX_MAP = {
+    'MALE': 'M',
+    'FEMALE': 'F',
+    'U': 'Unknown'
+}
+
+
+class MemoryBudgetError(MemoryError):
+    """Raised when even the required columns do not fit the memory budget"""
+
+
+def _clean_categorical(series, normalize=None):
+    """
+    Clean a column as a fixed categorical, touching only its categories.
+
+    Every null-like spelling collapses into 'Unknown', which is always code 0
+    (UNKNOWN_CODE); the remaining categories follow in sorted order, so the
+    same label gets the same code on every load.
+    """
+    series = series.astype('category')
+    categories = pd.Index(series.cat.categories.astype(str))
+    if normalize is not None:
+        categories = normalize(categories)
+    categories = categories.where(~categories.isin(UNKNOWN_LABELS), 'Unknown')
+
+    new_categories = pd.Index(['Unknown'] + sorted(set(categories) - {'Unknown'}))
+    # Missing rows have code -1, which picks the trailing UNKNOWN_CODE slot
+    lookup = np.append(new_categories.get_indexer(categories), UNKNOWN_CODE)
+    codes = lookup[series.cat.codes.to_numpy()]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=new_categories),
+        index=series.index,
+        name=series.name
+    )
+
+
+def _normalize_sex(categories):
+    categories = categories.str.upper().str.strip()
+    return categories.map(lambda c: PERSON_SEX_MAP.get(c, c))
+
+
+def _year_column(dates):
+    """YEAR as int16, or float32 when some crash dates are missing"""
+    years = dates.dt.year
+    if years.isna().any():
+        return years.astype('float32')
+    return years.astype('int16')
+
+
+def prepare_dataset(df):
+    """Parse dates, clean categoricals and shrink numeric columns for the dashboard"""
+    if DATE_COLUMN in df.columns:
+        df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], errors='coerce')
+        df['YEAR'] = _year_column(df[DATE_COLUMN])
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            normalize = _normalize_sex if col == 'PERSON_SEX' else None
+            df[col] = _clean_categorical(df[col], normalize)
+
+    for col in COUNT_COLUMNS:
+        if col in df.columns:
+            counts = pd.to_numeric(df[col], errors='coerce').fillna(0).clip(lower=0)
+            df[col] = pd.to_numeric(counts, downcast='unsigned')
+
+    for col in COORDINATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+
+    for col in STREET_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    return df
+
+
+def manifest_columns(manifest):
+    """Every column named by a manifest, required first"""
+    columns = list(manifest['required'])
+    for group in manifest.get('optional', []):
+        columns.extend(group)
+    return columns
+
+
+def memory_report(df):
+    """Per-column dtype and in-memory size (MB), largest first"""
+    sizes = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'mb': (sizes / 2**20).round(2)
+    })
+    return report.sort_values('mb', ascending=False)
+
+
+def apply_memory_budget(df, budget_mb, manifest):
+    """Drop optional column groups until df fits budget_mb, or refuse"""
+    def size_mb(frame):
+        return frame.memory_usage(deep=True, index=False).sum() / 2**20
+
+    for group in reversed(manifest.get('optional', [])):
+        if size_mb(df) <= budget_mb:
+            break
+        present = [c for c in group if c in df.columns]
+        if present:
+            log.warning(f"Memory budget {budget_mb:,.0f} MB exceeded; dropping optional columns {present}")
+            df = df.drop(columns=present)
+
+    if size_mb(df) > budget_mb:
+        raise MemoryBudgetError(
+            f"Required columns need {size_mb(df):,.1f} MB, over the {budget_mb:,.0f} MB budget"
+        )
+    return df
+
+
+def _storage_frame(df):
+    """Make the remaining object columns safe and compact for Parquet"""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        # Mixed str/float columns (e.g. ZIP_CODE) cannot be written as-is
+        values = df[col].where(df[col].isna(), df[col].astype(str))
+        if values.nunique() < len(values) // 2:
+            values = values.astype('category')
+        df[col] = values
+    return df
+
+
+def _stored_schema(path):
+    if os.path.isdir(path):
+        with open(os.path.join(path, COLUMN_STORE_SCHEMA)) as f:
+            return json.load(f)
+    import pyarrow.parquet as pq
+    metadata = pq.read_schema(path).metadata or {}
+    if SCHEMA_KEY not in metadata:
+        return {}
+    return json.loads(metadata[SCHEMA_KEY])
+
+
+def save_dataset(df, path=PARQUET_PATH):
+    """Write the prepared dataset as typed Parquet with its schema version"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = _storage_frame(prepare_dataset(df))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SCHEMA_KEY] = json.dumps({
+        'version': SCHEMA_VERSION,
+        'rows': len(df),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }).encode()
+    pq.write_table(table.replace_schema_metadata(metadata), path, compression='zstd')
+    print(f"Saved {len(df):,} rows x {len(df.columns)} columns to {path}")
+    return path
+
+
+def save_column_store(df, path=COLUMNS_PATH):
+    """
+    Write the prepared dataset as one memory-mappable .npy file per column.
+
+    Categoricals (and any remaining text columns, which become categoricals)
+    are stored as their integer codes with the labels in a JSON dictionary.
+    schema.json is written last, so a half-written store is never loaded.
+    """
+    df = _storage_frame(prepare_dataset(df))
+    os.makedirs(path, exist_ok=True)
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == object:
+            series = series.astype('category')
+        if series.dtype.name == 'category':
+            values = series.cat.codes.to_numpy()
+            with open(os.path.join(path, f"{col}.categories.json"), 'w') as f:
+                json.dump([str(c) for c in series.cat.categories], f)
+            columns[col] = 'category'
+        else:
+            values = series.to_numpy()
+            columns[col] = 'array'
+        np.save(os.path.join(path, f"{col}.npy"), np.ascontiguousarray(values))
+
+    with open(os.path.join(path, COLUMN_STORE_SCHEMA), 'w') as f:
+        json.dump({
+            'version': SCHEMA_VERSION,
+            'rows': len(df),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'columns': columns
+        }, f, indent=2)
+    print(f"Saved {len(df):,} rows x {len(df.columns)} columns to {path}/")
+    return path
+
+
+# Rows read at a time when a store is streamed from the CSV
+STREAM_CHUNK_ROWS = 250_000
+
+
+def _inferred_dtypes(source, chunk_rows):
+    """
+    The dtype read_csv infers for each column of the whole file, found a
+    chunk at a time: integers and floats widen to float, any other mix is text
+    """
+    seen = {}
+    for chunk in pd.read_csv(source, chunksize=chunk_rows):
+        for col, dtype in chunk.dtypes.items():
+            seen.setdefault(col, set()).add(dtype)
+    dtypes = {}
+    for col, kinds in seen.items():
+        if len(kinds) == 1:
+            dtypes[col] = kinds.pop()
+        elif all(dtype.kind in 'iuf' for dtype in kinds):
+            dtypes[col] = np.dtype('float64')
+        else:
+            dtypes[col] = np.dtype(object)
+    return dtypes
+
+
+def _stored_categories(col, labels):
+    """The categories save_column_store() ends up with for the labels a column holds"""
+    if col in CATEGORICAL_COLUMNS:
+        return ['Unknown'] + sorted(set(labels) - {'Unknown'})
+    return sorted(labels)
+
+
+def stream_column_store(source, path=COLUMNS_PATH, chunk_rows=STREAM_CHUNK_ROWS, sort_by=None):
+    """
+    save_column_store() of the CSV at source without reading it whole.
+
+    A first pass finds the dtypes read_csv would infer for the whole file; the
+    second prepares chunk_rows rows at a time and appends them to one file per
+    column (categoricals as provisional ids). Each column is then converted in
+    slices to the dtype, categories and codes the whole-frame writer picks.
+    sort_by orders the rows stably by those columns, as save_partitioned()
+    does; that needs a sort key and the row order in memory, the rest only a
+    chunk.
+    """
+    dtypes = _inferred_dtypes(source, chunk_rows)
+    os.makedirs(path, exist_ok=True)
+    columns = None
+    raw = {}
+    # Per column: provisional dtype, and for categoricals {label: provisional id}
+    temporary = {}
+    labels = {}
+    year_missing = False
+    counts = {col: {'max': 0, 'whole': True} for col in COUNT_COLUMNS}
+    rows = 0
+    try:
+        for chunk in pd.read_csv(source, chunksize=chunk_rows, dtype=dtypes):
+            chunk = prepare_dataset(chunk)
+            if columns is None:
+                columns = list(chunk.columns)
+                raw = {col: open(os.path.join(path, f"{col}.raw"), 'wb') for col in columns}
+            for col in columns:
+                values = chunk[col]
+                if values.dtype == object:
+                    # Text the whole-frame writer turns into a categorical of strings
+                    values = values.where(values.isna(), values.astype(str)).astype('category')
+                if values.dtype.name == 'category':
+                    ids = labels.setdefault(col, {})
+                    lookup = [ids.setdefault(str(label), len(ids)) for label in values.cat.categories]
+                    values = np.append(np.array(lookup, dtype=np.int32), np.int32(-1))[values.cat.codes.to_numpy()]
+                    temporary[col] = np.dtype(np.int32)
+                elif col == 'YEAR':
+                    year_missing = year_missing or bool(values.isna().any())
+                    values = values.to_numpy(dtype=np.float32)
+                    temporary[col] = np.dtype(np.float32)
+                elif col in counts:
+                    values = values.to_numpy(dtype=np.float64)
+                    if len(values):
+                        counts[col]['max'] = max(counts[col]['max'], float(values.max()))
+                        counts[col]['whole'] = counts[col]['whole'] and bool((values == np.floor(values)).all())
+                    temporary[col] = np.dtype(np.float64)
+                else:
+                    values = values.to_numpy(dtype=temporary.setdefault(col, values.dtype))
+                raw[col].write(np.ascontiguousarray(values).tobytes())
+            rows += len(chunk)
+    finally:
+        for f in raw.values():
+            f.close()
+
+    # Final dtype and the conversion from the provisional values, per column
+    final = {}
+    stored = {}
+    for col in columns or []:
+        if col in labels:
+            names = list(labels[col])
+            categories = _stored_categories(col, names)
+            codes = pd.Categorical([], categories=categories).codes.dtype
+            remap = np.append(pd.Index(categories).get_indexer(names), -1).astype(codes)
+            final[col] = (codes, lambda ids, remap=remap: remap[ids])
+            with open(os.path.join(path, f"{col}.categories.json"), 'w') as f:
+                json.dump([str(c) for c in categories], f)
+            stored[col] = 'category'
+            continue
+        if col == 'YEAR':
+            dtype = np.dtype(np.float32 if year_missing else np.int16)
+        elif col in counts:
+            # pd.to_numeric(downcast='unsigned') over the whole column
+            whole = counts[col]['whole']
+            dtype = np.min_scalar_type(int(counts[col]['max'])) if whole else np.dtype(np.float64)
+        else:
+            dtype = temporary[col]
+        final[col] = (dtype, lambda values, dtype=dtype: values.astype(dtype))
+        stored[col] = 'array'
+
+    def provisional(col):
+        if rows == 0:
+            return np.zeros(0, dtype=temporary.get(col, np.float64))
+        return np.memmap(os.path.join(path, f"{col}.raw"), dtype=temporary[col], mode='r', shape=(rows,))
+
+    order = None
+    if sort_by:
+        # sort_values(sort_by, kind='stable', na_position='last'): missing values sort last
+        keys = []
+        for col in reversed(sort_by):
+            key = final[col][1](np.asarray(provisional(col)))
+            if key.dtype.kind == 'f':
+                key = np.where(np.isnan(key), np.inf, key)
+            elif col in labels:
+                key = np.where(key < 0, np.iinfo(np.int64).max, key.astype(np.int64))
+            keys.append(key)
+        order = np.lexsort(keys)
+
+    for col in columns or []:
+        dtype, convert = final[col]
+        values = provisional(col)
+        out = np.lib.format.open_memmap(os.path.join(path, f"{col}.npy"), mode='w+', dtype=dtype, shape=(rows,))
+        for start in range(0, rows, chunk_rows):
+            stop = min(start + chunk_rows, rows)
+            out[start:stop] = convert(values[start:stop] if order is None else values[order[start:stop]])
+        out.flush()
+        del out, values
+        os.remove(os.path.join(path, f"{col}.raw"))
+
+    with open(os.path.join(path, COLUMN_STORE_SCHEMA), 'w') as f:
+        json.dump({
+            'version': SCHEMA_VERSION,
+            'rows': rows,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'columns': stored
+        }, f, indent=2)
+    log.info(f"Streamed {rows:,} rows x {len(stored)} columns to {path}/")
+    return path
+
+
+def stream_dataset(source, path=PARQUET_PATH, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    save_dataset() of the CSV at source without reading it whole: streamed
+    into a temporary column store, then written to Parquet a slice at a time.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    staged = f"{path}.columns.partial"
+    stream_column_store(source, staged, chunk_rows)
+    try:
+        df = _map_column_store(staged)
+        # _storage_frame() keeps text as strings unless it repeats enough
+        text = [col for col in df.columns
+                if df[col].dtype.name == 'category' and col not in CATEGORICAL_COLUMNS + STREET_COLUMNS
+                and len(df[col].cat.categories) >= len(df) // 2]
+        metadata = None
+        writer = None
+        for start in range(0, max(len(df), 1), chunk_rows):
+            part = df.iloc[start:start + chunk_rows]
+            if text:
+                part = part.assign(**{col: part[col].astype(object) for col in text})
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            if writer is None:
+                metadata = dict(table.schema.metadata or {})
+                metadata[SCHEMA_KEY] = json.dumps({
+                    'version': SCHEMA_VERSION,
+                    'rows': len(df),
+                    'created': time.strftime('%Y-%m-%dT%H:%M:%S')
+                }).encode()
+                writer = pq.ParquetWriter(path, table.schema.with_metadata(metadata), compression='zstd')
+            writer.write_table(table.replace_schema_metadata(metadata))
+        writer.close()
+        log.info(f"Streamed {len(df):,} rows x {len(df.columns)} columns to {path}")
+    finally:
+        shutil.rmtree(staged)
+    return path
+
+
+def _map_column_store(path, wanted=None):
+    """
+    DataFrame over read-only memory maps of the stored columns.
+
+    Built with copy=False and in the final column order, so pandas keeps the
+    maps as-is instead of consolidating them into private blocks.
+    """
+    columns = _stored_schema(path)['columns']
+    names = list(columns) if wanted is None else [c for c in wanted if c in columns]
+    data = {}
+    for col in names:
+        values = np.load(os.path.join(path, f"{col}.npy"), mmap_mode='r')
+        if columns[col] == 'category':
+            with open(os.path.join(path, f"{col}.categories.json")) as f:
+                values = pd.Categorical.from_codes(values, categories=json.load(f))
+        data[col] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def _read_columns(path, wanted):
+    """Read only the wanted columns that the file actually has"""
+    if os.path.isdir(path):
+        return _map_column_store(path, wanted)
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        available = set(pq.read_schema(path).names)
+        return pd.read_parquet(path, columns=[c for c in wanted if c in available])
+    return pd.read_csv(path, usecols=lambda c: c in wanted, low_memory=False)
+
+
+def resolve_dataset_path(path=None):
+    """
+    The file load_dataset() reads: the given path, else CRASHLENS_DATA_PATH,
+    else the partitioned store, column store, Parquet or CSV, whichever
+    exists first.
+    """
+    if path is not None:
+        return path
+    if os.environ.get('CRASHLENS_DATA_PATH'):
+        return os.environ['CRASHLENS_DATA_PATH']
+    for candidate in (PARTITIONED_PATH, COLUMNS_PATH, PARQUET_PATH):
+        if os.path.exists(candidate):
+            return candidate
+    return CSV_PATH
+
+
+def dataset_version(path=None):
+    """Short fingerprint of the dataset file; changes whenever the file is rewritten"""
+    path = resolve_dataset_path(path)
+    # A column store is rewritten whenever its schema file is
+    stat = os.stat(os.path.join(path, COLUMN_STORE_SCHEMA) if os.path.isdir(path) else path)
+    fingerprint = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}:{SCHEMA_VERSION}"
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+
+
+def load_dataset(path=None, manifest=None, memory_budget_mb=None):
+    """
+    Load the dashboard dataset, preferring the typed Parquet copy.
+
+    With a manifest only its columns are read (YEAR is derived from the crash
+    date when the file does not store it). With memory_budget_mb, optional
+    column groups are dropped to fit, and MemoryBudgetError is raised when
+    the required columns alone are too big.
+    """
+    path = resolve_dataset_path(path)
+    stored = os.path.isdir(path) or path.endswith('.parquet')
+    current = stored and _stored_schema(path).get('version') == SCHEMA_VERSION
+
+    if manifest is None:
+        if os.path.isdir(path):
+            df = _map_column_store(path)
+        elif path.endswith('.parquet'):
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, low_memory=False)
+    else:
+        wanted = manifest_columns(manifest)
+        # The CSV's YEAR comes from the raw crashes table; re-derive it like the app always has
+        if 'YEAR' in wanted and not current:
+            wanted.append(DATE_COLUMN)
+        df = _read_columns(path, wanted)
+        missing = [c for c in manifest['required'] if c not in df.columns and c != 'YEAR']
+        if missing:
+            raise KeyError(f"{path} is missing required columns: {missing}")
+
+    if not current:
+        if stored:
+            log.warning(f"{path} is not schema version {SCHEMA_VERSION}; re-preparing")
+        df = prepare_dataset(df)
+
+    if manifest is not None:
+        ordered = [c for c in manifest_columns(manifest) if c in df.columns]
+        # Selecting columns copies them, which would un-share a memory-mapped store
+        if ordered != list(df.columns):
+            df = df[ordered]
+    if memory_budget_mb is not None:
+        df = apply_memory_budget(df, memory_budget_mb, manifest or {'required': list(df.columns)})
+
+    return df
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else CSV_PATH
+    target = sys.argv[2] if len(sys.argv) > 2 else PARQUET_PATH
+    start = time.perf_counter()
+    if target.endswith('.columns'):
+        save_column_store(pd.read_csv(source, low_memory=False), target)
+    else:
+        save_dataset(pd.read_csv(source, low_memory=False), target)
+    print(f"Converted {source} -> {target} in {time.perf_counter() - start:.1f}s")
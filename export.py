@@ -0,0 +1,143 @@
+"""
+Streaming export of the filtered rows.
+
+An export can select millions of rows, so it is never materialized: the row
+positions of the filter selection are walked in blocks, each block is
+gathered into a small DataFrame and encoded on its own, and the encoded bytes
+are yielded as they are produced. Memory stays at one chunk whatever the
+size of the export.
+
+csv       gzip-compressed CSV, one header line
+parquet   one row group per chunk
+"""
+import time
+import zlib
+
+import numpy as np
+
+from metrics import log
+
+EXPORT_FORMATS = {
+    'csv': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+# Rows gathered and encoded at a time
+EXPORT_CHUNK_ROWS = 65536
+
+
+def export_chunks(df, row_blocks, columns, limit=None, chunk_rows=EXPORT_CHUNK_ROWS, gather=None):
+    """
+    DataFrames of at most chunk_rows rows of df[columns], for the row
+    positions yielded by row_blocks, stopping after limit rows. gather(columns,
+    positions) replaces df when the rows come from elsewhere, e.g. the joined
+    crash and person tables (star.CrashTables.joined).
+    """
+    if gather is None:
+        gather = lambda columns, positions: _gather(df, columns, positions)
+    pending = np.zeros(0, dtype=np.int64)
+    remaining = limit
+    for positions in row_blocks:
+        if remaining is not None:
+            positions = positions[:remaining]
+            remaining -= len(positions)
+        pending = np.concatenate([pending, positions])
+        while len(pending) >= chunk_rows:
+            yield gather(columns, pending[:chunk_rows])
+            pending = pending[chunk_rows:]
+        if remaining == 0:
+            break
+    if len(pending):
+        yield gather(columns, pending)
+
+
+def _gather(df, columns, positions):
+    # Gather column by column: df[columns] would copy every selected column in full first
+    return df.iloc[positions, [df.columns.get_loc(c) for c in columns]]
+
+
+def stream_csv(chunks, empty):
+    """
+    gzip-compressed CSV bytes of the chunks, header first. empty is a
+    zero-row frame with the export's columns, for the header when nothing
+    matched.
+    """
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    header = True
+    for chunk in chunks:
+        data = compressor.compress(chunk.to_csv(index=False, header=header).encode())
+        header = False
+        if data:
+            yield data
+    if header:
+        yield compressor.compress(empty.to_csv(index=False).encode())
+    yield compressor.flush()
+
+
+class _Drain:
+    """Write-only file that hands back what was written since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_parquet(chunks, empty):
+    """
+    Parquet bytes of the chunks, one row group each. empty gives the schema
+    when nothing matched, as for stream_csv().
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _Drain()
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema, compression='zstd')
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is None:
+        table = pa.Table.from_pandas(empty, preserve_index=False)
+        writer = pq.ParquetWriter(sink, table.schema, compression='zstd')
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(df, row_blocks, columns, fmt, limit=None, gather=None):
+    """Encoded bytes of an export, logging its size and time once finished"""
+    if gather is None:
+        gather = lambda columns, positions: _gather(df, columns, positions)
+    start = time.perf_counter()
+    rows = 0
+    size = 0
+
+    def counted():
+        nonlocal rows
+        for chunk in export_chunks(df, row_blocks, columns, limit, gather=gather):
+            rows += len(chunk)
+            yield chunk
+
+    empty = gather(columns, np.zeros(0, dtype=np.int64))
+    stream = stream_parquet if fmt == 'parquet' else stream_csv
+    for data in stream(counted(), empty):
+        size += len(data)
+        yield data
+    log.info(f"Exported {rows:,} rows as {fmt} ({size / 2**20:,.1f} MB) in {time.perf_counter() - start:.1f}s")
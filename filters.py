@@ -0,0 +1,412 @@
+"""
+Row filters over the dashboard's dictionary-encoded columns.
+
+The categorical columns prepared by data_store hold small integer codes, so a
+filter translates its labels to codes once and then selects rows with a single
+lookup-table gather over the code array instead of comparing strings.
+
+BitmapIndex goes one step further for the dropdown filters: it precomputes a
+row bitmap per value so a whole filter combination becomes a few bitwise
+operations and one gather of the selected rows.
+
+Free-text search is compiled into the same terms (compile_search_query) and
+plan_filters() merges it with the dropdowns into one plan: values are
+intersected per column, contradictions such as "queens" with the MANHATTAN
+dropdown are caught before any row is touched, and the remaining predicates
+are ordered by their row counts in the index so the most selective runs first.
+"""
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def category_codes(series, values):
+    """Codes of the given labels in a categorical column (unknown labels are skipped)"""
+    codes = series.cat.categories.get_indexer([str(v) for v in values])
+    return codes[codes >= 0]
+
+
+def value_mask(series, values):
+    """Boolean row mask for `series in values` on a categorical column"""
+    categories = series.cat.categories
+    selected = np.zeros(len(categories), dtype=bool)
+    selected[category_codes(series, values)] = True
+    return selected[series.cat.codes.to_numpy()]
+
+
+# Filter dimensions of update_dashboard, in dropdown order
+INDEXED_COLUMNS = [
+    'BOROUGH',
+    'YEAR',
+    'VEHICLE_TYPE_CODE_1',
+    'PERSON_TYPE',
+    'PERSON_SEX',
+    'CONTRIBUTING_FACTOR_VEHICLE_1',
+    'PERSON_INJURY'
+]
+
+
+# Search vocabulary. Keywords are matched as substrings of the lower-cased
+# query; for boroughs, genders and vehicles only the first match counts
+SEARCH_BOROUGHS = {
+    'manhattan': 'MANHATTAN',
+    'brooklyn': 'BROOKLYN',
+    'queens': 'QUEENS',
+    'bronx': 'BRONX',
+    'staten island': 'STATEN ISLAND',
+    'staten': 'STATEN ISLAND'
+}
+
+SEARCH_GENDERS = {
+    'male': 'M',
+    'man': 'M',
+    'men': 'M',
+    'female': 'F',
+    'woman': 'F',
+    'women': 'F'
+}
+
+SEARCH_PERSON_TYPES = [
+    (['pedestrian'], 'PEDESTRIAN'),
+    (['cyclist', 'bicycle', 'bike'], 'BICYCLIST'),
+    (['driver'], 'DRIVER'),
+    (['passenger'], 'PASSENGER')
+]
+
+SEARCH_VEHICLES = {
+    'taxi': 'TAXI',
+    'sedan': 'SEDAN',
+    'suv': 'SPORT UTILITY / STATION WAGON',
+    'truck': 'PICK-UP TRUCK',
+    'van': 'VAN',
+    'bus': 'BUS',
+    'motorcycle': 'MOTORCYCLE',
+    'bicycle': 'BICYCLE'
+}
+
+SEARCH_OUTCOMES = [
+    (['injured', 'injury'], 'injured'),
+    (['killed', 'fatal', 'death'], 'killed')
+]
+
+YEAR_PATTERN = re.compile(r'\b(20\d{2})\b')
+
+# Outcome predicates: the crash reported someone hurt, or this person was
+OUTCOME_PREDICATES = {
+    'injured': ('NUMBER_OF_PERSONS_INJURED', 'INJURED'),
+    'killed': ('NUMBER_OF_PERSONS_KILLED', 'KILLED')
+}
+
+
+def search_targets():
+    """Every (column, value) a search keyword can produce"""
+    targets = [('BOROUGH', v) for v in SEARCH_BOROUGHS.values()]
+    targets += [('PERSON_SEX', v) for v in SEARCH_GENDERS.values()]
+    targets += [('PERSON_TYPE', v) for _, v in SEARCH_PERSON_TYPES]
+    targets += [('VEHICLE_TYPE_CODE_1', v) for v in SEARCH_VEHICLES.values()]
+    targets.append(('PERSON_INJURY', 'UNINJURED'))
+    targets += [('PERSON_INJURY', label) for _, label in OUTCOME_PREDICATES.values()]
+    return list(dict.fromkeys(targets))
+
+
+def compile_search_query(query):
+    """
+    Translate free-text search into a filter spec:
+
+    terms      [(column, [values]), ...], all of which must hold
+    outcomes   names from OUTCOME_PREDICATES, all of which must hold
+    """
+    spec = {'terms': [], 'outcomes': []}
+    query = (query or '').lower().strip()
+    if not query:
+        return spec
+
+    def first_match(keywords):
+        return next((value for keyword, value in keywords.items() if keyword in query), None)
+
+    borough = first_match(SEARCH_BOROUGHS)
+    if borough:
+        spec['terms'].append(('BOROUGH', [borough]))
+    gender = first_match(SEARCH_GENDERS)
+    if gender:
+        spec['terms'].append(('PERSON_SEX', [gender]))
+    years = YEAR_PATTERN.findall(query)
+    if years:
+        spec['terms'].append(('YEAR', [int(years[0])]))
+    for keywords, person_type in SEARCH_PERSON_TYPES:
+        if any(keyword in query for keyword in keywords):
+            spec['terms'].append(('PERSON_TYPE', [person_type]))
+    for keywords, outcome in SEARCH_OUTCOMES:
+        if any(keyword in query for keyword in keywords):
+            spec['outcomes'].append(outcome)
+    if 'uninjured' in query:
+        spec['terms'].append(('PERSON_INJURY', ['UNINJURED']))
+    vehicle = first_match(SEARCH_VEHICLES)
+    if vehicle:
+        spec['terms'].append(('VEHICLE_TYPE_CODE_1', [vehicle]))
+    return spec
+
+
+def _key(value):
+    # Dropdowns send YEAR as an int and everything else as a label
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    return str(value)
+
+
+def plan_filters(filters, search_spec, index):
+    """
+    Merge dropdown filters and a compiled search into one evaluation plan:
+
+    values     {column: [values]} after intersecting every term on that column
+    outcomes   outcome predicates that must hold
+    steps      [(column or outcome, values, estimated rows)], most selective first
+    empty      why no row can match, or None
+
+    Empty dropdowns and columns the index does not cover are ignored.
+    """
+    plan = {'values': {}, 'outcomes': sorted(set(search_spec['outcomes'])), 'steps': [], 'empty': None}
+
+    allowed = {}
+    for col, values in list(filters.items()) + search_spec['terms']:
+        if not values or col not in index.counts:
+            continue
+        keys = {_key(v) for v in values}
+        allowed[col] = allowed[col] & keys if col in allowed else keys
+
+    for col, keys in allowed.items():
+        plan['values'][col] = sorted(keys)
+        if not keys:
+            plan['empty'] = f"{col}: no value satisfies every filter on it"
+            return plan
+        estimate = sum(index.counts[col].get(key, 0) for key in keys)
+        plan['steps'].append((col, plan['values'][col], estimate))
+
+    for outcome in plan['outcomes']:
+        if outcome in index.outcome_counts:
+            plan['steps'].append((outcome, [], index.outcome_counts[outcome]))
+
+    plan['steps'].sort(key=lambda step: step[2])
+    if plan['steps'] and plan['steps'][0][2] == 0:
+        col, values, _ = plan['steps'][0]
+        plan['empty'] = f"{col}: no rows for {values}" if values else f"no {col} rows"
+    return plan
+
+
+def plan_state(plan):
+    """
+    Stable string for what a plan selects, used as the result cache key.
+
+    Search text and dropdowns that select the same rows share a key, and all
+    plans that cannot match anything share one.
+    """
+    if plan['empty']:
+        return json.dumps({'empty': True})
+    state = dict(plan['values'])
+    if plan['outcomes']:
+        state['outcomes'] = plan['outcomes']
+    return json.dumps(state, sort_keys=True)
+
+
+def _pack(mask):
+    """Pack a boolean row mask into little-endian 64-bit words"""
+    packed = np.packbits(mask, bitorder='little')
+    words = np.zeros(-(-len(packed) // 8) * 8, dtype=np.uint8)
+    words[:len(packed)] = packed
+    return words.view(np.uint64)
+
+
+class BitmapIndex:
+    """
+    Per-value row bitmaps for the dashboard's filter columns, built once at load.
+
+    Values covering at least 1/32 of the rows get a packed bitmap (one bit per
+    row, stored as 64-bit words). Rarer values, such as the long tail of
+    vehicle types, keep a sorted array of row ids instead, which is smaller
+    below that density. select() ORs the values within a column and ANDs the
+    columns together, so any dropdown combination resolves with a handful of
+    word-level operations before a single gather of the matching rows.
+
+    The outcome predicates of the search get a bitmap each, and row counts per
+    value are kept so plan_filters() can estimate selectivity.
+    """
+
+    def __init__(self, df, columns=INDEXED_COLUMNS):
+        self.n_rows = len(df)
+        self.n_words = -(-self.n_rows // 64)
+        self.bitmaps = {}
+        self.row_ids = {}
+        self.counts = {}
+        self.outcomes = {}
+        self.outcome_counts = {}
+        for col in columns:
+            if col in df.columns:
+                self._index_column(col, df[col])
+        for outcome, (count_col, injury) in OUTCOME_PREDICATES.items():
+            if count_col in df.columns and 'PERSON_INJURY' in df.columns:
+                mask = (df[count_col] > 0).to_numpy() | value_mask(df['PERSON_INJURY'], [injury])
+                self.outcomes[outcome] = _pack(mask)
+                self.outcome_counts[outcome] = int(mask.sum())
+
+    def _index_column(self, col, series):
+        if series.dtype.name == 'category':
+            codes = series.cat.codes.to_numpy()
+            labels = series.cat.categories
+        else:
+            codes, labels = pd.factorize(series)
+
+        # NaN rows (code -1) are never selected by a dropdown value
+        valid = codes >= 0
+        counts = np.bincount(codes[valid], minlength=len(labels))
+        # Stable sort of small ints is a radix sort; each value's ids stay ordered
+        order = np.flatnonzero(valid)[np.argsort(codes[valid], kind='stable')].astype(np.uint32)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+
+        self.bitmaps[col] = {}
+        self.row_ids[col] = {}
+        self.counts[col] = {}
+        for code, label in enumerate(labels):
+            if counts[code] == 0:
+                continue
+            key = _key(label)
+            self.counts[col][key] = int(counts[code])
+            if counts[code] * 32 >= self.n_rows:
+                self.bitmaps[col][key] = _pack(codes == code)
+            else:
+                self.row_ids[col][key] = order[bounds[code]:bounds[code + 1]].copy()
+
+    @property
+    def nbytes(self):
+        return sum(
+            sum(a.nbytes for a in store[col].values())
+            for store in (self.bitmaps, self.row_ids)
+            for col in store
+        ) + sum(a.nbytes for a in self.outcomes.values())
+
+    def _value_bitmap(self, col, value, first=0, last=None):
+        """Words first..last of a value's bitmap"""
+        key = _key(value)
+        last = self.n_words if last is None else last
+        if key in self.bitmaps[col]:
+            return self.bitmaps[col][key][first:last]
+        if key in self.row_ids[col]:
+            ids = self.row_ids[col][key]
+            low, high = np.searchsorted(ids, [first * 64, last * 64])
+            mask = np.zeros((last - first) * 64, dtype=bool)
+            mask[ids[low:high] - first * 64] = True
+            return _pack(mask)
+        return None
+
+    def _column_bits(self, col, values, first=0, last=None):
+        last = self.n_words if last is None else last
+        column_bits = np.zeros(last - first, dtype=np.uint64)
+        for value in values:
+            bitmap = self._value_bitmap(col, value, first, last)
+            if bitmap is not None:
+                column_bits |= bitmap
+        return column_bits
+
+    def word_spans(self, ranges):
+        """
+        Word slices [(first, last), ...] covering row ranges (None = every
+        row), merged where they share a word.
+        """
+        if ranges is None:
+            return [(0, self.n_words)]
+        spans = []
+        for start, stop in ranges:
+            first, last = start // 64, -(-stop // 64)
+            if spans and spans[-1][1] >= first:
+                spans[-1] = (spans[-1][0], max(spans[-1][1], last))
+            else:
+                spans.append((first, last))
+        return spans
+
+    def select(self, filters):
+        """
+        Packed row selection for {column: [values]}.
+
+        Empty value lists and unindexed columns are ignored; returns None
+        when nothing filters, i.e. every row is selected.
+        """
+        selection = None
+        for col, values in filters.items():
+            if not values or col not in self.bitmaps:
+                continue
+            column_bits = self._column_bits(col, values)
+            if selection is None:
+                selection = column_bits
+            else:
+                selection &= column_bits
+            if not selection.any():
+                break
+        return selection
+
+    def select_plan(self, plan, ranges=None):
+        """
+        Packed row selection for a plan from plan_filters(), ANDed in step
+        order. With row ranges (from PartitionMap.ranges()) only their words
+        are combined; the rest stay clear, so the ranges must cover every
+        row the plan can select.
+        """
+        if plan['empty']:
+            return np.zeros(self.n_words, dtype=np.uint64)
+        if ranges is None:
+            return self._select_words(plan, 0, self.n_words)
+        selection = np.zeros(self.n_words, dtype=np.uint64)
+        for first, last in self.word_spans(ranges):
+            words = self._select_words(plan, first, last)
+            if words is not None:
+                selection[first:last] = words
+        return selection
+
+    def _select_words(self, plan, first, last):
+        selection = None
+        for name, values, _ in plan['steps']:
+            if name in self.outcomes:
+                bits = self.outcomes[name][first:last]
+            else:
+                bits = self._column_bits(name, values, first, last)
+            if selection is None:
+                selection = bits.copy()
+            else:
+                selection &= bits
+            if not selection.any():
+                break
+        return selection
+
+    def contains(self, selection, positions):
+        """Whether each of the given row positions is set in a selection"""
+        positions = np.asarray(positions, dtype=np.uint64)
+        words = selection[positions >> np.uint64(6)]
+        return ((words >> (positions & np.uint64(63))) & np.uint64(1)).astype(bool)
+
+    def rows(self, selection, ranges=None):
+        """Row positions set in a selection from select(), unpacking only the words of ranges"""
+        if ranges is None:
+            bits = np.unpackbits(selection.view(np.uint8), count=self.n_rows, bitorder='little')
+            return np.flatnonzero(bits)
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + list(self.iter_rows(selection, ranges=ranges)))
+
+    def iter_rows(self, selection, block_rows=2**20, ranges=None):
+        """
+        Row positions of a selection (None = every row) in ascending blocks,
+        unpacking block_rows bits at a time so memory stays bounded. With
+        ranges, only the words of those row ranges are visited.
+        """
+        block_words = max(block_rows // 64, 1)
+        for span_first, span_last in self.word_spans(ranges):
+            for first in range(span_first, span_last, block_words):
+                last = min(first + block_words, span_last)
+                start = first * 64
+                stop = min(last * 64, self.n_rows)
+                if selection is None:
+                    yield np.arange(start, stop)
+                    continue
+                words = selection[first:last]
+                if not words.any():
+                    continue
+                bits = np.unpackbits(words.view(np.uint8), count=stop - start, bitorder='little')
+                yield np.flatnonzero(bits) + start
@@ -0,0 +1,502 @@
+"""
+Incremental update of the pipeline's output from delta exports.
+
+A full build (pipeline.py) leaves its join buckets in the work directory
+and records a watermark: the highest COLLISION_ID and crash date written.
+An incremental run reads delta CSVs in the layout of the full exports (the
+crash and person records added or changed since), puts them through the same
+ingest, cleaning and standardization, and upserts them:
+
+    crashes   by COLLISION_ID. Ids above the watermark are new rows; at or
+              below it the stored row is replaced when the record changed
+              (a late new id is inserted).
+    persons   by UNIQUE_ID. A changed record replaces the person joined to
+              its crash; a crash without a person takes the first new one.
+              Persons of crashes not seen yet wait for them, as in the join.
+
+Only the buckets holding the delta's collision ids are joined again, and the
+catalog is adjusted by the rows that changed instead of recounted. When every
+change lies above the watermark and the fill values (median age, most common
+ZIP code) stay the same, the new rows are appended to the output CSV;
+otherwise it is rewritten from the buckets, still without redoing any
+earlier stage.
+
+    python incremental.py --crashes crashes_delta.csv --persons persons_delta.csv
+
+The result is what a full build over the exports with the deltas applied
+gives. --check proves it: it applies the deltas recorded in pipeline.json to
+copies of the full exports, runs the full build on those in a scratch
+directory and compares the CSVs and the catalogs. A full build of new
+exports remains the fallback, and starts the delta record over.
+
+The dashboard loads a partitioned store, column store or Parquet copy in
+preference to the CSV (data_store.resolve_dataset_path()). Every such store
+of the output (or the one CRASHLENS_DATA_PATH names) is rebuilt from the
+updated CSV, streamed a chunk at a time so memory stays bounded as in the
+full build, written beside it and swapped in so a running app's memory maps
+stay valid, and its catalog is adjusted like the CSV's; --check compares
+each with the same store built from the full build by its converter. A restarted app serves
+the update. A store of another kind (e.g. a CSV elsewhere) cannot be rebuilt
+and is only warned about.
+"""
+import argparse
+import filecmp
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from catalog import build_catalog, catalog_path, read_catalog, save_catalog, update_catalog
+from data_store import (
+    COLUMNS_PATH, CSV_PATH, DATE_COLUMN, PARQUET_PATH, PARTITIONED_PATH, dataset_version, load_dataset,
+    prepare_dataset, save_column_store, save_dataset, stream_column_store, stream_dataset
+)
+from filters import INDEXED_COLUMNS
+from metrics import log
+from partitions import PARTITION_COLUMNS, PARTITIONS_FILE, PartitionMap, save_partition_map, save_partitioned
+from pipeline import (
+    CHUNK_ROWS, STATE_FILE, TABLES, WORKDIR, _add_counts, _fingerprint, _raise_watermark, clean_chunk,
+    fill_chunk, fill_stats, histogram_state, join_bucket, joined_name, joined_part, load_state, parse_chunk,
+    run_pipeline, save_state, stage_write, standardize_chunk
+)
+
+# What identifies a record of each table; rows missing any of these are skipped
+RECORD_KEYS = {
+    'crashes': ['COLLISION_ID'],
+    'persons': ['UNIQUE_ID', 'COLLISION_ID']
+}
+
+
+def read_delta(path, table, chunk_rows=CHUNK_ROWS):
+    """
+    A delta export through the full build's ingest, clean and standardize
+    steps, with its first record per key. Returns (records, skipped rows).
+    """
+    chunks = [
+        standardize_chunk(clean_chunk(parse_chunk(chunk, table), table))
+        for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype=str)
+    ]
+    if not chunks:
+        chunks = [parse_chunk(pd.read_csv(path, nrows=0, dtype=str), table)]
+    delta = pd.concat(chunks, ignore_index=True)
+    keys = RECORD_KEYS[table]
+    keyed = delta[keys].notna().all(axis=1)
+    records = delta[keyed].drop_duplicates(keys[0], ignore_index=True)
+    return records, int((~keyed).sum())
+
+
+def _rows_differ(new, old):
+    """Per row of new, whether it differs from the row of old with the same index"""
+    old = old.loc[new.index, new.columns]
+    # As text, with every kind of missing value (None, NaN, <NA>) alike
+    as_text = lambda frame: frame.astype(str).where(frame.notna(), '')
+    return (as_text(new) != as_text(old)).any(axis=1)
+
+
+def split_joined(joined, columns):
+    """A joined bucket back into its crash rows and the persons joined to them"""
+    sides = {}
+    for table in TABLES:
+        names = {joined_name(col, table, columns): col for col in columns[table]}
+        sides[table] = joined[list(names)].rename(columns=names)
+    persons = sides['persons']
+    return sides['crashes'], persons[persons['UNIQUE_ID'].notna()]
+
+
+def upsert_bucket(crashes, persons, delta_crashes, delta_persons, watermark_id):
+    """
+    Apply a bucket's delta records to its stored crashes and known persons
+    (at most one per collision: the joined ones and the waiting ones).
+    Returns the new (crashes, persons), the number of changed records per
+    table and the collision ids they belong to.
+    """
+    above = delta_crashes['COLLISION_ID'] > watermark_id
+    stored = ~above & delta_crashes['COLLISION_ID'].isin(crashes['COLLISION_ID'])
+    updates = delta_crashes[stored].set_index('COLLISION_ID')
+    if len(updates):
+        updates = updates[_rows_differ(updates, crashes.set_index('COLLISION_ID'))]
+    upserted = pd.concat([updates.reset_index(), delta_crashes[~stored]], ignore_index=True)
+    if len(upserted):
+        crashes = pd.concat(
+            [crashes[~crashes['COLLISION_ID'].isin(upserted['COLLISION_ID'])], upserted[crashes.columns]],
+            ignore_index=True
+        )
+
+    keys = ['UNIQUE_ID', 'COLLISION_ID']
+    known = pd.MultiIndex.from_frame(persons[keys])
+    replacing = pd.MultiIndex.from_frame(delta_persons[keys]).isin(known)
+    replacements = delta_persons[replacing].set_index('UNIQUE_ID')
+    if len(replacements):
+        replacements = replacements[_rows_differ(replacements, persons.set_index('UNIQUE_ID'))]
+    # A collision's first person stays its person; only one without any takes a new one
+    additions = delta_persons[~replacing & ~delta_persons['COLLISION_ID'].isin(persons['COLLISION_ID'])]
+    additions = additions.drop_duplicates('COLLISION_ID')
+    changed_persons = len(replacements) + len(additions)
+    if changed_persons:
+        persons = pd.concat([
+            persons[~persons['UNIQUE_ID'].isin(replacements.index)],
+            replacements.reset_index()[persons.columns],
+            additions[persons.columns]
+        ], ignore_index=True)
+    touched = pd.concat([upserted['COLLISION_ID'], replacements['COLLISION_ID'], additions['COLLISION_ID']])
+    return crashes, persons, {'crashes': len(upserted), 'persons': changed_persons}, touched
+
+
+def _catalog_frame(joined, stats):
+    """joined as the dashboard reads it back from the CSV, for the catalog's columns"""
+    text = fill_chunk(joined.copy(), stats).to_csv(index=False)
+    wanted = set(INDEXED_COLUMNS) | {DATE_COLUMN}
+    return prepare_dataset(pd.read_csv(io.StringIO(text), usecols=lambda c: c in wanted, low_memory=False))
+
+
+def store_kind(path):
+    """'partitions', 'columns' or 'parquet' for a store built from the CSV, else None"""
+    if os.path.isdir(path):
+        return 'partitions' if os.path.exists(os.path.join(path, PARTITIONS_FILE)) else 'columns'
+    return 'parquet' if path.endswith('.parquet') else None
+
+
+def served_stores(output):
+    """
+    The existing stores the dashboard may load instead of output: the
+    partitioned store, column store and Parquet copy of the default CSV, and
+    CRASHLENS_DATA_PATH when it names another file.
+    """
+    stores = []
+    if os.path.abspath(output) == os.path.abspath(CSV_PATH):
+        stores = [path for path in (PARTITIONED_PATH, COLUMNS_PATH, PARQUET_PATH) if os.path.exists(path)]
+    served = os.environ.get('CRASHLENS_DATA_PATH')
+    if served and os.path.exists(served) and os.path.abspath(served) != os.path.abspath(output):
+        if not any(os.path.abspath(served) == os.path.abspath(path) for path in stores):
+            stores.append(served)
+    return stores
+
+
+def write_store(csv, path, kind, columns=PARTITION_COLUMNS):
+    """Build a store of the given kind at path from the whole CSV in memory, as its converter does"""
+    df = pd.read_csv(csv, low_memory=False)
+    if kind == 'partitions':
+        save_partitioned(df, path, columns)
+    elif kind == 'columns':
+        save_column_store(df, path)
+    else:
+        save_dataset(df, path)
+
+
+def rebuild_store(csv, path, chunk_rows=CHUNK_ROWS):
+    """
+    Rebuild the store at path from the updated CSV, streamed chunk_rows rows
+    at a time like the rest of the pipeline. It is written beside the old one
+    and swapped in, so a running app's memory maps of the old files stay
+    valid; a partitioned store is described once it is in place.
+    """
+    kind = store_kind(path)
+    staged = f"{path}.partial"
+    if os.path.isdir(staged):
+        shutil.rmtree(staged)
+    if kind == 'parquet':
+        stream_dataset(csv, staged, chunk_rows)
+        os.replace(staged, path)
+        return
+    columns = None
+    if kind == 'partitions':
+        with open(os.path.join(path, PARTITIONS_FILE)) as f:
+            columns = json.load(f)['columns']
+    stream_column_store(csv, staged, chunk_rows, sort_by=columns)
+    retired = f"{path}.old"
+    shutil.rmtree(retired, ignore_errors=True)
+    os.rename(path, retired)
+    os.rename(staged, path)
+    shutil.rmtree(retired)
+    if kind == 'partitions':
+        save_partition_map(path, columns)
+
+
+def run_incremental(crashes, persons, output=CSV_PATH, workdir=WORKDIR):
+    """
+    Upsert the delta exports into the full build in workdir and its output
+    (and the stores the dashboard loads instead of it), returning the record
+    of the update that is added to pipeline.json.
+    """
+    state = load_state(workdir)
+    if 'write' not in state['stages'] or not os.path.exists(output):
+        raise RuntimeError(f"No finished full build of {output} in {workdir}; run pipeline.py first")
+    stores = served_stores(output)
+    for path in stores:
+        if store_kind(path) is None:
+            log.warning(f"The dashboard loads {path}, which is not built from {output}; it will serve stale data")
+    stores = [path for path in stores if store_kind(path) is not None]
+    started = time.perf_counter()
+    join = state['stages']['join']
+    columns = join['columns']
+    watermark = dict(state['stages']['write']['watermark'])
+    first_id = state['stages']['dedupe']['id_ranges']['crashes'][0]
+    bucket_ids = state['settings']['bucket_ids']
+    old_version = dataset_version(output)
+    old_stats = {'age_median': join['age_median'], 'zip_mode': join['zip_mode']}
+
+    delta = {}
+    skipped = {}
+    for table, path in (('crashes', crashes), ('persons', persons)):
+        delta[table], skipped[table] = read_delta(path, table, state['settings']['chunk_rows'])
+        delta[table] = delta[table].reindex(columns=columns[table])
+
+    def bucket_of(ids):
+        # No upper clip: ids past the last bucket open new ones
+        return np.maximum((ids.to_numpy(dtype=np.int64) - first_id) // bucket_ids, 0)
+
+    crash_buckets = bucket_of(delta['crashes']['COLLISION_ID'])
+    person_buckets = bucket_of(delta['persons']['COLLISION_ID'])
+    joined_dir = os.path.join(workdir, 'join', 'joined')
+    orphans_path = os.path.join(workdir, 'join', 'orphans.parquet')
+    orphans = pd.read_parquet(orphans_path)
+    orphan_buckets = bucket_of(orphans['COLLISION_ID'])
+
+    ages = dict((age, n) for age, n in join['age_counts'])
+    zip_codes = dict((z, n) for z, n in join['zip_counts'])
+    # The catalogs of the output and of every store, each adjusted by the changed rows
+    catalogs = {path: read_catalog(catalog_path(path), old_version if path == output else dataset_version(path))
+                for path in [output] + stores}
+    counting = any(catalog is not None for catalog in catalogs.values())
+    staged = os.path.join(workdir, 'incremental.partial')
+    shutil.rmtree(staged, ignore_errors=True)
+    os.makedirs(staged)
+
+    # One bucket at a time; the rewritten parts are staged and put in place together
+    changed = {'crashes': 0, 'persons': 0}
+    buckets = []
+    appended = []
+    catalog_rows = {'removed': [], 'added': []}
+    only_new = True
+    kept_orphans = [orphans.iloc[:0]]
+    for bucket in np.union1d(np.union1d(crash_buckets, person_buckets), orphan_buckets):
+        waiting = orphans[orphan_buckets == bucket]
+        in_crashes = crash_buckets == bucket
+        in_persons = person_buckets == bucket
+        if not in_crashes.any() and not in_persons.any():
+            kept_orphans.append(waiting)
+            continue
+        path = joined_part(joined_dir, int(bucket))
+        old = pd.read_parquet(path) if os.path.exists(path) else None
+        if old is None:
+            stored_crashes, stored_persons = delta['crashes'].iloc[:0], delta['persons'].iloc[:0]
+        else:
+            stored_crashes, stored_persons = split_joined(old, columns)
+        new_crashes, known, counts, touched = upsert_bucket(
+            stored_crashes, pd.concat([stored_persons, waiting], ignore_index=True),
+            delta['crashes'][in_crashes], delta['persons'][in_persons],
+            -1 if watermark['collision_id'] is None else watermark['collision_id']
+        )
+        kept_orphans.append(known[~known['COLLISION_ID'].isin(new_crashes['COLLISION_ID'])])
+        if not len(touched):
+            continue
+        for table in TABLES:
+            changed[table] += counts[table]
+        joined = join_bucket(new_crashes, known)
+        if not len(joined):
+            # Only persons still waiting for their crashes
+            continue
+        if old is None:
+            old = joined.iloc[:0]
+        for frame, sign in ((old, -1), (joined, 1)):
+            _add_counts(ages, frame['PERSON_AGE'], sign)
+            _add_counts(zip_codes, frame['ZIP_CODE'], sign)
+        # Appending keeps the CSV in order only if no stored row changed
+        only_new = only_new and joined.iloc[:len(old)].equals(old)
+        if only_new:
+            appended.append(joined.iloc[len(old):])
+        if counting:
+            catalog_rows['removed'].append(old[old['COLLISION_ID'].isin(touched)])
+            catalog_rows['added'].append(joined[joined['COLLISION_ID'].isin(touched)])
+        joined.to_parquet(joined_part(staged, int(bucket)), index=False)
+        buckets.append(int(bucket))
+
+    stats = fill_stats(ages, zip_codes)
+    # Unkeyed crashes are written last, so nothing can be appended after them
+    append = only_new and stats == old_stats and not os.path.exists(joined_part(joined_dir, None))
+    os.makedirs(joined_dir, exist_ok=True)
+    for bucket in buckets:
+        os.replace(joined_part(staged, bucket), joined_part(joined_dir, bucket))
+    pd.concat(kept_orphans, ignore_index=True).to_parquet(orphans_path, index=False)
+    join.update(histogram_state(ages, zip_codes))
+
+    if append:
+        for rows in appended:
+            _raise_watermark(watermark, rows, columns)
+            fill_chunk(rows.copy(), stats).to_csv(output, mode='a', header=False, index=False)
+        state['stages']['write']['watermark'] = watermark
+    elif buckets:
+        ctx = {'output': output, 'workdir': workdir, 'state': state}
+        state['stages']['write'] = stage_write(ctx, staged)
+    shutil.rmtree(staged)
+
+    if buckets:
+        for path in stores:
+            rebuild_store(output, path, state['settings']['chunk_rows'])
+
+    # Adjust the catalogs by the changed rows instead of rescanning the output
+    if counting and buckets:
+        removed, added = (
+            _catalog_frame(pd.concat(catalog_rows[side], ignore_index=True), old_stats if side == 'removed' else stats)
+            for side in ('removed', 'added')
+        )
+        for path, catalog in catalogs.items():
+            if catalog is not None:
+                save_catalog(update_catalog(catalog, removed, added, dataset_version(path)), catalog_path(path))
+
+    record = {
+        'inputs': {'crashes': _fingerprint(crashes), 'persons': _fingerprint(persons)},
+        'rows': {table: {'in': len(delta[table]), 'changed': changed[table], 'skipped': skipped[table]}
+                 for table in TABLES},
+        'buckets': sorted(buckets),
+        'output': 'appended' if append or not buckets else 'rewritten',
+        'catalog': 'updated' if catalogs[output] is not None and buckets else 'unchanged',
+        'stores': {path: {'kind': store_kind(path), 'output': 'rebuilt' if buckets else 'unchanged',
+                          'catalog': 'updated' if catalogs[path] is not None and buckets else 'unchanged'}
+                   for path in stores},
+        'seconds': round(time.perf_counter() - started, 2)
+    }
+    state.setdefault('deltas', []).append(record)
+    save_state(workdir, state)
+    return record
+
+
+def _raw_column(columns, name):
+    """The raw export's column for a pipeline column name (A B -> A_B)"""
+    return next(c for c in columns if c.strip().replace(' ', '_') == name)
+
+
+def apply_delta_csv(base, delta, table, output, chunk_rows=CHUNK_ROWS):
+    """
+    Copy of the raw export base with the delta export's records applied, as a
+    fresh export would have them: a changed record in place of the first one
+    with its key (later duplicates dropped), new records at the end.
+    """
+    keys = RECORD_KEYS[table]
+    records = pd.read_csv(delta, dtype=str)
+    ids = pd.DataFrame({k: pd.to_numeric(records[_raw_column(records.columns, k)], errors='coerce') for k in keys})
+    keyed = ids.notna().all(axis=1)
+    records = records[keyed].set_axis(ids.loc[keyed, keys[0]])
+    records = records[~records.index.duplicated()]
+
+    placed = set()
+    header = True
+    for chunk in pd.read_csv(base, chunksize=chunk_rows, dtype=str):
+        chunk_ids = pd.to_numeric(chunk[_raw_column(chunk.columns, keys[0])], errors='coerce')
+        hit = chunk_ids.isin(records.index)
+        if hit.any():
+            first = hit & ~chunk_ids.duplicated() & ~chunk_ids.isin(placed)
+            chunk.iloc[np.flatnonzero(first)] = records.loc[chunk_ids[first], chunk.columns].to_numpy()
+            placed.update(chunk_ids[first])
+            chunk = chunk[~hit | first]
+        chunk.to_csv(output, mode='a', header=header, index=False)
+        columns = chunk.columns
+        header = False
+    records[~records.index.isin(placed)][columns].to_csv(output, mode='a', header=False, index=False)
+    return output
+
+
+def _catalog_counts(catalog):
+    # Values with equal counts may be listed in any order
+    return {col: dict((value, n) for value, n in entries) for col, entries in catalog['columns'].items()}
+
+
+def _partitions(path):
+    with open(os.path.join(path, PARTITIONS_FILE)) as f:
+        layout = json.load(f)
+    return layout['columns'], layout['rows'], layout['partitions']
+
+
+def check_incremental(output=CSV_PATH, workdir=WORKDIR):
+    """
+    Rebuild the output in full from the exports with the recorded deltas
+    applied, and compare it (and the stores the dashboard loads instead of
+    it, with their catalogs) with the incrementally updated one. Returns the
+    differences found (empty when they match).
+    """
+    state = load_state(workdir)
+    sources = [state['inputs']] + [record['inputs'] for record in state.get('deltas', [])]
+    for fingerprint in (source[table] for source in sources for table in TABLES):
+        if not os.path.exists(fingerprint['path']) or _fingerprint(fingerprint['path']) != fingerprint:
+            raise RuntimeError(f"{fingerprint['path']} changed since it was applied; cannot rebuild")
+    scratch = tempfile.mkdtemp(prefix='incremental-check-', dir=workdir)
+    try:
+        inputs = {table: state['inputs'][table]['path'] for table in TABLES}
+        for index, record in enumerate(state.get('deltas', [])):
+            for table in TABLES:
+                merged = os.path.join(scratch, f"{table}-{index}.csv")
+                inputs[table] = apply_delta_csv(inputs[table], record['inputs'][table]['path'], table, merged,
+                                                state['settings']['chunk_rows'])
+        rebuilt = os.path.join(scratch, os.path.basename(output))
+        run_pipeline(inputs['crashes'], inputs['persons'], rebuilt, os.path.join(scratch, 'work'),
+                     state['settings']['chunk_rows'], state['settings']['bucket_ids'])
+
+        differences = []
+        if not filecmp.cmp(output, rebuilt, shallow=False):
+            differences.append(f"{output} differs from the full build {rebuilt}")
+        full = None
+        for path in [output] + served_stores(output):
+            kind = store_kind(path)
+            if path != output:
+                if kind is None:
+                    differences.append(f"{path} is loaded by the dashboard but not built from {output}")
+                    continue
+                expected = os.path.join(scratch, os.path.basename(path))
+                write_store(rebuilt, expected, kind)
+                if not load_dataset(path).equals(load_dataset(expected)):
+                    differences.append(f"{path} differs from the same store of the full build {expected}")
+                elif kind == 'partitions' and _partitions(path) != _partitions(expected):
+                    differences.append(f"{path}/{PARTITIONS_FILE} differs from the full build's")
+                elif kind == 'partitions' and PartitionMap.load(path) is None:
+                    differences.append(f"{path}/{PARTITIONS_FILE} is out of date; the dashboard would not prune")
+            catalog = read_catalog(catalog_path(path), dataset_version(path))
+            if catalog is not None:
+                full = full or build_catalog(load_dataset(rebuilt))
+                if catalog['rows'] != full['rows'] or _catalog_counts(catalog) != _catalog_counts(full):
+                    differences.append(f"{catalog_path(path)} differs from the full build's catalog")
+        if differences:
+            # Keep the full build around to look at
+            scratch = None
+        return differences
+    finally:
+        if scratch is not None:
+            shutil.rmtree(scratch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--crashes', help="delta of the Motor Vehicle Collisions - Crashes export")
+    parser.add_argument('--persons', help="delta of the Motor Vehicle Collisions - Person export")
+    parser.add_argument('--output', default=CSV_PATH)
+    parser.add_argument('--workdir', default=WORKDIR)
+    parser.add_argument('--check', action='store_true',
+                        help="then compare with a full build over the exports with the deltas applied")
+    args = parser.parse_args()
+    if (args.crashes is None) != (args.persons is None):
+        parser.error("--crashes and --persons go together")
+    if args.crashes is None and not args.check:
+        parser.error("nothing to do: give the delta exports, --check or both")
+
+    if args.crashes is not None:
+        record = run_incremental(args.crashes, args.persons, args.output, args.workdir)
+        counts = ', '.join(f"{table} {c['changed']:,} of {c['in']:,} changed" for table, c in record['rows'].items())
+        print(f"Upserted {counts}; {len(record['buckets'])} bucket(s), output {record['output']}, "
+              f"catalog {record['catalog']} in {record['seconds']:.1f}s; "
+              f"log in {os.path.join(args.workdir, STATE_FILE)}")
+        for path, store in record['stores'].items():
+            print(f"{path}: {store['kind']} store {store['output']}, catalog {store['catalog']}")
+    if args.check:
+        differences = check_incremental(args.output, args.workdir)
+        for difference in differences:
+            print(difference)
+        print("Incremental output matches the full build" if not differences else "Check failed")
+        raise SystemExit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Logging, timed spans and Prometheus metrics for the dashboard.
+
+log           the 'crashlens' logger, on stdout; CRASHLENS_LOG_LEVEL sets its
+              level (default INFO, DEBUG adds per-request diagnostics)
+debug(build)  logs build() at DEBUG, and never calls it otherwise, so
+              diagnostics that scan data cost nothing in production
+span(stage)   times one stage of a request: filter, aggregate, figure, cache.
+              Spans nest, and each records only its own time, not its
+              children's. The body may add fields to the record it yields,
+              e.g. rows
+begin_request / end_request
+              bracket a server request; the time no span covered is recorded
+              as 'serialize' for callbacks (Dash's JSON encoding plus framework
+              overhead) and 'response' otherwise. end_request returns the
+              request's stages for logging and a Server-Timing header
+render()      every metric in the Prometheus text format, for /metrics
+
+Metrics live in the process that records them: under gunicorn each worker
+reports its own requests, and a scrape reaches whichever worker answers.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger('crashlens')
+if not log.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    log.addHandler(_handler)
+    log.setLevel(os.environ.get('CRASHLENS_LOG_LEVEL', 'INFO').upper())
+    log.propagate = False
+
+# Latency buckets in seconds, from a cube slice to a full scan
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+REGISTRY = []
+
+
+def debug(build):
+    """Log build() at DEBUG; build is only called when DEBUG is enabled"""
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(build())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """
+    A named metric with optional labels, registered for render().
+
+    collect, when given, is called at render time for {label values: value}
+    (e.g. counters kept by the result cache) instead of recorded values.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        if self.collect is not None:
+            return [(self.name, key, value) for key, value in self.collect().items()]
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value, *extra in self.samples():
+            labels = _label_text(self.labels, key, extra[0] if extra else ())
+            lines.append(f"{name}{labels} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = list(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, count, total = self.values.get(key, ([0] * len(self.buckets), 0, 0.0))
+            counts = [n + (value <= bound) for n, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, count + 1, total + value)
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        samples = []
+        for key, (counts, count, total) in values:
+            for bound, n in zip(self.buckets, counts):
+                samples.append((f"{self.name}_bucket", key, n, [('le', f"{bound:g}")]))
+            samples.append((f"{self.name}_bucket", key, count, [('le', '+Inf')]))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram(
+    'crashlens_stage_seconds', "Time spent per request stage, excluding nested stages", ['stage']
+)
+STAGE_ROWS = Counter('crashlens_stage_rows_total', "Rows handled per request stage", ['stage'])
+REQUEST_SECONDS = Histogram(
+    'crashlens_request_seconds', "Server time per request until the response is handed back", ['route', 'callback']
+)
+
+_local = threading.local()
+
+
+@contextmanager
+def span(stage, **fields):
+    """Time a stage; yields its record (a dict) for the body to add fields such as rows"""
+    stack = _local.__dict__.setdefault('stack', [])
+    record = dict(fields)
+    children = [0.0]
+    stack.append(children)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        own = elapsed - children[0]
+        STAGE_SECONDS.observe(own, stage=stage)
+        if 'rows' in record:
+            STAGE_ROWS.inc(int(record['rows']), stage=stage)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append((stage, own, record))
+
+
+def begin_request():
+    _local.trace = []
+    _local.stack = []
+    _local.request_start = time.perf_counter()
+
+
+def end_request(route, callback=''):
+    """
+    Record a finished request and return its stages, [(stage, seconds,
+    record)], merged per stage in first-seen order, the remainder last.
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return []
+    total = time.perf_counter() - _local.request_start
+    _local.trace = None
+    stages = {}
+    for stage, seconds, record in trace:
+        seconds_so_far, merged = stages.get(stage, (0.0, {}))
+        if 'rows' in record:
+            merged['rows'] = merged.get('rows', 0) + int(record['rows'])
+        stages[stage] = (seconds_so_far + seconds, merged)
+    remainder = 'serialize' if callback else 'response'
+    rest = max(total - sum(seconds for seconds, _ in stages.values()), 0.0)
+    STAGE_SECONDS.observe(rest, stage=remainder)
+    REQUEST_SECONDS.observe(total, route=route, callback=callback)
+    stages[remainder] = (rest, {})
+    return [(stage, seconds, record) for stage, (seconds, record) in stages.items()]
+
+
+def describe_stages(stages):
+    """'filter 3.1 ms (12,345 rows), figure 20.4 ms, ...' for a log line"""
+    parts = []
+    for stage, seconds, record in stages:
+        rows = f" ({record['rows']:,} rows)" if 'rows' in record else ''
+        parts.append(f"{stage} {seconds * 1000:.1f} ms{rows}")
+    return ', '.join(parts)
+
+
+def server_timing(stages):
+    """Server-Timing header value, shown per request in the browser's network panel"""
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds, _ in stages)
@@ -0,0 +1,301 @@
+"""
+Multi-core filtering and aggregation over shared memory.
+
+Reports the aggregate cube cannot answer (injured/killed searches) filter and
+summarize the raw rows on one core. ChunkedAggregator spreads that work over
+a pool of worker processes instead:
+
+- at load, the filter dimensions (as integer codes) and the injured/killed
+  counts are copied once into multiprocessing.shared_memory blocks, which
+  every worker maps instead of holding its own copy
+- a report's plan becomes per-column lookup tables of allowed codes; each
+  worker evaluates them over fixed chunks of CHUNK_ROWS rows and returns its
+  chunk's partial row counts and injured/killed sums per chart dimension
+- the partials are summed and turned into the same summary summarize()
+  returns
+
+CRASHLENS_AGGREGATE_WORKERS sets the pool size (0, the default, keeps
+everything on the request thread). start_pool() forks the workers, and must
+run before the process starts any other thread: a fork copies only the
+calling thread, so a lock another thread held (logging, imports) would stay
+held in the workers. The app starts it at import, before the background
+loader and the server's threads; the workers map the shared columns on
+their first task, once the data is loaded. Selections estimated below
+CRASHLENS_AGGREGATE_MIN_ROWS stay single-threaded, where the pool's overhead
+would outweigh the split. A pool that breaks (a worker killed, e.g. out of
+memory) is dropped: that report and every later one are counted on the
+request thread.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from aggregation import CHART_DIMENSIONS, DIMENSIONS, MEASURES, _dimension_codes
+from filters import OUTCOME_PREDICATES, _key
+from metrics import log
+
+CHUNK_ROWS = 2**20
+
+DEFAULT_MIN_ROWS = 1_000_000
+
+# Columns of the sex x injury crosstab
+CROSSTAB = ('PERSON_SEX', 'PERSON_INJURY')
+
+# Columns attached by each worker process: name -> array over shared memory,
+# and the block each one was mapped from
+_shared = {}
+_attached = {}
+_blocks = []
+
+
+def _attach(specs):
+    """Map every shared column the worker has not mapped yet"""
+    for col, (name, dtype, length) in specs.items():
+        if _attached.get(col) == name:
+            continue
+        block = shared_memory.SharedMemory(name=name)
+        _blocks.append(block)
+        _shared[col] = np.ndarray(length, dtype=dtype, buffer=block.buf)
+        _attached[col] = name
+
+
+def _weighted_counts(slots, n_slots, measures):
+    """[measure sums..., rows] per slot (summarize()'s column order), as one array"""
+    counts = np.empty((n_slots, len(measures) + 1), dtype=np.int64)
+    for i, (positions, values) in enumerate(measures):
+        counts[:, i] = np.bincount(slots[positions], weights=values, minlength=n_slots)
+    counts[:, -1] = np.bincount(slots, minlength=n_slots)
+    return counts
+
+
+def chunk_counts(columns, start, stop, predicates, outcomes, shapes):
+    """
+    Partial counts of rows start..stop of columns that pass the plan.
+
+    predicates   [(column, lookup)]: lookup[code + 1] is True for allowed codes
+    outcomes     [(measure, injury code)]: measure > 0 or PERSON_INJURY == code
+    shapes       {dimension: number of codes} for the tables to count
+
+    Returns {'by': {dimension: (codes + 1, measures + 1) array}, 'crosstab':
+    array or None}; slot 0 holds the rows with no value.
+    """
+    mask = None
+    for col, lookup in predicates:
+        passed = lookup[columns[col][start:stop].astype(np.int64) + 1]
+        mask = passed if mask is None else mask & passed
+    for measure, injury in outcomes:
+        passed = (columns[measure][start:stop] > 0) | (columns['PERSON_INJURY'][start:stop] == injury)
+        mask = passed if mask is None else mask & passed
+    # Without a filter every row counts, read in place rather than gathered
+    rows = slice(start, stop) if mask is None else np.flatnonzero(mask) + start
+    # Measures are mostly zero: only their non-zero rows are weighted, as in summarize()
+    measures = []
+    for measure in MEASURES:
+        values = columns[measure][rows]
+        positions = np.flatnonzero(values)
+        measures.append((positions, values[positions].astype(np.float64)))
+
+    codes = {dim: columns[dim][rows].astype(np.int64) for dim in shapes}
+    partial = {'by': {}, 'crosstab': None}
+    for dim, n_codes in shapes.items():
+        if dim in CHART_DIMENSIONS:
+            partial['by'][dim] = _weighted_counts(codes[dim] + 1, n_codes + 1, measures)
+    if all(dim in shapes for dim in CROSSTAB):
+        row_codes, col_codes = (codes[dim] for dim in CROSSTAB)
+        n_cols = shapes[CROSSTAB[1]]
+        slots = np.where((row_codes < 0) | (col_codes < 0), -1, row_codes * n_cols + col_codes) + 1
+        partial['crosstab'] = _weighted_counts(slots, shapes[CROSSTAB[0]] * n_cols + 1, measures)
+    return partial
+
+
+def _worker_counts(specs, start, stop, predicates, outcomes, shapes):
+    _attach(specs)
+    return chunk_counts(_shared, start, stop, predicates, outcomes, shapes)
+
+
+def _merge(partials):
+    merged = None
+    for partial in partials:
+        if merged is None:
+            merged = partial
+            continue
+        for dim, counts in partial['by'].items():
+            merged['by'][dim] += counts
+        if partial['crosstab'] is not None:
+            merged['crosstab'] += partial['crosstab']
+    return merged
+
+
+def start_pool(workers):
+    """
+    A process pool of workers, all forked before this returns. Raises
+    RuntimeError when another thread is running, as forking then is unsafe.
+    """
+    if threading.active_count() > 1:
+        raise RuntimeError("The aggregation pool must be started before any other thread")
+    # Workers forked after this share the parent's tracker of shared memory
+    # blocks; with one of their own, a worker's exit would unlink the blocks
+    # it had mapped
+    resource_tracker.ensure_running()
+    # Forked workers start from this process's modules instead of re-importing
+    # the app as a fresh interpreter would
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    # The first task forks every worker (before the pool's own thread starts)
+    pool.submit(int).result()
+    return pool
+
+
+class ChunkedAggregator:
+    """
+    The dashboard's summary of a plan's rows, computed chunk by chunk over
+    shared-memory columns, in pool (from start_pool()) when given, else in
+    this process. Built once at load from the crash rows; close() (also run
+    at exit) stops the pool and frees the shared memory.
+    """
+
+    def __init__(self, df, pool=None, chunk_rows=CHUNK_ROWS, min_rows=DEFAULT_MIN_ROWS):
+        self.n_rows = len(df)
+        self.pool = pool
+        self.chunk_rows = chunk_rows
+        self.min_rows = min_rows
+        self.labels = {}
+        self.columns = {}
+        self.blocks = []
+        for dim in DIMENSIONS:
+            if dim in df.columns:
+                codes, self.labels[dim] = _dimension_codes(df[dim])
+                # The narrowest integer type holding -1..len(labels) - 1
+                self.columns[dim] = self._share(codes.astype(np.min_scalar_type(-max(len(self.labels[dim]), 1))))
+        for measure in MEASURES:
+            self.columns[measure] = self._share(df[measure].to_numpy())
+        self.shapes = {dim: len(labels) for dim, labels in self.labels.items()}
+        # Sent with every task: the workers were forked before these blocks existed
+        self.specs = {col: (block.name, values.dtype.str, len(values))
+                      for col, values, block in zip(self.columns, self.columns.values(), self.blocks)}
+        atexit.register(self.close)
+
+    def _share(self, values):
+        """Copy an array into a new shared memory block; returns the view on it"""
+        values = np.ascontiguousarray(values)
+        block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self.blocks.append(block)
+        shared = np.ndarray(len(values), dtype=values.dtype, buffer=block.buf)
+        shared[:] = values
+        return shared
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        self.columns = {}
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def estimate(self, plan):
+        """Upper bound of the rows a plan selects, from its most selective step"""
+        return min([estimate for _, _, estimate in plan['steps']] + [self.n_rows])
+
+    def use_for(self, plan):
+        """Whether to split this plan over the pool rather than stay on the calling thread"""
+        return self.pool is not None and not plan['empty'] and self.estimate(plan) >= self.min_rows
+
+    def _predicates(self, plan):
+        predicates = []
+        for col, values in plan['values'].items():
+            if col not in self.labels:
+                continue
+            allowed = {_key(v) for v in values}
+            lookup = np.zeros(len(self.labels[col]) + 1, dtype=bool)
+            lookup[1:] = [_key(label) in allowed for label in self.labels[col]]
+            predicates.append((col, lookup))
+        # As in the index, outcomes only apply where it could evaluate them
+        outcomes = []
+        injuries = self.labels.get('PERSON_INJURY')
+        for name, _, _ in plan['steps']:
+            if name in OUTCOME_PREDICATES and injuries is not None:
+                measure, injury = OUTCOME_PREDICATES[name]
+                outcomes.append((measure, injuries.get_loc(injury) if injury in injuries else -2))
+        return predicates, outcomes
+
+    def chunks(self, ranges=None):
+        """(start, stop) of every chunk, within the row ranges when given"""
+        for start, stop in ranges if ranges is not None else [(0, self.n_rows)]:
+            for first in range(start, stop, self.chunk_rows):
+                yield first, min(first + self.chunk_rows, stop)
+
+    def summarize(self, plan, ranges=None):
+        """
+        summarize() of the rows a plan selects (within ranges), split into
+        chunks. If the pool breaks (a worker was killed, e.g. out of memory),
+        the chunks are counted in this process instead and the pool is given
+        up: later plans stay on the calling thread.
+        """
+        predicates, outcomes = self._predicates(plan)
+        tasks = list(self.chunks(ranges))
+        pool = self.pool
+        partials = None
+        if pool is not None and len(tasks) >= 2:
+            try:
+                futures = [pool.submit(_worker_counts, self.specs, start, stop, predicates, outcomes, self.shapes)
+                           for start, stop in tasks]
+                partials = [future.result() for future in futures]
+            except BrokenProcessPool as e:
+                log.error(f"Aggregation pool broke ({e}); counting in-process from now on")
+                self.pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+        if partials is None:
+            partials = (chunk_counts(self.columns, start, stop, predicates, outcomes, self.shapes)
+                        for start, stop in tasks)
+        merged = _merge(partials)
+        if merged is None:
+            merged = chunk_counts(self.columns, 0, 0, predicates, outcomes, self.shapes)
+        return self._summary(merged)
+
+    def _summary(self, merged):
+        names = MEASURES + ['rows']
+        summary = {'rows': 0, 'injured': 0, 'killed': 0, 'by': {}, 'sex_injury': None}
+        for dim, counts in merged['by'].items():
+            table = pd.DataFrame(
+                {name: counts[1:, i] for i, name in enumerate(names)},
+                index=self.labels[dim].rename(dim)
+            ).astype('int64')
+            summary['by'][dim] = table[table['rows'] > 0]
+        if merged['by']:
+            # Every row lands in one slot of any dimension, missing ones included
+            totals = next(iter(merged['by'].values())).sum(axis=0)
+            summary['injured'], summary['killed'], summary['rows'] = (int(t) for t in totals)
+        if merged['crosstab'] is not None:
+            row_labels, col_labels = (self.labels[dim] for dim in CROSSTAB)
+            shape = (len(row_labels), len(col_labels))
+            summary['sex_injury'] = {
+                name: pd.DataFrame(
+                    merged['crosstab'][1:, i].reshape(shape),
+                    index=row_labels.rename(CROSSTAB[0]),
+                    columns=col_labels.rename(CROSSTAB[1])
+                )
+                for i, name in enumerate(names)
+            }
+        return summary
+
+
+def workers_from_env():
+    """CRASHLENS_AGGREGATE_WORKERS, capped at the CPUs there are; 0 when unset"""
+    workers = int(os.environ.get('CRASHLENS_AGGREGATE_WORKERS', 0))
+    return min(workers, os.cpu_count() or 1) if workers > 0 else 0
+
+
+def min_rows_from_env():
+    return int(os.environ.get('CRASHLENS_AGGREGATE_MIN_ROWS', DEFAULT_MIN_ROWS))
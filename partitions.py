@@ -0,0 +1,230 @@
+"""
+Year x borough partitions of the dashboard dataset.
+
+Most reports filter on YEAR and BOROUGH. A partitioned column store keeps its
+rows ordered by (YEAR, BOROUGH), so every partition is one contiguous range
+of row positions, and describes the partitions in partitions.json:
+
+    {
+      "version": "<dataset_version()>",
+      "columns": ["YEAR", "BOROUGH"],
+      "rows": 5830000,
+      "partitions": [
+        {"key": [2023, "BROOKLYN"], "start": 0, "stop": 81234,
+         "stats": {"LATITUDE": [40.57, 40.74], "NUMBER_OF_PERSONS_KILLED": [0, 2], ...},
+         "values": {"PERSON_INJURY": ["INJURED", "KILLED", ...], ...}},
+        ...
+      ]
+    }
+
+with the min/max of the numeric columns and the labels present in each
+filter column. PartitionMap.ranges() keeps the partitions a filter plan can
+match: their key must be among the plan's YEAR / BOROUGH values, every other
+filtered column must have one of its values there, and an outcome search
+needs a non-zero count or the outcome's injury label. Each pruning rule is
+also a step of the plan, so restricting the bitmap index to the kept row
+ranges selects exactly the same rows while touching only their words; a
+"Brooklyn 2023" report combines, unpacks and gathers about 1/60th of them.
+
+Row positions stay global, so the bitmap index, spatial grid and exports
+need no translation. The store is memory-mapped: a partition's pages are
+read from disk the first time a report touches it, and memory only grows for
+the partitions that are looked at.
+
+    python partitions.py cleaned_merged_standardized_data.csv [cleaned_merged_standardized_data.partitions]
+"""
+import json
+import numbers
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_store import (
+    COLUMN_STORE_SCHEMA, CSV_PATH, PARTITIONED_PATH, _map_column_store, dataset_version, prepare_dataset,
+    save_column_store
+)
+from filters import INDEXED_COLUMNS, OUTCOME_PREDICATES, _key
+from metrics import log
+
+PARTITION_COLUMNS = ['YEAR', 'BOROUGH']
+PARTITIONS_FILE = 'partitions.json'
+
+
+def _label(value):
+    if pd.isna(value):
+        return None
+    return _key(value) if isinstance(value, numbers.Number) else str(value)
+
+
+def _partition_stats(part):
+    """Min/max of the numeric columns and labels present in the filter columns"""
+    stats = {}
+    values = {}
+    for col in part.columns:
+        series = part[col]
+        if col in INDEXED_COLUMNS and col not in PARTITION_COLUMNS:
+            present = series.value_counts()
+            values[col] = sorted(str(v) for v in present[present > 0].index)
+        elif pd.api.types.is_numeric_dtype(series) and series.notna().any():
+            stats[col] = [float(series.min()), float(series.max())]
+        elif pd.api.types.is_datetime64_any_dtype(series) and series.notna().any():
+            stats[col] = [series.min().isoformat(), series.max().isoformat()]
+    return stats, values
+
+
+def describe_partitions(df, columns=PARTITION_COLUMNS):
+    """The partitions of a frame already ordered by columns, with their statistics"""
+    keys = df[columns].astype(object).where(df[columns].notna(), None)
+    # A new partition starts wherever any key column changes
+    changes = np.zeros(len(df), dtype=bool)
+    if len(df):
+        changes[0] = True
+    for col in columns:
+        values = pd.Series(pd.factorize(keys[col], use_na_sentinel=False)[0])
+        changes[1:] |= (values.to_numpy()[1:] != values.to_numpy()[:-1])
+    starts = np.flatnonzero(changes)
+    stops = np.append(starts[1:], len(df))
+
+    partitions = []
+    for start, stop in zip(starts, stops):
+        stats, values = _partition_stats(df.iloc[start:stop])
+        partitions.append({
+            'key': [_label(keys[col].iloc[start]) for col in columns],
+            'start': int(start),
+            'stop': int(stop),
+            'stats': stats,
+            'values': values
+        })
+    return partitions
+
+
+def save_partitioned(df, path=PARTITIONED_PATH, columns=PARTITION_COLUMNS):
+    """
+    Write the dataset as a column store ordered by the partition columns
+    (stable, so rows keep their order within a partition) plus partitions.json.
+    """
+    df = prepare_dataset(df)
+    df = df.sort_values(columns, kind='stable', na_position='last', ignore_index=True)
+    save_column_store(df, path)
+    save_partition_map(path, columns)
+    return path
+
+
+def save_partition_map(path, columns=PARTITION_COLUMNS):
+    """
+    Describe the partitions of the column store at path in partitions.json,
+    for its current version (which includes where the store is: a store
+    moved into place has to be described again).
+    """
+    start = time.perf_counter()
+    stored = _map_column_store(path)
+    layout = {
+        'version': dataset_version(path),
+        'columns': columns,
+        'rows': len(stored),
+        'partitions': describe_partitions(stored, columns)
+    }
+    with open(os.path.join(path, PARTITIONS_FILE), 'w') as f:
+        json.dump(layout, f)
+    log.info(f"Described {len(layout['partitions'])} partitions in {time.perf_counter() - start:.1f}s")
+    return layout
+
+
+class PartitionMap:
+    """Row ranges of a partitioned store and the pruning of filter plans over them"""
+
+    def __init__(self, layout):
+        self.columns = layout['columns']
+        self.n_rows = layout['rows']
+        self.partitions = layout['partitions']
+
+    @classmethod
+    def load(cls, path, n_rows=None):
+        """
+        The partition map of the store at path, or None when it is not a
+        partitioned store, was rewritten since, or does not match the n_rows
+        rows loaded from it.
+        """
+        try:
+            with open(os.path.join(path, PARTITIONS_FILE)) as f:
+                layout = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(os.path.join(path, COLUMN_STORE_SCHEMA)) or layout['version'] != dataset_version(path):
+            log.warning(f"{path}/{PARTITIONS_FILE} is out of date; partition pruning disabled")
+            return None
+        if n_rows is not None and layout['rows'] != n_rows:
+            return None
+        return cls(layout)
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def remap(self, positions):
+        """
+        The same partitions over a table holding only the store rows at the
+        given ascending positions, such as the first row of each crash
+        (star.CrashTables). Each kept row must lie in its own partition.
+        """
+        bounds = np.searchsorted(positions, [[p['start'], p['stop']] for p in self.partitions])
+        return PartitionMap({
+            'columns': self.columns,
+            'rows': len(positions),
+            'partitions': [dict(p, start=int(a), stop=int(b)) for p, (a, b) in zip(self.partitions, bounds)]
+        })
+
+    def _matches(self, partition, plan):
+        for col, values in plan['values'].items():
+            if col in self.columns:
+                if partition['key'][self.columns.index(col)] not in values:
+                    return False
+            elif col in partition['values']:
+                if not set(partition['values'][col]) & {str(v) for v in values}:
+                    return False
+        for outcome in plan['outcomes']:
+            count_col, injury = OUTCOME_PREDICATES[outcome]
+            counted = partition['stats'].get(count_col, [0, 0])[1] > 0
+            if not counted and injury not in partition['values'].get('PERSON_INJURY', [injury]):
+                return False
+        return True
+
+    def prune(self, plan):
+        """The partitions a plan from plan_filters() can select rows in"""
+        if plan['empty']:
+            return []
+        return [p for p in self.partitions if self._matches(p, plan)]
+
+    def ranges(self, plan):
+        """
+        Row ranges [(start, stop), ...] of the partitions a plan can match,
+        adjacent ones merged, or None when no partition is pruned.
+        """
+        kept = self.prune(plan)
+        if len(kept) == len(self.partitions):
+            return None
+        ranges = []
+        for partition in kept:
+            if ranges and ranges[-1][1] == partition['start']:
+                ranges[-1] = (ranges[-1][0], partition['stop'])
+            else:
+                ranges.append((partition['start'], partition['stop']))
+        return ranges
+
+    def stats(self, ranges):
+        """Partitions and rows inside the given ranges (None = all), for logging"""
+        if ranges is None:
+            return len(self.partitions), self.n_rows
+        rows = sum(stop - start for start, stop in ranges)
+        kept = sum(1 for p in self.partitions if any(a <= p['start'] < b for a, b in ranges))
+        return kept, rows
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else CSV_PATH
+    target = sys.argv[2] if len(sys.argv) > 2 else PARTITIONED_PATH
+    start = time.perf_counter()
+    save_partitioned(pd.read_csv(source, low_memory=False), target)
+    print(f"Converted {source} -> {target} in {time.perf_counter() - start:.1f}s")
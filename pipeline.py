@@ -0,0 +1,608 @@
+"""
+Offline, out-of-core rebuild of the standardized dataset.
+
+This is V1.ipynb's cleaning, integration and standardization as a resumable
+pipeline over local copies of the two NYC Open Data exports. It never holds
+either table in memory: every stage streams fixed-size chunks through and
+checkpoints its output as Parquet parts under the work directory.
+
+    ingest        read the raw CSVs in chunks, columns renamed A B -> A_B
+    clean         upper-case/strip the categorical text, parse CRASH_DATE
+                  into YEAR, blank impossible ages and out-of-NYC coordinates
+    dedupe        keep the first row per COLLISION_ID in each table
+    standardize   fold spelling variants into one label (STANDARDIZATION_MAPS)
+    join          crashes LEFT JOIN persons on COLLISION_ID, one range of
+                  collision ids (bucket) at a time, sorted by COLLISION_ID
+    write         fill the remaining missing values and append each bucket
+                  to the output CSV
+
+    python pipeline.py --crashes Motor_Vehicle_Collisions_-_Crashes.csv \\
+                       --persons Motor_Vehicle_Collisions_-_Person.csv
+
+Each finished stage is recorded in <workdir>/pipeline.json with its timing
+and row counts. A rerun skips the stages already done for the same input
+files; --from STAGE redoes that stage and everything after it. Memory is
+bounded by --chunk-rows and by --bucket-ids (collision ids per join bucket).
+
+The join buckets and the watermark the write stage records are what
+incremental.py updates from delta exports afterwards; this full build is
+its fallback.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_store import COORDINATE_COLUMNS, COUNT_COLUMNS, CSV_PATH
+from spatial import NYC_BOUNDS
+
+STAGES = ['ingest', 'clean', 'dedupe', 'standardize', 'join', 'write']
+TABLES = ['crashes', 'persons']
+
+WORKDIR = 'pipeline_work'
+STATE_FILE = 'pipeline.json'
+
+CHUNK_ROWS = 250_000
+BUCKET_IDS = 250_000
+
+# Parsed as numbers at ingest; everything else stays text
+NUMERIC_COLUMNS = {
+    'crashes': ['COLLISION_ID'] + COORDINATE_COLUMNS + COUNT_COLUMNS,
+    'persons': ['UNIQUE_ID', 'COLLISION_ID', 'VEHICLE_ID', 'PERSON_AGE']
+}
+
+# Numeric columns kept as nullable integers; the other numbers are float64
+ID_COLUMNS = ['COLLISION_ID', 'UNIQUE_ID', 'VEHICLE_ID']
+
+# Suffixes of the columns both tables have, after the join
+JOIN_SUFFIXES = {'crashes': '_CRASH', 'persons': '_PERSON'}
+
+# Categorical text that is upper-cased and stripped
+TEXT_COLUMNS = {
+    'crashes': ['BOROUGH', 'CONTRIBUTING_FACTOR_VEHICLE_1', 'VEHICLE_TYPE_CODE_1'],
+    'persons': ['PERSON_TYPE', 'PERSON_INJURY', 'PERSON_SEX', 'CONTRIBUTING_FACTOR_1', 'CONTRIBUTING_FACTOR_2']
+}
+
+PERSON_AGE_RANGE = (0, 100)
+
+# Standard label -> spellings folded into it, applied in order (a later
+# group sees the result of the earlier ones). None stands for a missing value
+STANDARDIZATION_MAPS = {
+    'VEHICLE_TYPE_CODE_1': {
+        'TAXI': ['TAXI', 'YELLOW TAXI', 'GREEN TAXI'],
+        'SEDAN': ['SEDAN', '4 DR SEDAN', '4-DR SEDAN', '4 DOOR SEDAN', 'FOUR DOOR SEDAN', '4DR SEDAN'],
+        'SPORT UTILITY / STATION WAGON': ['SPORT UTILITY / STATION WAGON', 'SPORT UTILITY/STATION WAGON',
+                                          'SUV', 'STATION WAGON', 'SPORT UTILITY VEHICLE'],
+        'PICK-UP TRUCK': ['PICK-UP TRUCK', 'PICKUP TRUCK', 'PICK UP TRUCK', 'PICKUP', 'PK', 'TRUCK'],
+        'VAN': ['VAN', 'LARGE VAN', 'SMALL VAN', 'CARGO VAN'],
+        'BUS': ['BUS', 'SCHOOL BUS', 'CITY BUS', 'TRANSIT BUS', 'CHARTER BUS', 'INTERCITY BUS'],
+        'MOTORCYCLE': ['MOTORCYCLE', 'MOTORBIKE', 'SCOOTER', 'MOPED'],
+        'BICYCLE': ['BICYCLE', 'BIKE', 'E-BIKE', 'ELECTRIC BIKE'],
+        'UNKNOWN': ['UNKNOWN', 'UNSPECIFIED', 'OTHER', 'N/A', None]
+    },
+    'CONTRIBUTING_FACTOR_VEHICLE_1': {
+        'DRIVER INATTENTION/DISTRACTION': ['DRIVER INATTENTION/DISTRACTION', 'DRIVER INATTENTION',
+                                           'DISTRACTION', 'INATTENTION', 'DRIVER DISTRACTION'],
+        'FOLLOWING TOO CLOSELY': ['FOLLOWING TOO CLOSELY', 'TAILGATING', 'TOO CLOSE'],
+        'FAILURE TO YIELD RIGHT-OF-WAY': ['FAILURE TO YIELD RIGHT-OF-WAY', 'FAILURE TO YIELD',
+                                          'RIGHT OF WAY', 'YIELD FAILURE'],
+        'BACKING UNSAFELY': ['BACKING UNSAFELY', 'UNSAFE BACKING', 'BACKING'],
+        'UNKNOWN': ['UNSPECIFIED', 'UNKNOWN', 'OTHER', 'N/A', None]
+    },
+    'PERSON_TYPE': {
+        'DRIVER': ['DRIVER', 'VEHICLE DRIVER'],
+        'PASSENGER': ['PASSENGER', 'VEHICLE PASSENGER', 'OCCUPANT'],
+        'PEDESTRIAN': ['PEDESTRIAN', 'PED'],
+        'BICYCLIST': ['BICYCLIST', 'CYCLIST', 'BICYCLE RIDER'],
+        'UNKNOWN': ['UNKNOWN', 'UNSPECIFIED', 'OTHER', 'N/A', None]
+    },
+    'PERSON_SEX': {
+        'M': ['M', 'MALE'],
+        'F': ['F', 'FEMALE'],
+        'UNKNOWN': ['U', 'UNKNOWN', 'UNSPECIFIED', 'OTHER', 'N/A', None]
+    },
+    'PERSON_INJURY': {
+        'UNINJURED': ['UNINJURED', 'NO INJURY', 'NO APPARENT INJURY', 'DOES NOT APPLY', 'UNSPECIFIED'],
+        'INJURED': ['INJURED', 'COMPLAINT OF PAIN OR NAUSEA', 'SUSPECTED MINOR INJURY',
+                    'SUSPECTED SERIOUS INJURY', 'POSSIBLE INJURY', 'NON-INCAPACITATING INJURY'],
+        'KILLED': ['KILLED', 'FATAL', 'FATALITY']
+    },
+    'BOROUGH': {
+        'MANHATTAN': ['MANHATTAN', 'NEW YORK'],
+        'BROOKLYN': ['BROOKLYN', 'KINGS'],
+        'QUEENS': ['QUEENS'],
+        'BRONX': ['BRONX'],
+        'STATEN ISLAND': ['STATEN ISLAND', 'RICHMOND'],
+        'UNKNOWN': ['UNKNOWN', 'UNSPECIFIED', 'OTHER', 'N/A', None]
+    }
+}
+
+# Values for the gaps left after the join (unmatched crashes have no person)
+FILL_VALUES = {
+    'PERSON_TYPE': 'Unknown',
+    'PERSON_INJURY': 'Unknown',
+    'PERSON_SEX': 'Unknown',
+    'EJECTION': 'Unknown',
+    'SAFETY_EQUIPMENT': 'Unknown',
+    'BODILY_INJURY': 'Unknown',
+    'EMOTIONAL_STATUS': 'Unknown',
+    'POSITION_IN_VEHICLE': 'Unknown',
+    'PED_LOCATION': 'Unknown',
+    'PED_ACTION': 'Unknown',
+    'COMPLAINT': 'None',
+    'PED_ROLE': 'Unknown',
+    'CONTRIBUTING_FACTOR_1': 'Unspecified',
+    'CONTRIBUTING_FACTOR_2': 'Unspecified',
+    'BOROUGH': 'Unknown',
+    'ON_STREET_NAME': 'Unknown',
+    'CROSS_STREET_NAME': 'Unknown',
+    'OFF_STREET_NAME': 'Unknown',
+    'CONTRIBUTING_FACTOR_VEHICLE_1': 'Unspecified',
+    'CONTRIBUTING_FACTOR_VEHICLE_2': 'Unspecified',
+    'LOCATION': 'Unknown',
+    'VEHICLE_ID': -1
+}
+
+# Imputed columns that get a <column>_was_missing flag
+FLAGGED_COLUMNS = ['PERSON_AGE', 'LATITUDE', 'LONGITUDE']
+
+
+# Chunk storage
+
+def _part_path(directory, index):
+    return os.path.join(directory, f"part-{index:05d}.parquet")
+
+
+def write_part(df, directory, index):
+    os.makedirs(directory, exist_ok=True)
+    df.to_parquet(_part_path(directory, index), index=False)
+
+
+def part_files(directory):
+    return sorted(glob.glob(os.path.join(directory, 'part-*.parquet')))
+
+
+def read_parts(directory):
+    """The chunks of a stage output, in order"""
+    for path in part_files(directory):
+        yield pd.read_parquet(path)
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Per-chunk transformations
+
+def parse_chunk(df, table):
+    """Rename the raw columns A B -> A_B and parse the numeric ones"""
+    df.columns = df.columns.str.strip().str.replace(' ', '_')
+    for col in NUMERIC_COLUMNS[table]:
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce')
+            # One dtype whatever a chunk holds, so every part is written the same way
+            if col in ID_COLUMNS:
+                df[col] = values.where(values % 1 == 0).astype('Int64')
+            else:
+                df[col] = values.astype('float64')
+    return df
+
+
+def clean_chunk(df, table):
+    """Row-wise cleaning; missing values stay missing"""
+    for col in TEXT_COLUMNS[table]:
+        if col in df.columns:
+            df[col] = df[col].str.upper().str.strip()
+    if table == 'crashes':
+        if 'CRASH_DATE' in df.columns:
+            df['CRASH_DATE'] = pd.to_datetime(df['CRASH_DATE'], errors='coerce')
+            df['YEAR'] = df['CRASH_DATE'].dt.year.astype('Int16')
+        for col, (low, high) in (('LATITUDE', NYC_BOUNDS['lat']), ('LONGITUDE', NYC_BOUNDS['lon'])):
+            if col in df.columns:
+                outside = (df[col] == 0) | (df[col] < low) | (df[col] > high)
+                df.loc[outside, col] = np.nan
+    elif 'PERSON_AGE' in df.columns:
+        low, high = PERSON_AGE_RANGE
+        df.loc[(df['PERSON_AGE'] < low) | (df['PERSON_AGE'] > high), 'PERSON_AGE'] = np.nan
+    return df
+
+
+def _standard_value(value, mapping):
+    for standard, variants in mapping.items():
+        for variant in variants:
+            if variant is None:
+                matched = pd.isna(value)
+            else:
+                matched = not pd.isna(value) and str(value).upper().strip() == variant
+            if matched:
+                value = standard
+    return value
+
+
+def standardize_chunk(df, columns=None):
+    """Apply STANDARDIZATION_MAPS, resolving each distinct value once"""
+    for col, mapping in STANDARDIZATION_MAPS.items():
+        if col not in df.columns or (columns is not None and col not in columns):
+            continue
+        values = df[col].astype(object)
+        distinct = pd.unique(values)
+        lookup = {value: _standard_value(value, mapping) for value in distinct if not pd.isna(value)}
+        standardized = values.map(lookup)
+        if values.isna().any():
+            standardized = standardized.where(values.notna(), _standard_value(None, mapping))
+        df[col] = standardized
+    return df
+
+
+def fill_chunk(df, stats):
+    """Fill the gaps of a joined chunk; medians and modes come from the whole join"""
+    for col in FLAGGED_COLUMNS:
+        if col in df.columns:
+            df[f'{col}_was_missing'] = df[col].isna().astype(int)
+    for col in COUNT_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].fillna(0)
+    if 'PERSON_AGE' in df.columns and stats['age_median'] is not None:
+        df['PERSON_AGE'] = df['PERSON_AGE'].fillna(stats['age_median'])
+    if 'ZIP_CODE' in df.columns and stats['zip_mode'] is not None:
+        df['ZIP_CODE'] = df['ZIP_CODE'].fillna(stats['zip_mode'])
+    for col, value in FILL_VALUES.items():
+        if col in df.columns:
+            df[col] = df[col].fillna(value)
+    return df
+
+
+def _median_of_counts(counts):
+    """Median of the values a {value: count} histogram describes"""
+    if not counts:
+        return None
+    values = sorted(counts)
+    cumulative = np.cumsum([counts[v] for v in values])
+    total = cumulative[-1]
+    lower = values[int(np.searchsorted(cumulative, (total + 1) // 2))]
+    upper = values[int(np.searchsorted(cumulative, total // 2 + 1))]
+    return (lower + upper) / 2
+
+
+def _add_counts(totals, series, sign=1):
+    for value, n in series.value_counts().items():
+        totals[value] = totals.get(value, 0) + sign * int(n)
+        if totals[value] == 0:
+            del totals[value]
+
+
+def fill_stats(ages, zip_codes):
+    """The write stage's fill values from the join's age / ZIP code histograms"""
+    # mode() breaks ties by the smallest value
+    zip_mode = min(zip_codes, key=lambda z: (-zip_codes[z], z)) if zip_codes else None
+    return {'age_median': _median_of_counts(ages), 'zip_mode': zip_mode}
+
+
+def histogram_state(ages, zip_codes):
+    """The histograms as [value, count] pairs for pipeline.json, with their fill values"""
+    state = {
+        'age_counts': [[float(age), n] for age, n in sorted(ages.items())],
+        'zip_counts': [[str(z), n] for z, n in sorted(zip_codes.items())]
+    }
+    state.update(fill_stats(ages, zip_codes))
+    return state
+
+
+def joined_name(col, table, columns):
+    """Name of a crashes / persons column in the joined table"""
+    other = columns.get('persons' if table == 'crashes' else 'crashes', [])
+    if col != 'COLLISION_ID' and col in other:
+        return col + JOIN_SUFFIXES[table]
+    return col
+
+
+def join_bucket(crashes, persons):
+    """
+    crashes LEFT JOIN persons (at most one per collision) on COLLISION_ID,
+    sorted by it. Person columns of unmatched crashes are standardized like
+    the rest.
+    """
+    if persons is None:
+        joined = crashes
+    else:
+        suffixes = (JOIN_SUFFIXES['crashes'], JOIN_SUFFIXES['persons'])
+        joined = crashes.merge(persons, on='COLLISION_ID', how='left', suffixes=suffixes)
+        joined = standardize_chunk(joined, columns=TEXT_COLUMNS['persons'])
+    return joined.sort_values('COLLISION_ID', kind='stable', ignore_index=True)
+
+
+# Stages. Each reads the previous stage's parts, writes its own into `out`
+# and returns {'rows': {table: {'in': n, 'out': n}}, ...}
+
+def stage_ingest(ctx, out):
+    rows = {}
+    for table in TABLES:
+        count = 0
+        reader = pd.read_csv(ctx['inputs'][table], chunksize=ctx['chunk_rows'], dtype=str)
+        for index, chunk in enumerate(reader):
+            write_part(parse_chunk(chunk, table), os.path.join(out, table), index)
+            count += len(chunk)
+        rows[table] = {'in': count, 'out': count}
+    return {'rows': rows}
+
+
+def _map_stage(ctx, out, previous, transform):
+    rows = {}
+    for table in TABLES:
+        count = 0
+        for index, chunk in enumerate(read_parts(os.path.join(ctx['workdir'], previous, table))):
+            chunk = transform(chunk, table)
+            write_part(chunk, os.path.join(out, table), index)
+            count += len(chunk)
+        rows[table] = {'in': count, 'out': count}
+    return {'rows': rows}
+
+
+def stage_clean(ctx, out):
+    return _map_stage(ctx, out, 'ingest', clean_chunk)
+
+
+def stage_dedupe(ctx, out):
+    """
+    First row per COLLISION_ID in each table, as drop_duplicates() would keep
+    it. Seen ids are a boolean array indexed by id, grown as needed.
+    """
+    rows = {}
+    id_ranges = {}
+    for table in TABLES:
+        seen = np.zeros(0, dtype=bool)
+        seen_missing = False
+        count_in = count_out = 0
+        for index, chunk in enumerate(read_parts(os.path.join(ctx['workdir'], 'clean', table))):
+            count_in += len(chunk)
+            ids = chunk['COLLISION_ID']
+            keep = ~ids.duplicated().to_numpy()
+            missing = ids.isna().to_numpy()
+            present = ids.fillna(0).to_numpy(dtype=np.int64)
+            if len(present) and present.max() >= len(seen):
+                grown = np.zeros(max(present.max() + 1, 2 * len(seen)), dtype=bool)
+                grown[:len(seen)] = seen
+                seen = grown
+            keep &= np.where(missing, not seen_missing, ~seen[present])
+            seen[present[keep & ~missing]] = True
+            seen_missing = seen_missing or bool((keep & missing).any())
+            chunk = chunk[keep]
+            write_part(chunk, os.path.join(out, table), index)
+            count_out += len(chunk)
+        rows[table] = {'in': count_in, 'out': count_out}
+        ids = np.flatnonzero(seen)
+        id_ranges[table] = [int(ids.min()), int(ids.max())] if len(ids) else [0, 0]
+    return {'rows': rows, 'id_ranges': id_ranges}
+
+
+def stage_standardize(ctx, out):
+    return _map_stage(ctx, out, 'dedupe', lambda chunk, table: standardize_chunk(chunk))
+
+
+def _bucket_of(ids, first_id, bucket_ids, n_buckets):
+    """Join bucket per collision id; missing ids go to the extra last bucket"""
+    buckets = ((ids.fillna(first_id).to_numpy(dtype=np.int64) - first_id) // bucket_ids).clip(0, n_buckets - 1)
+    return np.where(ids.isna().to_numpy(), n_buckets, buckets)
+
+
+def joined_part(directory, bucket):
+    """
+    Part file of a join bucket; bucket None holds the crashes without a
+    collision id, written last so buckets added later never take its name.
+    """
+    if bucket is None:
+        return os.path.join(directory, 'part-unkeyed.parquet')
+    return _part_path(directory, bucket)
+
+
+def stage_join(ctx, out):
+    """
+    Range-partitioned left join: both tables are scattered into buckets of
+    bucket_ids consecutive collision ids, then each bucket pair is merged on
+    its own. The age / ZIP code histograms for the write stage's fills are
+    collected on the way, and the persons no crash matched are kept for
+    incremental updates (incremental.py).
+    """
+    bucket_ids = ctx['bucket_ids']
+    first_id, last_id = ctx['state']['stages']['dedupe']['id_ranges']['crashes']
+    n_buckets = (last_id - first_id) // bucket_ids + 1
+    scatter = os.path.join(out, 'scatter')
+    schema = {}
+
+    for table in TABLES:
+        for index, chunk in enumerate(read_parts(os.path.join(ctx['workdir'], 'standardize', table))):
+            schema.setdefault(table, chunk.iloc[:0])
+            buckets = _bucket_of(chunk['COLLISION_ID'], first_id, bucket_ids, n_buckets)
+            for bucket in np.unique(buckets):
+                write_part(chunk[buckets == bucket], os.path.join(scatter, table, f"{bucket:05d}"), index)
+
+    ages = {}
+    zip_codes = {}
+    orphans = []
+    count_in = {table: 0 for table in TABLES}
+    count_out = 0
+    for bucket in range(n_buckets + 1):
+        crashes = [pd.read_parquet(p) for p in part_files(os.path.join(scatter, 'crashes', f"{bucket:05d}"))]
+        persons = [pd.read_parquet(p) for p in part_files(os.path.join(scatter, 'persons', f"{bucket:05d}"))]
+        persons = pd.concat(persons, ignore_index=True) if persons else schema.get('persons')
+        count_in['persons'] += 0 if persons is None else len(persons)
+        keyed = bucket < n_buckets
+        if not crashes:
+            if keyed and persons is not None:
+                orphans.append(persons)
+            continue
+        crashes = pd.concat(crashes, ignore_index=True)
+        count_in['crashes'] += len(crashes)
+
+        joined = join_bucket(crashes, persons)
+        if keyed and persons is not None:
+            orphans.append(persons[~persons['COLLISION_ID'].isin(crashes['COLLISION_ID'])])
+        if 'PERSON_AGE' in joined.columns:
+            _add_counts(ages, joined['PERSON_AGE'])
+        if 'ZIP_CODE' in joined.columns:
+            _add_counts(zip_codes, joined['ZIP_CODE'])
+        os.makedirs(os.path.join(out, 'joined'), exist_ok=True)
+        joined.to_parquet(joined_part(os.path.join(out, 'joined'), bucket if keyed else None), index=False)
+        count_out += len(joined)
+    shutil.rmtree(scatter)
+    if 'persons' in schema:
+        pd.concat([schema['persons']] + orphans, ignore_index=True).to_parquet(
+            os.path.join(out, 'orphans.parquet'), index=False
+        )
+
+    result = {
+        'rows': {
+            'crashes': {'in': count_in['crashes'], 'out': count_out},
+            'persons': {'in': count_in['persons'], 'out': count_out}
+        },
+        'buckets': n_buckets,
+        'columns': {table: list(frame.columns) for table, frame in schema.items()}
+    }
+    result.update(histogram_state(ages, zip_codes))
+    return result
+
+
+def _raise_watermark(watermark, chunk, columns):
+    """Highest COLLISION_ID and crash date seen so far, including chunk"""
+    ids = chunk['COLLISION_ID'].dropna()
+    if len(ids):
+        watermark['collision_id'] = max(watermark['collision_id'] or 0, int(ids.max()))
+    date_column = joined_name('CRASH_DATE', 'crashes', columns)
+    if date_column in chunk.columns:
+        dates = pd.to_datetime(chunk[date_column], errors='coerce').dropna()
+        if len(dates):
+            latest = dates.max().strftime('%Y-%m-%d')
+            watermark['crash_date'] = max(watermark['crash_date'] or latest, latest)
+    return watermark
+
+
+def stage_write(ctx, out):
+    """
+    Fill each joined bucket and append it to the output CSV, which replaces
+    the old one only once complete. Records the watermark: the highest
+    COLLISION_ID and crash date written.
+    """
+    stats = ctx['state']['stages']['join']
+    os.makedirs(out, exist_ok=True)
+    temporary = os.path.join(out, os.path.basename(ctx['output']))
+    watermark = {'collision_id': None, 'crash_date': None}
+    count = 0
+    for chunk in read_parts(os.path.join(ctx['workdir'], 'join', 'joined')):
+        _raise_watermark(watermark, chunk, stats['columns'])
+        chunk = fill_chunk(chunk, stats)
+        chunk.to_csv(temporary, mode='a', header=count == 0, index=False)
+        count += len(chunk)
+    os.replace(temporary, ctx['output'])
+    return {
+        'rows': {'joined': {'in': count, 'out': count}},
+        'output': os.path.abspath(ctx['output']),
+        'watermark': watermark
+    }
+
+
+STAGE_FUNCTIONS = {
+    'ingest': stage_ingest,
+    'clean': stage_clean,
+    'dedupe': stage_dedupe,
+    'standardize': stage_standardize,
+    'join': stage_join,
+    'write': stage_write
+}
+
+
+# Runner
+
+def load_state(workdir):
+    try:
+        with open(os.path.join(workdir, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'inputs': None, 'stages': {}}
+
+
+def save_state(workdir, state):
+    temporary = os.path.join(workdir, f"{STATE_FILE}.tmp")
+    with open(temporary, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temporary, os.path.join(workdir, STATE_FILE))
+
+
+def run_pipeline(crashes, persons, output=CSV_PATH, workdir=WORKDIR,
+                 chunk_rows=CHUNK_ROWS, bucket_ids=BUCKET_IDS, start=None):
+    """
+    Run the stages that are not checkpointed yet (or start and everything
+    after it), returning the pipeline state with per-stage timing and counts.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    state = load_state(workdir)
+    inputs = {'crashes': _fingerprint(crashes), 'persons': _fingerprint(persons)}
+    settings = {'chunk_rows': chunk_rows, 'bucket_ids': bucket_ids}
+    if state['inputs'] != inputs or state.get('settings') != settings:
+        # Different input files (or chunking): nothing checkpointed applies
+        state = {'inputs': inputs, 'settings': settings, 'stages': {}}
+    ctx = {
+        'inputs': {'crashes': crashes, 'persons': persons},
+        'output': output,
+        'workdir': workdir,
+        'chunk_rows': chunk_rows,
+        'bucket_ids': bucket_ids,
+        'state': state
+    }
+
+    redo = False
+    for stage in STAGES:
+        redo = redo or stage == start or stage not in state['stages']
+        if stage == 'write' and not os.path.exists(output):
+            redo = True
+        if not redo:
+            print(f"[{stage}] checkpointed, skipping")
+            continue
+
+        if stage == 'join' and state.get('deltas'):
+            print(f"[join] dropping {len(state['deltas'])} incremental update(s) applied since the last full build")
+            state['deltas'] = []
+        state['stages'].pop(stage, None)
+        out = os.path.join(workdir, stage)
+        partial = f"{out}.partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        started = time.perf_counter()
+        result = STAGE_FUNCTIONS[stage](ctx, partial)
+        result['seconds'] = round(time.perf_counter() - started, 2)
+        # Publish the checkpoint only once the stage has finished
+        shutil.rmtree(out, ignore_errors=True)
+        os.replace(partial, out)
+        state['stages'][stage] = result
+        save_state(workdir, state)
+
+        counts = ', '.join(f"{table} {c['in']:,} -> {c['out']:,}" for table, c in result['rows'].items())
+        print(f"[{stage}] {counts} rows in {result['seconds']:.1f}s")
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--crashes', required=True, help="Motor Vehicle Collisions - Crashes CSV export")
+    parser.add_argument('--persons', required=True, help="Motor Vehicle Collisions - Person CSV export")
+    parser.add_argument('--output', default=CSV_PATH)
+    parser.add_argument('--workdir', default=WORKDIR)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--bucket-ids', type=int, default=BUCKET_IDS)
+    parser.add_argument('--from', dest='start', choices=STAGES, help="redo this stage and the ones after it")
+    args = parser.parse_args()
+
+    state = run_pipeline(
+        args.crashes, args.persons, args.output, args.workdir,
+        args.chunk_rows, args.bucket_ids, args.start
+    )
+    total = sum(stage['seconds'] for stage in state['stages'].values())
+    print(f"Wrote {args.output} ({total:.1f}s over all stages); stage log in {os.path.join(args.workdir, STATE_FILE)}")
+
+
+if __name__ == '__main__':
+    main()
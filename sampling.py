@@ -0,0 +1,164 @@
+"""
+Stratified samples behind the dashboard's quick preview.
+
+StratifiedSample draws a simple random sample of the crash rows within every
+BOROUGH x YEAR stratum, sized in proportion to the stratum (at least
+MIN_PER_STRATUM rows, at most all of them). Each sampled row stands for
+N_h / n_h rows of its stratum, so summarize() over the sample rows a plan
+selects, weighted that way, estimates every KPI and chart count of the full
+table. estimate() adds the half-width of a CONFIDENCE interval to the crash,
+injury and fatality totals, from the stratified variance with the finite
+population correction.
+
+CRASHLENS_PREVIEW_ROWS sets the sample size (default 200,000; 0 turns the
+preview off). CRASHLENS_PREVIEW_ERROR instead asks for a relative margin, e.g.
+0.05 for +/-5% on the crash count of a view matching TARGET_SELECTIVITY of the
+crashes, and sizes the sample for it; views matching more do better, narrower
+ones worse.
+"""
+import os
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from aggregation import DIMENSIONS, MEASURES, summarize
+from filters import BitmapIndex
+
+STRATA = ['BOROUGH', 'YEAR']
+
+DEFAULT_ROWS = 200_000
+
+MIN_PER_STRATUM = 10
+
+# Below this many matching sample rows an estimate is too rough to show
+MIN_MATCHES = 30
+
+CONFIDENCE = 0.95
+Z = NormalDist().inv_cdf(0.5 + CONFIDENCE / 2)
+
+# Share of the crashes a view matches that CRASHLENS_PREVIEW_ERROR is sized for
+TARGET_SELECTIVITY = 0.01
+
+# KPI totals with a margin, and the column each one sums (None counts rows)
+TOTALS = {'rows': None, 'injured': 'NUMBER_OF_PERSONS_INJURED', 'killed': 'NUMBER_OF_PERSONS_KILLED'}
+
+
+def strata_codes(df):
+    """Stratum of every row (0..n-1), missing borough or year forming strata of their own"""
+    ids = np.zeros(len(df), dtype=np.int64)
+    for col in STRATA:
+        if col in df.columns:
+            codes, uniques = pd.factorize(df[col])
+            ids = ids * (len(uniques) + 1) + (codes + 1)
+    codes, _ = pd.factorize(ids)
+    return codes
+
+
+def allocate(population, n_rows):
+    """Sample rows per stratum: proportional, at least MIN_PER_STRATUM, at most the whole stratum"""
+    proportional = np.round(n_rows * population / population.sum()).astype(np.int64)
+    return np.minimum(np.maximum(proportional, MIN_PER_STRATUM), population)
+
+
+def draw(strata, allocation, rng):
+    """
+    Sorted positions of a simple random sample of allocation[h] rows within
+    each stratum h: the rows with the smallest random keys. Only rows whose
+    key falls under a generous per-stratum threshold are sorted.
+    """
+    population = np.bincount(strata, minlength=len(allocation))
+    keys = rng.random(len(strata))
+    threshold = np.minimum((1.5 * allocation + 20) / np.maximum(population, 1), 1.0)
+    candidates = np.flatnonzero(keys < threshold[strata])
+    order = candidates[np.lexsort((keys[candidates], strata[candidates]))]
+    ordered_strata = strata[order]
+    rank = np.arange(len(order)) - np.searchsorted(ordered_strata, ordered_strata)
+    return np.sort(order[rank < allocation[ordered_strata]])
+
+
+class StratifiedSample:
+    """
+    A BOROUGH x YEAR stratified sample of the crash rows with its own bitmap
+    index, so a plan from plan_filters() selects sample rows the same way it
+    selects crashes.
+    """
+
+    def __init__(self, df, n_rows, seed=0):
+        strata = strata_codes(df)
+        self.population = np.bincount(strata)
+        # A child stream: plain integer seeds can repeat the draws that generated
+        # the data (default_rng(0) and default_rng([0, 0]) coincide)
+        rng = np.random.default_rng(np.random.SeedSequence(seed).spawn(1)[0])
+        positions = draw(strata, allocate(self.population, n_rows), rng)
+        self.strata = strata[positions]
+        self.sizes = np.bincount(self.strata, minlength=len(self.population))
+        self.weights = self.population[self.strata] / self.sizes[self.strata]
+        columns = [col for col in DIMENSIONS + MEASURES if col in df.columns]
+        self.frame = df[columns].take(positions).reset_index(drop=True)
+        self.index = BitmapIndex(self.frame)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def estimate(self, plan):
+        """
+        summarize() of the full table estimated from the sample rows a plan
+        selects, plus 'margins' ({'rows', 'injured', 'killed'}: half-width of
+        the confidence interval of each total, None for a total fewer than
+        MIN_MATCHES sample rows add to) and 'sample_rows'. None when fewer than
+        MIN_MATCHES sample rows match.
+        """
+        selection = self.index.select_plan(plan)
+        rows = np.arange(len(self.frame)) if selection is None else self.index.rows(selection)
+        if len(rows) < MIN_MATCHES:
+            return None
+        matched = self.frame.take(rows)
+        weights = self.weights[rows]
+        scaled = matched.assign(rows=weights, **{m: matched[m].to_numpy() * weights for m in MEASURES})
+        summary = summarize(scaled)
+        strata = self.strata[rows]
+        summary['margins'] = {}
+        for total, col in TOTALS.items():
+            values = np.ones(len(rows)) if col is None else matched[col].to_numpy()
+            # Too few non-zero sample rows (e.g. fatalities) make the interval meaningless
+            enough = np.count_nonzero(values) >= MIN_MATCHES
+            summary['margins'][total] = self.margin(strata, values) if enough else None
+        summary['sample_rows'] = len(rows)
+        return summary
+
+    def margin(self, strata, values):
+        """
+        Half-width of the confidence interval of the estimated total of values,
+        given for the matching sample rows (their strata); every other sample
+        row counts as 0.
+
+        The stratified variance is taken unless the unstratified (with
+        replacement) one is larger: a rare value missing from most strata's
+        sample would otherwise look certain there.
+        """
+        n = self.sizes
+        values = values.astype(np.float64)
+        sums = np.bincount(strata, weights=values, minlength=len(n))
+        squares = np.bincount(strata, weights=values ** 2, minlength=len(n))
+        # Within-stratum sample variance; a stratum of one row is sampled whole
+        variance = np.zeros(len(n))
+        several = n > 1
+        variance[several] = (squares[several] - sums[several] ** 2 / n[several]) / (n[several] - 1)
+        population = self.population
+        stratified = np.sum(population ** 2 * (1 - n / population) * variance / np.maximum(n, 1))
+
+        # Every sample row's weighted value, the non-matching ones being 0
+        weighted = self.population[strata] / n[strata] * values
+        total, squared, size = weighted.sum(), (weighted ** 2).sum(), len(self.strata)
+        unstratified = size / (size - 1) * (squared - total ** 2 / size)
+        return float(Z * np.sqrt(max(stratified, unstratified, 0.0)))
+
+
+def sample_rows_from_env():
+    """CRASHLENS_PREVIEW_ERROR turned into a sample size, else CRASHLENS_PREVIEW_ROWS"""
+    error = os.environ.get('CRASHLENS_PREVIEW_ERROR')
+    if error:
+        p = TARGET_SELECTIVITY
+        return int(np.ceil(Z ** 2 * (1 - p) / (float(error) ** 2 * p)))
+    return int(os.environ.get('CRASHLENS_PREVIEW_ROWS', DEFAULT_ROWS))
@@ -0,0 +1,204 @@
+"""
+Spatial binning for the crash map.
+
+Instead of plotting a random sample of crashes, the map shows every selected
+crash binned into a fixed lat/lon grid over NYC. Each row's grid cell is
+computed once at load, so a request only gathers the cell ids of the selected
+rows and bincounts them with the crash / injured / killed weights. The figure
+payload grows with the number of occupied cells, not with the number of rows.
+
+The grid doubles as a spatial index: rows are also kept grouped by cell, so a
+zoomed or panned map reads only the rows of the visible cells. viewport()
+picks the level of detail: individual crashes when few enough are visible,
+otherwise a density binned to the viewport (or the grid cells themselves when
+zoomed out that far).
+"""
+import numpy as np
+import pandas as pd
+
+# Same box the map used to drop bad coordinates
+NYC_BOUNDS = {
+    'lat': (40.5, 40.9),
+    'lon': (-74.25, -73.7)
+}
+
+# About 550 m north-south and 420 m east-west at NYC's latitude
+CELL_DEGREES = 0.005
+
+# Most crashes drawn individually; busier viewports are binned
+POINT_BUDGET = 2000
+
+# Bins across the longer side of a viewport's density
+VIEW_BINS = 64
+
+# Map size used to estimate the viewport when plotly does not report it
+MAP_PIXELS = (1200, 400)
+
+# Map weight choices: measure column -> label
+MAP_WEIGHTS = {
+    'rows': 'Crashes',
+    'NUMBER_OF_PERSONS_INJURED': 'Injuries',
+    'NUMBER_OF_PERSONS_KILLED': 'Fatalities'
+}
+
+
+class SpatialGrid:
+    """
+    Per-row grid cell ids over NYC_BOUNDS, built once at load.
+
+    Rows with missing coordinates or outside the box get cell -1 and are
+    never counted. The other rows are also stored grouped by cell (order,
+    with cell c's rows at order[cell_starts[c]:cell_starts[c + 1]]).
+    """
+
+    def __init__(self, df, cell_degrees=CELL_DEGREES, bounds=NYC_BOUNDS):
+        self.cell_degrees = cell_degrees
+        self.lat_min, self.lat_max = bounds['lat']
+        self.lon_min, self.lon_max = bounds['lon']
+        self.n_lat = int(np.ceil((self.lat_max - self.lat_min) / cell_degrees))
+        self.n_lon = int(np.ceil((self.lon_max - self.lon_min) / cell_degrees))
+        self.n_cells = self.n_lat * self.n_lon
+
+        lat = df['LATITUDE'].to_numpy()
+        lon = df['LONGITUDE'].to_numpy()
+        # NaN coordinates fail every comparison, so they fall outside too
+        inside = (lat >= self.lat_min) & (lat <= self.lat_max) & (lon >= self.lon_min) & (lon <= self.lon_max)
+        with np.errstate(invalid='ignore'):
+            row = np.clip(((lat - self.lat_min) / cell_degrees).astype(np.int32), 0, self.n_lat - 1)
+            col = np.clip(((lon - self.lon_min) / cell_degrees).astype(np.int32), 0, self.n_lon - 1)
+        self.cells = np.where(inside, row * self.n_lon + col, -1).astype(np.int32)
+        self.lat = lat
+        self.lon = lon
+
+        located = np.flatnonzero(inside)
+        # Stable sort of small ints is a radix sort; each cell's rows stay ordered
+        self.order = located[np.argsort(self.cells[located], kind='stable')].astype(np.uint32)
+        self.cell_starts = np.concatenate([
+            [0], np.cumsum(np.bincount(self.cells[located], minlength=self.n_cells))
+        ])
+        self.measures = {
+            measure: df[measure].to_numpy()
+            for measure in MAP_WEIGHTS if measure in df.columns
+        }
+
+    @property
+    def nbytes(self):
+        return self.cells.nbytes + self.order.nbytes + self.cell_starts.nbytes
+
+    def cell_centers(self, cells):
+        """Latitude and longitude of the centers of the given cell ids"""
+        row, col = np.divmod(cells, self.n_lon)
+        return (
+            self.lat_min + (row + 0.5) * self.cell_degrees,
+            self.lon_min + (col + 0.5) * self.cell_degrees
+        )
+
+    def _bin_table(self, bins, n_bins, positions, centers):
+        """Crashes and measure sums per occupied bin, with bin-center coordinates"""
+        counts = {'rows': np.bincount(bins, minlength=n_bins)}
+        for measure, values in self.measures.items():
+            counts[measure] = np.bincount(bins, weights=values[positions], minlength=n_bins)
+
+        occupied = np.flatnonzero(counts['rows'])
+        lat, lon = centers(occupied)
+        table = pd.DataFrame({name: c[occupied].astype(np.int64) for name, c in counts.items()})
+        table.insert(0, 'LONGITUDE', lon)
+        table.insert(0, 'LATITUDE', lat)
+        return table
+
+    def density(self, positions=None):
+        """
+        Crashes plus injured/killed sums per occupied cell for the given row
+        positions (None = every row), as a DataFrame with cell-center
+        LATITUDE / LONGITUDE.
+        """
+        cells = self.cells if positions is None else self.cells[positions]
+        inside = cells >= 0
+        if positions is None:
+            positions = np.flatnonzero(inside)
+        else:
+            positions = positions[inside]
+        return self._bin_table(cells[inside], self.n_cells, positions, self.cell_centers)
+
+    def _cell_range(self, low, high, origin, n):
+        first = int(np.clip(np.floor((low - origin) / self.cell_degrees), 0, n - 1))
+        last = int(np.clip(np.floor((high - origin) / self.cell_degrees), 0, n - 1))
+        return first, last
+
+    def viewport_rows(self, lat_range, lon_range):
+        """Positions of the rows in every grid cell touching the viewport"""
+        row_first, row_last = self._cell_range(*lat_range, self.lat_min, self.n_lat)
+        col_first, col_last = self._cell_range(*lon_range, self.lon_min, self.n_lon)
+        # Cells of one grid row are contiguous, so each row is a single slice
+        first_cells = np.arange(row_first, row_last + 1) * self.n_lon + col_first
+        starts = self.cell_starts[first_cells]
+        stops = self.cell_starts[first_cells + (col_last - col_first) + 1]
+        return np.concatenate([self.order[a:b] for a, b in zip(starts, stops)])
+
+    def viewport(self, lat_range, lon_range, keep=None, point_budget=POINT_BUDGET):
+        """
+        What the map should draw for a viewport, as (mode, data):
+
+        ('points', positions)   at most point_budget visible crashes
+        ('density', table)      crashes binned to the viewport, as from density()
+
+        keep(positions) -> bool mask restricts the rows, e.g. to a filter
+        selection. Viewports outside the grid get ('points', empty).
+        """
+        outside = (
+            lat_range[1] < self.lat_min or lat_range[0] > self.lat_max or
+            lon_range[1] < self.lon_min or lon_range[0] > self.lon_max
+        )
+        if outside:
+            return 'points', np.zeros(0, dtype=np.uint32)
+        positions = self.viewport_rows(lat_range, lon_range)
+        if keep is not None:
+            positions = positions[keep(positions)]
+
+        bin_degrees = max(lat_range[1] - lat_range[0], lon_range[1] - lon_range[0]) / VIEW_BINS
+        if len(positions) > point_budget and bin_degrees >= self.cell_degrees:
+            # Zoomed out: the precomputed cells are already fine enough
+            return 'density', self._bin_table(self.cells[positions], self.n_cells, positions, self.cell_centers)
+
+        lat = self.lat[positions]
+        lon = self.lon[positions]
+        visible = (lat >= lat_range[0]) & (lat <= lat_range[1]) & (lon >= lon_range[0]) & (lon <= lon_range[1])
+        positions = positions[visible]
+        if len(positions) <= point_budget:
+            return 'points', positions
+
+        n_lon = int(np.ceil((lon_range[1] - lon_range[0]) / bin_degrees)) + 1
+        n_lat = int(np.ceil((lat_range[1] - lat_range[0]) / bin_degrees)) + 1
+        row = ((lat[visible] - lat_range[0]) / bin_degrees).astype(np.int64)
+        col = ((lon[visible] - lon_range[0]) / bin_degrees).astype(np.int64)
+
+        def centers(bins):
+            bin_row, bin_col = np.divmod(bins, n_lon)
+            return lat_range[0] + (bin_row + 0.5) * bin_degrees, lon_range[0] + (bin_col + 0.5) * bin_degrees
+
+        return 'density', self._bin_table(row * n_lon + col, n_lat * n_lon, positions, centers)
+
+
+def viewport_bounds(relayout_data, pixels=MAP_PIXELS):
+    """
+    (lat_range, lon_range) visible after a mapbox relayout, or None when the
+    event did not move the map. Uses the corner coordinates plotly reports,
+    else estimates them from the center and zoom.
+    """
+    if not relayout_data:
+        return None
+    derived = relayout_data.get('mapbox._derived')
+    if derived and derived.get('coordinates'):
+        lon, lat = zip(*derived['coordinates'])
+        return (min(lat), max(lat)), (min(lon), max(lon))
+    if 'mapbox.center' not in relayout_data or 'mapbox.zoom' not in relayout_data:
+        return None
+    center = relayout_data['mapbox.center']
+    # Web-mercator tiles are 512 px wide in mapbox-gl
+    degrees_per_pixel = 360 / (512 * 2 ** relayout_data['mapbox.zoom'])
+    half_lon = pixels[0] / 2 * degrees_per_pixel
+    half_lat = pixels[1] / 2 * degrees_per_pixel * np.cos(np.radians(center['lat']))
+    return (
+        (center['lat'] - half_lat, center['lat'] + half_lat),
+        (center['lon'] - half_lon, center['lon'] + half_lon)
+    )
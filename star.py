@@ -0,0 +1,224 @@
+"""
+Crash / person star schema of the dashboard dataset.
+
+The merged table has one row per (crash, person): its left join repeats every
+crash column (borough, factor, vehicle, coordinates, counts) once per person
+of the crash. CrashTables splits it at load into
+
+    crashes   one row per COLLISION_ID, in the order the crashes first appear
+    persons   the person columns, grouped by crash: person_crash[p] is the
+              crash row of person p, and the persons of crash c are rows
+              person_starts[c]:person_starts[c + 1]
+
+so crash-level numbers (crash counts, NUMBER_OF_PERSONS_INJURED sums, the
+map) count each crash once, and the crash columns are stored once. A crash
+the join found no person for keeps its single row of Unknowns, as in the
+merged table.
+
+CrashIndex filters the crash rows. Crash columns use their bitmaps as
+BitmapIndex does; the person predicates of a plan select person rows, which
+are semi-joined down to the crashes they belong to ("crashes with a female
+pedestrian"). The search outcomes hold for a crash when its counts say so or
+one of its persons has the injury.
+
+The notebook and pipeline.py keep at most one person per collision. Then both
+tables have the merged table's rows (one_to_one), nothing is copied, and the
+merged frame with a plain BitmapIndex already is the star schema.
+"""
+import numpy as np
+import pandas as pd
+
+from filters import INDEXED_COLUMNS, OUTCOME_PREDICATES, BitmapIndex, _pack, value_mask
+
+CRASH_KEY = 'COLLISION_ID'
+
+# Columns of the persons table; pipeline.py suffixes the ones both tables have
+# with _PERSON, and the rest of the person attributes start with PERSON_
+PERSON_COLUMNS = [
+    'UNIQUE_ID',
+    'VEHICLE_ID',
+    'EMOTIONAL_STATUS',
+    'BODILY_INJURY',
+    'POSITION_IN_VEHICLE',
+    'SAFETY_EQUIPMENT',
+    'EJECTION',
+    'COMPLAINT',
+    'PED_ROLE',
+    'PED_LOCATION',
+    'PED_ACTION',
+    'CONTRIBUTING_FACTOR_1',
+    'CONTRIBUTING_FACTOR_2'
+]
+
+
+def is_person_column(col):
+    """Whether a merged-table column comes from the persons table"""
+    return col in PERSON_COLUMNS or col.startswith('PERSON_') or col.endswith('_PERSON')
+
+
+def _columns(df, names):
+    """df[names] without copying the columns, so a memory-mapped store stays shared"""
+    data = {}
+    for col in names:
+        series = df[col]
+        data[col] = series.array if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) else series.to_numpy()
+    return pd.DataFrame(data, copy=False)
+
+
+def _crash_rows(ids):
+    """
+    Crash row of every merged row, crashes numbered in order of first
+    appearance, and the merged row each crash first appears at. Rows without
+    a COLLISION_ID are crashes of their own.
+    """
+    codes, uniques = pd.factorize(ids)
+    missing = codes < 0
+    if len(uniques) == len(codes):
+        return codes, np.arange(len(codes))
+    codes[missing] = len(uniques) + np.arange(missing.sum())
+    _, first = np.unique(codes, return_index=True)
+    # np.unique orders by code; renumber by first appearance
+    rank = np.empty(len(first), dtype=np.int64)
+    order = np.argsort(first, kind='stable')
+    rank[order] = np.arange(len(first))
+    return rank[codes], first[order]
+
+
+def _expand(starts, stops):
+    """Concatenated ranges starts[i]:stops[i]"""
+    lengths = stops - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+class CrashTables:
+    """The crash fact table and person table of a merged frame"""
+
+    def __init__(self, crashes, persons, person_crash, crash_positions=None):
+        self.crashes = crashes
+        self.persons = persons
+        self.person_crash = person_crash
+        self.person_starts = np.searchsorted(person_crash, np.arange(len(crashes) + 1)).astype(person_crash.dtype)
+        # Merged row of each crash, for translating store row ranges; None = the same rows
+        self.crash_positions = crash_positions
+
+    @classmethod
+    def from_merged(cls, df, key=CRASH_KEY):
+        """
+        Split a merged frame. Without the key column every row is a crash of
+        its own, as is every row of a frame whose keys are all distinct.
+        """
+        person_cols = [c for c in df.columns if is_person_column(c)]
+        crash_cols = [c for c in df.columns if c not in person_cols]
+        if key in df.columns:
+            crash_of_row, first = _crash_rows(df[key])
+        else:
+            first = np.arange(len(df))
+        if len(first) == len(df):
+            return cls(_columns(df, crash_cols), _columns(df, person_cols), np.arange(len(df), dtype=np.uint32))
+
+        order = np.argsort(crash_of_row, kind='stable')
+        crashes = df.iloc[first, [df.columns.get_loc(c) for c in crash_cols]].reset_index(drop=True)
+        persons = df.iloc[order, [df.columns.get_loc(c) for c in person_cols]].reset_index(drop=True)
+        return cls(crashes, persons, crash_of_row[order].astype(np.uint32), first)
+
+    @property
+    def one_to_one(self):
+        """At most one person per crash: both tables have the merged rows"""
+        return len(self.persons) == len(self.crashes)
+
+    @property
+    def nbytes(self):
+        frames = sum(int(f.memory_usage(deep=True, index=False).sum()) for f in (self.crashes, self.persons))
+        return frames + self.person_crash.nbytes + self.person_starts.nbytes
+
+    def person_rows(self, crash_rows):
+        """Person rows of the given crash rows, crash by crash"""
+        crash_rows = np.asarray(crash_rows, dtype=np.int64)
+        starts = self.person_starts[crash_rows].astype(np.int64)
+        return _expand(starts, self.person_starts[crash_rows + 1].astype(np.int64))
+
+    def joined(self, columns, rows=None):
+        """
+        Merged-table rows for the given person rows (all when None): person
+        columns from the person table, the others from each person's crash.
+        """
+        if rows is None:
+            rows = np.arange(len(self.persons))
+        crash_rows = self.person_crash[rows]
+        data = {}
+        for col in columns:
+            if col in self.persons.columns:
+                data[col] = self.persons[col].take(rows).reset_index(drop=True)
+            else:
+                data[col] = self.crashes[col].take(crash_rows).reset_index(drop=True)
+        return pd.DataFrame(data)
+
+
+class CrashIndex(BitmapIndex):
+    """
+    BitmapIndex of the crash rows whose person predicates semi-join a person
+    table's bitmaps down to crashes. counts covers both tables, so
+    plan_filters() takes person columns as before (their counts are persons).
+    """
+
+    def __init__(self, tables, columns=INDEXED_COLUMNS):
+        super().__init__(tables.crashes, [c for c in columns if not is_person_column(c)])
+        self.tables = tables
+        self.persons = BitmapIndex(tables.persons, [c for c in columns if is_person_column(c)])
+        self.person_columns = set(self.persons.counts)
+        self.counts.update(self.persons.counts)
+        for outcome, (count_col, injury) in OUTCOME_PREDICATES.items():
+            if count_col in tables.crashes.columns and 'PERSON_INJURY' in tables.persons.columns:
+                mask = (tables.crashes[count_col] > 0).to_numpy()
+                mask[tables.person_crash[value_mask(tables.persons['PERSON_INJURY'], [injury])]] = True
+                self.outcomes[outcome] = _pack(mask)
+                self.outcome_counts[outcome] = int(mask.sum())
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.persons.nbytes
+
+    def semi_joined(self, plan):
+        """Whether a plan filters on person columns"""
+        return any(col in self.person_columns for col in plan['values'])
+
+    def _person_steps(self, plan):
+        return [step for step in plan['steps'] if step[0] in self.person_columns]
+
+    def _select_words(self, plan, first, last):
+        crash_plan = dict(plan, steps=[step for step in plan['steps'] if step[0] not in self.person_columns])
+        selection = super()._select_words(crash_plan, first, last)
+        person_steps = self._person_steps(plan)
+        # Person predicates go last: a semi-join costs more than ANDing bitmaps
+        if person_steps and (selection is None or selection.any()):
+            bits = self._semi_join(person_steps, first, last)
+            selection = bits if selection is None else selection & bits
+        return selection
+
+    def _semi_join(self, steps, first, last):
+        """Words first..last of the crashes with a person matching every step"""
+        start = first * 64
+        stop = min(last * 64, self.n_rows)
+        person_start, person_stop = (int(row) for row in self.tables.person_starts[[start, stop]])
+        person_first, person_last = person_start // 64, -(-person_stop // 64)
+        words = self.persons._select_words({'steps': steps}, person_first, person_last)
+        bits = np.unpackbits(words.view(np.uint8), bitorder='little')
+        rows = np.flatnonzero(bits) + person_first * 64
+        rows = rows[(rows >= person_start) & (rows < person_stop)]
+        mask = np.zeros((last - first) * 64, dtype=bool)
+        mask[self.tables.person_crash[rows].astype(np.int64) - start] = True
+        return _pack(mask)
+
+    def person_filter(self, plan):
+        """Packed person selection of a plan's person predicates, or None when it has none"""
+        steps = self._person_steps(plan)
+        if not steps:
+            return None
+        return self.persons._select_words({'steps': steps}, 0, self.persons.n_words)
+
+    def person_rows(self, crash_rows, person_selection=None):
+        """Person rows of the given crashes, only those in person_selection when given"""
+        rows = self.tables.person_rows(crash_rows)
+        if person_selection is not None:
+            rows = rows[self.persons.contains(person_selection, rows)]
+        return rows
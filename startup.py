@@ -0,0 +1,92 @@
+"""
+Background data loading for the dashboard.
+
+Loading and indexing the dataset takes a while, so it runs in a daemon thread
+started at import instead of blocking the server. The loader moves through
+three states:
+
+loading   the load function is running; progress() reports its current step
+ready     it returned; the dashboard serves data
+failed    it raised; the error is kept and reported
+
+status() is what /healthz and /readyz return and what the dashboard's
+loading banner shows.
+"""
+import threading
+import time
+
+from metrics import log
+
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class BackgroundLoader:
+    """Runs load(loader) once in a daemon thread and tracks its state"""
+
+    def __init__(self, load, steps):
+        self.load = load
+        self.steps = list(steps)
+        self.state = LOADING
+        self.step = None
+        self.done = 0
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.ready_event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, name='data-loader', daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.load(self)
+        except Exception as e:
+            log.exception(f"Error loading data: {e}")
+            with self.lock:
+                self.state = FAILED
+                self.error = f"{type(e).__name__}: {e}"
+                self.finished = time.time()
+        else:
+            with self.lock:
+                self.state = READY
+                self.step = None
+                self.done = len(self.steps)
+                self.finished = time.time()
+            log.info(f"Data ready in {self.finished - self.started:.1f}s")
+        finally:
+            self.ready_event.set()
+
+    def progress(self, step):
+        """Called by the load function when it starts one of its steps"""
+        with self.lock:
+            if self.step is not None:
+                self.done += 1
+            self.step = step
+        log.info(f"Startup: {step}...")
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def wait(self, timeout=None):
+        """Block until loading has finished (either way); True once ready"""
+        self.ready_event.wait(timeout)
+        return self.ready
+
+    def status(self):
+        with self.lock:
+            elapsed = (self.finished or time.time()) - self.started if self.started else 0.0
+            return {
+                'state': self.state,
+                'step': self.step,
+                'progress': round(self.done / len(self.steps), 2) if self.steps else 1.0,
+                'error': self.error,
+                'elapsed': round(elapsed, 1)
+            }